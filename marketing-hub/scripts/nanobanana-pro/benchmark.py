@@ -0,0 +1,183 @@
+#!/usr/bin/env python3
+"""
+Browser runtime benchmark for Gemini Image Generator
+Compares launch time, memory and success rate of the BROWSER_RUNTIMES
+
+For each runtime (optionally with and without BROWSER_LITE_ARGS) and each
+run, the authenticated profile is cloned without caches into a temporary
+directory, so every launch is equally cold and the source profile is
+never opened by a different browser version. Each run measures:
+
+- launch: seconds until the browser context exists
+- ready: seconds until Gemini is loaded and the prompt input is found
+- memory: PSS of the whole browser process tree after settling
+  (after the generations, if a prompt is given)
+- success: prompt input found (or, with --prompt, images generated)
+
+Results are printed as a table and saved to BENCHMARK_DIR.
+
+Usage:
+    python benchmark.py                                  # All runtimes, 3 runs each
+    python benchmark.py --runtimes chrome headless-shell --lite both
+    python benchmark.py --prompt "白背景のコーヒーカップ" --jobs 2   # Real generations
+"""
+
+import sys
+import json
+import time
+import argparse
+import tempfile
+from pathlib import Path
+from statistics import median
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import (
+    BROWSER_PROFILE_DIR,
+    STATE_FILE,
+    BROWSER_RUNTIMES,
+    BENCHMARK_DIR,
+    DATA_DIR
+)
+from profile_manager import copy_profile, profile_in_use
+
+
+def _median(values):
+    values = [v for v in values if v is not None]
+    return round(median(values), 2) if values else None
+
+
+def bench_run(playwright, runtime: str, lite: bool, source: Path, state_file: Path,
+              prompt: str = None, jobs: int = 0, settle: float = 5) -> dict:
+    """One cold launch (and optional generations) of a runtime on a fresh profile clone."""
+    from browser_utils import BrowserFactory, browser_memory
+    from image_generator import probe_ui, generate_with_context
+    from circuit_breaker import CircuitBreaker
+
+    run = {"runtime": runtime, "lite": lite, "launch": None, "ready": None,
+           "memory_mb": None, "ok": False, "generated": 0, "jobs": jobs}
+    with tempfile.TemporaryDirectory(dir=DATA_DIR) as tmp:
+        profile = Path(tmp) / "profile"
+        copy_profile(source, profile)
+
+        context = None
+        start = time.time()
+        try:
+            context = BrowserFactory.launch_persistent_context(
+                playwright, headless=True, user_data_dir=str(profile),
+                state_file=state_file, runtime=runtime, lite=lite)
+            run["launch"] = round(time.time() - start, 2)
+
+            page = context.pages[0] if context.pages else context.new_page()
+            run["ok"] = probe_ui(page)
+            if run["ok"]:
+                run["ready"] = round(time.time() - start, 2)
+
+            if prompt and run["ok"]:
+                # Private breaker: benchmark failures must not trip production jobs
+                breaker = CircuitBreaker(path=Path(tmp) / "circuit.json")
+                for i in range(jobs):
+                    generation = generate_with_context(
+                        context, prompt, str(Path(tmp) / f"bench-{i}.png"),
+                        breaker=breaker, job_id=f"bench-{runtime}-{i}")
+                    run["generated"] += 1 if generation else 0
+
+            time.sleep(settle)
+            memory = browser_memory(profile)
+            run["memory_mb"] = memory["total_mb"] if memory else None
+        except Exception as e:
+            run["error"] = str(e)
+            print(f"   ❌ {runtime}: {e}")
+        finally:
+            if context:
+                try:
+                    context.close()
+                except Exception:
+                    pass
+    return run
+
+
+def summarize(runs: list) -> dict:
+    jobs = sum(r["jobs"] for r in runs)
+    if jobs:
+        success = sum(r["generated"] for r in runs) / jobs
+    else:
+        success = sum(1 for r in runs if r["ok"]) / len(runs)
+    return {
+        "runtime": runs[0]["runtime"],
+        "lite": runs[0]["lite"],
+        "runs": len(runs),
+        "launch_p50": _median(r["launch"] for r in runs),
+        "ready_p50": _median(r["ready"] for r in runs),
+        "memory_mb_p50": _median(r["memory_mb"] for r in runs),
+        "success_rate": round(success, 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Benchmark browser runtimes for Gemini automation",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python benchmark.py
+  python benchmark.py --runtimes chromium headless-shell --lite both --runs 5
+  python benchmark.py --prompt "sunset over the sea" --jobs 3
+        """
+    )
+    parser.add_argument("--runtimes", nargs="+", choices=BROWSER_RUNTIMES, default=BROWSER_RUNTIMES,
+                        help="Runtimes to compare (default: all)")
+    parser.add_argument("--lite", choices=["off", "on", "both"], default="off",
+                        help="Benchmark with BROWSER_LITE_ARGS (default: off)")
+    parser.add_argument("--runs", type=int, default=3, help="Cold launches per runtime (default: 3)")
+    parser.add_argument("--prompt", help="Also generate images to measure the real success rate")
+    parser.add_argument("--jobs", type=int, default=1, help="Generations per run with --prompt")
+    parser.add_argument("--settle", type=float, default=5,
+                        help="Seconds to wait before sampling memory (default: 5)")
+    parser.add_argument("--profile", type=Path, default=BROWSER_PROFILE_DIR,
+                        help="Authenticated profile to clone (default: BROWSER_PROFILE_DIR)")
+    parser.add_argument("--state-file", type=Path, default=STATE_FILE,
+                        help="Storage state for cookie re-injection (default: STATE_FILE)")
+    args = parser.parse_args()
+
+    if not args.profile.exists():
+        print(f"❌ Profile not found: {args.profile}")
+        return 1
+    if profile_in_use(args.profile):
+        print("⚠️  Profile is in use; cloning a live profile may copy half-written files")
+
+    from patchright.sync_api import sync_playwright
+
+    variants = [(runtime, lite) for runtime in args.runtimes
+                for lite in {"off": [False], "on": [True], "both": [False, True]}[args.lite]]
+    jobs = args.jobs if args.prompt else 0
+    summaries = []
+    all_runs = []
+    with sync_playwright() as playwright:
+        for runtime, lite in variants:
+            label = f"{runtime}{' (lite)' if lite else ''}"
+            print(f"⏱  {label}: {args.runs} runs")
+            runs = [bench_run(playwright, runtime, lite, args.profile, args.state_file,
+                              args.prompt, jobs, args.settle)
+                    for _ in range(args.runs)]
+            all_runs += runs
+            summaries.append(summarize(runs))
+
+    print(f"\n{'runtime':<22}{'launch s':>10}{'ready s':>10}{'memory MB':>12}{'success':>10}")
+    for s in summaries:
+        label = f"{s['runtime']}{' (lite)' if s['lite'] else ''}"
+        print(f"{label:<22}{s['launch_p50'] or '-':>10}{s['ready_p50'] or '-':>10}"
+              f"{s['memory_mb_p50'] or '-':>12}{s['success_rate']:>10.0%}")
+
+    BENCHMARK_DIR.mkdir(parents=True, exist_ok=True)
+    out = BENCHMARK_DIR / f"runtime-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    with open(out, 'w') as f:
+        json.dump({"summaries": summaries, "runs": all_runs, "prompt": args.prompt}, f,
+                  indent=2, ensure_ascii=False)
+    print(f"\n✓ Saved: {out}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,22 +4,37 @@ Handles browser launching with persistent context and anti-detection features
 Based on NotebookLM skill patterns
 """
 
+import os
 import json
 import time
 import random
+import shutil
+import hashlib
+from contextlib import contextmanager
 from typing import Optional
 from pathlib import Path
 
-from patchright.sync_api import Playwright, BrowserContext, Page
+from patchright.sync_api import Playwright, BrowserContext, Page, sync_playwright
 
 from config import (
     BROWSER_PROFILE_DIR,
     STATE_FILE,
     BROWSER_ARGS,
+    BROWSER_RUNTIME,
+    BROWSER_LITE,
+    BROWSER_LITE_ARGS,
     USER_AGENT,
+    PROFILE_CACHE_DIRS,
+    PROFILE_TMPFS_CACHE,
+    TMPFS_CACHE_ROOT,
+    BROWSER_RECYCLE_JOBS,
+    BROWSER_RECYCLE_RSS_MB,
+    BROWSER_RECYCLE_IDLE,
+    BROWSER_STATS_DIR,
     TYPING_WPM_MIN,
     TYPING_WPM_MAX
 )
+import profiler
 
 
 class BrowserFactory:
@@ -29,7 +44,11 @@ class BrowserFactory:
     def launch_persistent_context(
         playwright: Playwright,
         headless: bool = True,
-        user_data_dir: Optional[str] = None
+        user_data_dir: Optional[str] = None,
+        state_file: Optional[Path] = None,
+        tmpfs_cache: Optional[bool] = None,
+        runtime: Optional[str] = None,
+        lite: Optional[bool] = None
     ) -> BrowserContext:
         """
         Launch a persistent browser context with anti-detection features.
@@ -43,6 +62,10 @@ class BrowserFactory:
             playwright: Playwright instance
             headless: Whether to run in headless mode
             user_data_dir: Directory for browser profile (default: BROWSER_PROFILE_DIR)
+            state_file: Storage state to re-inject cookies from (default: STATE_FILE)
+            tmpfs_cache: Keep disposable caches on tmpfs (default: PROFILE_TMPFS_CACHE)
+            runtime: "chrome", "chromium" or "headless-shell" (default: BROWSER_RUNTIME)
+            lite: Add BROWSER_LITE_ARGS (default: BROWSER_LITE)
 
         Returns:
             BrowserContext: Configured browser context
@@ -55,34 +78,94 @@ class BrowserFactory:
 
         print(f"   → Using browser profile: {user_data_dir}")
 
+        args = list(BROWSER_ARGS)
+        if lite if lite is not None else BROWSER_LITE:
+            args += BROWSER_LITE_ARGS
+        if tmpfs_cache is None:
+            tmpfs_cache = PROFILE_TMPFS_CACHE
+        if tmpfs_cache:
+            args += BrowserFactory._redirect_caches_to_tmpfs(Path(user_data_dir))
+
         # Launch persistent context (key difference from regular launch!)
         context = playwright.chromium.launch_persistent_context(
             user_data_dir=user_data_dir,
-            channel="chrome",  # Use real Chrome for better compatibility
+            channel=BrowserFactory._channel(runtime or BROWSER_RUNTIME, headless),
             headless=headless,
             no_viewport=True,  # Allow dynamic viewport
             ignore_default_args=["--enable-automation"],
             user_agent=USER_AGENT,
-            args=BROWSER_ARGS
+            args=args
         )
 
         # Inject cookies from state.json if available (Playwright bug workaround)
         # See: https://github.com/microsoft/playwright/issues/36139
-        BrowserFactory._inject_cookies(context)
+        BrowserFactory._inject_cookies(context, state_file)
 
         return context
 
     @staticmethod
-    def _inject_cookies(context: BrowserContext):
+    def _channel(runtime: str, headless: bool) -> Optional[str]:
+        """
+        Playwright channel for a runtime.
+
+        "chrome" is the installed Google Chrome and "chromium" the bundled
+        full Chromium. Without a channel, headless launches use the
+        stripped-down chromium-headless-shell.
+        """
+        if runtime == "chrome":
+            return "chrome"
+        if runtime == "chromium":
+            return "chromium"
+        if runtime == "headless-shell":
+            if headless:
+                return None
+            print("   ⚠️  headless-shell cannot show a window, using bundled Chromium")
+            return "chromium"
+        raise ValueError(f"Unknown browser runtime: {runtime}")
+
+    @staticmethod
+    def _redirect_caches_to_tmpfs(user_data_dir: Path) -> list:
+        """
+        Move disposable cache directories of a profile onto tmpfs.
+
+        Cache directories under Default/ are replaced by symlinks into
+        TMPFS_CACHE_ROOT, so they never touch the disk and vanish on reboot.
+
+        Returns:
+            list: Extra Chrome arguments (HTTP disk cache location)
+        """
+        cache_root = TMPFS_CACHE_ROOT / profile_key(user_data_dir)
+        cache_root.mkdir(parents=True, exist_ok=True)
+
+        default_dir = user_data_dir / "Default"
+        default_dir.mkdir(parents=True, exist_ok=True)
+        for name in PROFILE_CACHE_DIRS:
+            link = default_dir / name
+            target = cache_root / name
+            target.mkdir(exist_ok=True)
+            if link.is_symlink():
+                continue
+            if link.exists():
+                shutil.rmtree(link, ignore_errors=True)
+            link.symlink_to(target, target_is_directory=True)
+
+        return [f"--disk-cache-dir={cache_root / 'Cache'}"]
+
+    @staticmethod
+    def _inject_cookies(context: BrowserContext, state_file: Optional[Path] = None):
         """
         Inject cookies from state.json if available.
 
         This is a workaround for Playwright bug where session cookies
         (expires=-1) don't persist automatically in user_data_dir.
+        Cloned worker profiles pass their own state file here.
         """
-        if STATE_FILE.exists():
+        if state_file is None:
+            state_file = STATE_FILE
+
+        if state_file.exists():
             try:
-                with open(STATE_FILE, 'r') as f:
+                with open(state_file, 'r') as f:
                     state = json.load(f)
                     if 'cookies' in state and len(state['cookies']) > 0:
                         context.add_cookies(state['cookies'])
@@ -92,13 +175,283 @@ class BrowserFactory:
                 pass
 
 
+def profile_key(user_data_dir) -> str:
+    """Short stable name for a profile directory."""
+    return hashlib.sha1(str(Path(user_data_dir).resolve()).encode()).hexdigest()[:12]
+
+
+def _proc_table() -> dict:
+    """pid -> (ppid, argv) for every readable process (Linux /proc)."""
+    table = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat", 'r') as f:
+                # comm may contain spaces; ppid is the 2nd field after ")"
+                ppid = int(f.read().rsplit(")", 1)[1].split()[1])
+            with open(f"/proc/{entry}/cmdline", 'rb') as f:
+                argv = f.read().decode(errors="replace").split("\0")
+        except (OSError, ValueError, IndexError):
+            continue
+        table[int(entry)] = (ppid, argv)
+    return table
+
+
+def _process_memory_kb(pid: int) -> int:
+    """Proportional set size of a process (shared pages split), falling back to RSS."""
+    for path, field in ((f"/proc/{pid}/smaps_rollup", "Pss:"), (f"/proc/{pid}/status", "VmRSS:")):
+        try:
+            with open(path, 'r') as f:
+                for line in f:
+                    if line.startswith(field):
+                        return int(line.split()[1])
+        except (OSError, ValueError):
+            continue
+    return 0
+
+
+def browser_memory(user_data_dir) -> Optional[dict]:
+    """
+    Memory of the Chrome process tree using a profile.
+
+    Finds the browser process by its --user-data-dir argument and sums the
+    PSS of it and all descendants (renderers, GPU, utility processes).
+
+    Returns:
+        dict: {"processes", "total_mb", "by_type": {type: mb}, "largest_renderer_mb"},
+              or None where /proc is unavailable
+    """
+    if not os.path.isdir("/proc"):
+        return None
+
+    target = Path(user_data_dir).resolve()
+    table = _proc_table()
+    children = {}
+    roots = []
+    for pid, (ppid, argv) in table.items():
+        children.setdefault(ppid, []).append(pid)
+        for arg in argv:
+            if arg.startswith("--user-data-dir=") and not any(a.startswith("--type=") for a in argv):
+                if Path(arg.split("=", 1)[1]).resolve() == target:
+                    roots.append(pid)
+                break
+
+    by_type = {}
+    largest_renderer = 0
+    count = 0
+    stack = list(roots)
+    while stack:
+        pid = stack.pop()
+        stack.extend(children.get(pid, []))
+        argv = table[pid][1]
+        kind = next((a.split("=", 1)[1] for a in argv if a.startswith("--type=")), "browser")
+        kb = _process_memory_kb(pid)
+        by_type[kind] = by_type.get(kind, 0) + kb
+        if kind == "renderer":
+            largest_renderer = max(largest_renderer, kb)
+        count += 1
+
+    return {
+        "processes": count,
+        "total_mb": round(sum(by_type.values()) / 1024, 1),
+        "by_type": {kind: round(kb / 1024, 1) for kind, kb in by_type.items()},
+        "largest_renderer_mb": round(largest_renderer / 1024, 1)
+    }
+
+
+class ManagedBrowser:
+    """
+    Long-lived browser context for worker processes, recycled between jobs.
+
+    A Chrome driving Gemini grows with every conversation. After each job the
+    context is closed (and relaunched lazily for the next one) when it has
+    served max_jobs jobs, its process tree uses more than max_memory_mb, or
+    it sat idle longer than max_idle seconds. Jobs run one at a time through
+    job(), so closing between jobs never interrupts work.
+
+    Memory and recycling stats are written to BROWSER_STATS_DIR/<profile>.json
+    after every job.
+    """
+
+    def __init__(self, headless: bool = True, user_data_dir: Optional[str] = None,
+                 state_file: Optional[Path] = None,
+                 max_jobs: int = BROWSER_RECYCLE_JOBS,
+                 max_memory_mb: float = BROWSER_RECYCLE_RSS_MB,
+                 max_idle: float = BROWSER_RECYCLE_IDLE,
+                 stats_dir: Path = BROWSER_STATS_DIR,
+                 **launch_options):
+        self.headless = headless
+        self.user_data_dir = str(user_data_dir or BROWSER_PROFILE_DIR)
+        self.state_file = state_file
+        self.max_jobs = max_jobs
+        self.max_memory_mb = max_memory_mb
+        self.max_idle = max_idle
+        self.stats_path = Path(stats_dir) / f"{profile_key(self.user_data_dir)}.json"
+        self.launch_options = launch_options
+
+        self._playwright = None
+        self._context = None
+        self._closing = False
+        self.launched_at = None
+        self.last_launch_seconds = None
+        self.last_used = time.time()
+        self.jobs_since_launch = 0
+        self.total_jobs = 0
+        self.launches = 0
+        self.recycles = {}  # reason -> count
+        self.last_memory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+
+    @property
+    def running(self) -> bool:
+        return self._context is not None
+
+    def start(self) -> BrowserContext:
+        """Return the live context, launching it if needed."""
+        if self._context is not None:
+            return self._context
+        if self._playwright is None:
+            self._playwright = sync_playwright().start()
+
+        start = time.time()
+        context = BrowserFactory.launch_persistent_context(
+            self._playwright,
+            headless=self.headless,
+            user_data_dir=self.user_data_dir,
+            state_file=self.state_file,
+            **self.launch_options
+        )
+        context.on("close", lambda _: self._on_close())
+        self._context = context
+        self.launched_at = time.time()
+        self.last_used = self.launched_at  # Not idle right after (re)launch
+        self.last_launch_seconds = round(self.launched_at - start, 2)
+        self.jobs_since_launch = 0
+        self.launches += 1
+        return context
+
+    def _on_close(self):
+        # Chrome exited without us closing it (crash, OOM kill)
+        if not self._closing and self._context is not None:
+            print("   ⚠️  Browser closed unexpectedly, will relaunch")
+            self._context = None
+            self.recycles["crash"] = self.recycles.get("crash", 0) + 1
+
+    @contextmanager
+    def job(self):
+        """Run one job on the context; recycle afterwards if the policy says so."""
+        if self.recycle_reason() == "idle":
+            self.close("idle")
+        context = self.start()
+        try:
+            yield context
+        finally:
+            self.jobs_since_launch += 1
+            self.total_jobs += 1
+            self.last_used = time.time()
+            self.maybe_recycle()
+
+    def recycle_reason(self) -> Optional[str]:
+        """Why the running browser should be recycled now, or None."""
+        if self._context is None:
+            return None
+        if self.max_jobs and self.jobs_since_launch >= self.max_jobs:
+            return "jobs"
+        if self.max_idle and time.time() - self.last_used > self.max_idle:
+            return "idle"
+        self.last_memory = self.memory()
+        if (self.max_memory_mb and self.last_memory
+                and self.last_memory["total_mb"] > self.max_memory_mb):
+            return "memory"
+        return None
+
+    def maybe_recycle(self) -> Optional[str]:
+        """Close the browser if due (between jobs or from an idle loop)."""
+        reason = self.recycle_reason()
+        if reason:
+            memory = self.last_memory or {}
+            print(f"   ↻ Recycling browser ({reason}: {self.jobs_since_launch} jobs, "
+                  f"{memory.get('total_mb', '?')} MB)")
+            self.close(reason)
+        self.export_stats()
+        return reason
+
+    def memory(self) -> Optional[dict]:
+        return browser_memory(self.user_data_dir) if self._context is not None else None
+
+    def close(self, reason: Optional[str] = None):
+        """Drain the context: close its pages, then the browser (flushes the profile)."""
+        if self._context is None:
+            return
+        self._closing = True
+        try:
+            for page in list(self._context.pages):
+                try:
+                    page.close()
+                except Exception:
+                    pass
+            self._context.close()
+        except Exception:
+            pass
+        finally:
+            self._context = None
+            self._closing = False
+        if reason:
+            self.recycles[reason] = self.recycles.get(reason, 0) + 1
+
+    def shutdown(self):
+        """Close the browser and stop Playwright."""
+        self.close()
+        if self._playwright is not None:
+            try:
+                self._playwright.stop()
+            except Exception:
+                pass
+            self._playwright = None
+        self.export_stats()
+
+    def stats(self) -> dict:
+        return {
+            "profile": self.user_data_dir,
+            "pid": os.getpid(),
+            "running": self.running,
+            "uptime": round(time.time() - self.launched_at, 1) if self.running else None,
+            "jobs_since_launch": self.jobs_since_launch,
+            "total_jobs": self.total_jobs,
+            "launches": self.launches,
+            "last_launch_seconds": self.last_launch_seconds,
+            "recycles": self.recycles,
+            "memory": self.last_memory if self.running else None,
+            "limits": {"jobs": self.max_jobs, "memory_mb": self.max_memory_mb,
+                       "idle": self.max_idle},
+            "updated_at": time.time()
+        }
+
+    def export_stats(self):
+        """Write stats() to the profile's JSON file (best effort)."""
+        try:
+            self.stats_path.parent.mkdir(parents=True, exist_ok=True)
+            tmp = self.stats_path.with_suffix(".tmp")
+            with open(tmp, 'w') as f:
+                json.dump(self.stats(), f, indent=2)
+            os.replace(tmp, self.stats_path)
+        except OSError as e:
+            print(f"   ⚠️  Could not write browser stats: {e}")
+
+
 class StealthUtils:
     """Utilities for human-like browser interactions"""
 
     @staticmethod
     def random_delay(min_ms: int = 100, max_ms: int = 500):
         """Add random delay to mimic human behavior"""
-        time.sleep(random.uniform(min_ms / 1000, max_ms / 1000))
+        profiler.sleep(random.uniform(min_ms / 1000, max_ms / 1000))
 
     @staticmethod
     def human_type(page: Page, selector: str, text: str,
@@ -132,7 +485,7 @@ class StealthUtils:
             element.type(char)
             # Add random variation (±30%)
             delay = base_delay * random.uniform(0.7, 1.3)
-            time.sleep(delay / 1000)
+            profiler.sleep(delay / 1000)
 
     @staticmethod
     def scroll_slowly(page: Page, amount: int = 300):
@@ -0,0 +1,88 @@
+"""
+Cooperative cancellation for Gemini Image Generator
+Stops a job at the next safe point instead of letting it run out its timeout
+
+A CancelToken is handed down to generate_with_context. The wait loop,
+navigation, retry backoff and the singleflight/queue waits check it at
+least every POLL_INTERVAL seconds and raise
+GenerationError(CANCELLED). The generator then stops Gemini's
+in-progress response and gives the tab back to the standby pool, so the
+worker is free for the next job right away.
+
+Sources of cancellation:
+- CLI (generate.py): SIGTERM/SIGINT, sent by route.ts when its timer fires
+  or the client disconnects (install_signal_handlers). A second signal
+  stops the process the hard way.
+- Queue/workers: cancel by job id (`python job_queue.py cancel <id>`,
+  `python coordination.py cancel <id>`); the worker's token polls the
+  queue's cancel flag.
+
+Cancelled results carry "cancelled": true and are never published to
+singleflight waiters.
+"""
+
+import signal
+import threading
+import time
+from typing import Callable, Optional
+
+from failures import FailureKind, GenerationError
+
+# Longest a blocking wait goes without checking the token (seconds)
+POLL_INTERVAL = 0.5
+
+
+class CancelToken:
+    """Cancellation flag, set locally or polled from an external source"""
+
+    def __init__(self, poll: Optional[Callable[[], bool]] = None, poll_interval: float = 1.0):
+        self._event = threading.Event()
+        self._poll = poll
+        self._poll_interval = poll_interval
+        self._polled_at = 0.0
+        self.reason = None
+
+    def cancel(self, reason: str = "cancelled"):
+        if not self._event.is_set():
+            self.reason = reason
+            self._event.set()
+
+    @property
+    def cancelled(self) -> bool:
+        if self._event.is_set():
+            return True
+        if self._poll and time.time() - self._polled_at >= self._poll_interval:
+            self._polled_at = time.time()
+            try:
+                if self._poll():
+                    self.cancel("cancel requested")
+            except Exception as e:
+                print(f"   ⚠️  Cancellation check failed: {e}")
+        return self._event.is_set()
+
+    def check(self):
+        """Raise GenerationError(CANCELLED) if the job was cancelled."""
+        if self.cancelled:
+            raise GenerationError(FailureKind.CANCELLED, f"Cancelled ({self.reason})")
+
+    def wait(self, seconds: float) -> bool:
+        """time.sleep() that a cancellation cuts short. Returns True if cancelled."""
+        end = time.time() + seconds
+        while not self.cancelled:
+            remaining = end - time.time()
+            if remaining <= 0:
+                return False
+            self._event.wait(min(POLL_INTERVAL, remaining))
+        return True
+
+
+def install_signal_handlers(token: CancelToken):
+    """Turn SIGTERM/SIGINT into token.cancel(); a second signal exits at once."""
+    def handle(signum, frame):
+        if token.cancelled:
+            raise KeyboardInterrupt
+        print(f"   ⏹ Received {signal.Signals(signum).name}, cancelling...")
+        token.cancel(signal.Signals(signum).name)
+
+    signal.signal(signal.SIGTERM, handle)
+    signal.signal(signal.SIGINT, handle)
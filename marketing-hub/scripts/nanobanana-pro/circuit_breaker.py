@@ -0,0 +1,197 @@
+#!/usr/bin/env python3
+"""
+Circuit breaker for Gemini Image Generator
+Fails fast while the Gemini UI is broken instead of tying up workers
+
+After CIRCUIT_FAILURE_THRESHOLD consecutive structural failures (input not
+found, no response ever appearing, a finished response without a matching
+image) the circuit opens and new jobs are rejected immediately. Only a
+successful generation resets the count; declines, slow jobs and failed
+downloads say nothing about the selectors and leave it alone.
+
+After CIRCUIT_COOLDOWN seconds one job is let through as a half-open probe:
+it loads Gemini and checks the image-mode chip and the input field, then
+runs its own generation to check the image selectors. Only probe_result()
+closes the circuit; a structural failure anywhere in the probe keeps it
+open for another cooldown.
+
+State is shared by all generator processes through CIRCUIT_FILE.
+
+Usage:
+    python circuit_breaker.py status    # Show circuit state
+    python circuit_breaker.py reset     # Force the circuit closed
+"""
+
+import sys
+import os
+import json
+import time
+import argparse
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Optional
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import (
+    CIRCUIT_FILE,
+    CIRCUIT_FAILURE_THRESHOLD,
+    CIRCUIT_COOLDOWN,
+    CIRCUIT_PROBE_TIMEOUT
+)
+from failures import FailureKind
+
+# Failures that mean the page structure no longer matches our selectors
+STRUCTURAL_FAILURES = {FailureKind.INPUT_NOT_FOUND, FailureKind.NO_RESPONSE,
+                       FailureKind.NO_IMAGE}
+
+
+class CircuitBreaker:
+    """File-backed circuit breaker shared across processes"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    PROBE = "probe"  # allow() result: caller must run the half-open probe
+
+    def __init__(self, path: Path = CIRCUIT_FILE,
+                 threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+                 cooldown: float = CIRCUIT_COOLDOWN):
+        self.path = Path(path)
+        self.lock_path = self.path.with_suffix(".lock")
+        self.threshold = threshold
+        self.cooldown = cooldown
+
+    @contextmanager
+    def _locked(self):
+        """Exclusive access to the state file; yields the state dict to mutate."""
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.lock_path, 'w') as lock:
+            try:
+                import fcntl
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            except ImportError:
+                pass  # No cross-process locking on this platform
+
+            state = self._read()
+            yield state
+            tmp = self.path.with_suffix(".tmp")
+            with open(tmp, 'w') as f:
+                json.dump(state, f, indent=2)
+            os.replace(tmp, self.path)
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {"state": self.CLOSED, "consecutive": 0}
+
+    def status(self) -> dict:
+        state = self._read()
+        if state.get("state") == self.OPEN:
+            state["retry_after"] = max(0, round(state.get("open_until", 0) - time.time()))
+        return state
+
+    def allow(self) -> str:
+        """
+        Decide whether a new job may run.
+
+        Returns:
+            str: CLOSED (run normally), PROBE (run the half-open probe first)
+                 or OPEN (reject immediately)
+        """
+        with self._locked() as state:
+            if state.get("state", self.CLOSED) == self.CLOSED:
+                return self.CLOSED
+
+            now = time.time()
+            if now < state.get("open_until", 0):
+                return self.OPEN
+
+            # Half-open: exactly one probe at a time, unless the prober died
+            probe_started = state.get("probe_started", 0)
+            if probe_started and now - probe_started < CIRCUIT_PROBE_TIMEOUT:
+                return self.OPEN
+
+            state["probe_started"] = now
+            state["probe_pid"] = os.getpid()
+            return self.PROBE
+
+    def probe_result(self, ok: bool):
+        """Close the circuit after a good probe, or re-open it for another cooldown."""
+        with self._locked() as state:
+            if ok:
+                print("   ✓ Circuit probe succeeded, closing circuit")
+                state.clear()
+                state.update({"state": self.CLOSED, "consecutive": 0})
+            else:
+                print(f"   ⚠️  Circuit probe failed, staying open for {self.cooldown}s")
+                self._open(state, "probe failed")
+
+    def probe_abandoned(self):
+        """Let the next job probe at once (this process's probe ended without a verdict)."""
+        with self._locked() as state:
+            if state.get("probe_pid") == os.getpid():
+                state.pop("probe_started", None)
+                state.pop("probe_pid", None)
+
+    def record(self, failure: Optional[FailureKind]):
+        """
+        Record the outcome of an attempt (None = success).
+
+        Never changes OPEN/CLOSED by success alone: an open circuit only
+        closes through probe_result().
+        """
+        if failure is not None and failure not in STRUCTURAL_FAILURES:
+            return  # Says nothing about the selectors either way
+
+        with self._locked() as state:
+            if failure is None:
+                if state.get("consecutive"):
+                    state["consecutive"] = 0
+                    state.pop("last_failure", None)
+                return
+
+            state["consecutive"] = state.get("consecutive", 0) + 1
+            state["last_failure"] = failure.value
+            if state.get("state", self.CLOSED) == self.CLOSED and state["consecutive"] >= self.threshold:
+                print(f"⚠️  {state['consecutive']} structural failures in a row, opening circuit")
+                self._open(state, failure.value)
+
+    def is_open(self) -> bool:
+        state = self._read()
+        return state.get("state") == self.OPEN and time.time() < state.get("open_until", 0)
+
+    def reset(self):
+        with self._locked() as state:
+            state.clear()
+            state.update({"state": self.CLOSED, "consecutive": 0})
+
+    def _open(self, state: dict, reason: str):
+        now = time.time()
+        state["state"] = self.OPEN
+        state["reason"] = reason
+        state["opened_at"] = now
+        state["open_until"] = now + self.cooldown
+        state.pop("probe_started", None)
+        state.pop("probe_pid", None)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the generator circuit breaker")
+    parser.add_argument("action", choices=["status", "reset"], help="Action to perform")
+    args = parser.parse_args()
+
+    breaker = CircuitBreaker()
+    if args.action == "reset":
+        breaker.reset()
+        print("✓ Circuit closed")
+        return 0
+
+    print(json.dumps(breaker.status(), indent=2))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
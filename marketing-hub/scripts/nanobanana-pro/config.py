@@ -11,8 +11,83 @@ DATA_DIR = SKILL_ROOT / "data"
 BROWSER_PROFILE_DIR = DATA_DIR / "browser_profile"
 STATE_FILE = DATA_DIR / "state.json"
 AUTH_INFO_FILE = DATA_DIR / "auth_info.json"
+
+# Worker profiles (cloned from an authenticated "golden" snapshot)
+GOLDEN_PROFILE_DIR = DATA_DIR / "golden_profile"
+WORKER_PROFILES_DIR = DATA_DIR / "worker_profiles"
+
+# Disposable profile content skipped when cloning (directory names, any depth)
+PROFILE_CACHE_DIRS = [
+    "Cache",
+    "Code Cache",
+    "GPUCache",
+    "GrShaderCache",
+    "GraphiteDawnCache",
+    "DawnCache",
+    "ShaderCache",
+    "Service Worker",
+    "Crashpad",
+    "BrowserMetrics",
+    "component_crx_cache",
+    "optimization_guide_model_store",
+]
+# Per-process lock files that must never be copied between profiles
+PROFILE_LOCK_FILES = ["SingletonLock", "SingletonCookie", "SingletonSocket"]
+
+# Profile compaction keeps only auth-relevant storage (paths relative to the profile)
+PROFILE_KEEP_PATHS = [
+    "Local State",
+    "Default/Preferences",
+    "Default/Secure Preferences",
+    "Default/Cookies",
+    "Default/Cookies-journal",
+    "Default/Network",  # Cookies live here since Chrome 96
+    "Default/Local Storage",
+    "Default/Session Storage",
+    "Default/IndexedDB",
+    "Default/Login Data",
+    "Default/Login Data-journal",
+    "Default/Web Data",
+    "Default/Web Data-journal",
+]
+PROFILE_MAINTENANCE_LOG = DATA_DIR / "profile_maintenance.jsonl"
+
+# Keep disposable caches on tmpfs (RAM) instead of in the profile directory
+PROFILE_TMPFS_CACHE = False
+TMPFS_CACHE_ROOT = Path("/dev/shm/nanobanana-cache")
 OUTPUT_DIR = Path(__file__).parent.parent.parent / "public" / "uploads" / "ai-generated"
 
+# Image store (content-addressed dedup + retention for OUTPUT_DIR)
+IMAGE_STORE_DB = DATA_DIR / "image_store.db"
+BLOB_DIR = OUTPUT_DIR / ".blobs"  # Must share a filesystem with OUTPUT_DIR (hardlinks)
+OUTPUT_MAX_BYTES = 2 * 1024 ** 3  # Disk budget for generated images (2 GiB)
+RETENTION_BATCH = 100  # Max blobs evicted per SQL round trip
+RETENTION_GRACE = 600  # Images created or served this recently are never evicted (URL still in flight)
+ALIAS_RETENTION = 86400  # A filename served this recently keeps its image, even over budget (URL handed out)
+RETENTION_INTERVAL = 300  # Seconds between retention passes (supervisor loop, standalone generate.py)
+
+# Image download: streamed in chunks to a temp file, validated and hashed, then renamed into place
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024  # Bytes per browser round trip and write
+IMAGE_MAX_BYTES = 64 * 1024 ** 2  # Abort downloads larger than this
+IMAGE_MIN_SIDE = 64  # Smaller images are placeholders or icons, not results
+IMAGE_MAX_PIXELS = 12000 * 12000  # Larger dimensions mean a corrupt header
+DOWNLOAD_PART_MAX_AGE = 3600  # Temp download files older than this are leftovers of a crash (swept by enforce)
+
+# Output storage: "local" (OUTPUT_DIR, served by Next.js) or "s3" (any S3-compatible
+# service, e.g. MinIO; requires boto3). Remote uploads run in the background.
+STORAGE_BACKEND = "local"
+S3_BUCKET = None
+S3_ENDPOINT_URL = None  # e.g. "http://localhost:9000" for MinIO; None = AWS
+S3_PREFIX = "ai-generated/"
+S3_PUBLIC_URL = None  # Base URL browsers load images from (CDN); default: endpoint/bucket
+STORAGE_UPLOAD_WORKERS = 4  # Concurrent uploads per process
+STORAGE_MULTIPART_THRESHOLD = 16 * 1024 * 1024  # Files at least this big use multipart upload
+STORAGE_PART_SIZE = 8 * 1024 * 1024  # Multipart part size (S3 minimum: 5 MiB)
+STORAGE_UPLOAD_RETRIES = 5  # Attempts per upload before it waits in the spool
+STORAGE_RETRY_AFTER = 300  # Seconds before a spooled upload that ran out of retries is tried again
+STORAGE_SPOOL_DIR = DATA_DIR / "upload_spool"  # Pending uploads (survive process exits)
+STORAGE_DRAIN_TIMEOUT = 60  # generate.py waits this long for its uploads after printing the result
+
 # Browser settings
 USER_AGENT = (
     "Mozilla/5.0 (Macintosh; Intel Mac OS X 10_15_7) "
@@ -31,10 +106,115 @@ BROWSER_ARGS = [
 GEMINI_URL = "https://gemini.google.com/"
 NANOBANANA_URL = "https://aistudio.google.com/generate-images"
 
+# Browser runtime (compare with benchmark.py before switching):
+#   "chrome"         - installed Google Chrome (most compatible, heaviest)
+#   "chromium"       - Playwright's bundled Chromium (`patchright install chromium`)
+#   "headless-shell" - chromium-headless-shell, headless only (lightest)
+BROWSER_RUNTIME = "chrome"
+BROWSER_RUNTIMES = ["chrome", "chromium", "headless-shell"]
+BROWSER_LITE = False  # Append BROWSER_LITE_ARGS to BROWSER_ARGS
+BROWSER_LITE_ARGS = [
+    "--disable-extensions",
+    "--disable-component-update",
+    "--disable-background-networking",
+    "--disable-default-apps",
+    "--disable-sync",
+    "--no-first-run",
+    "--mute-audio",
+    "--disable-features=Translate,MediaRouter,OptimizationHints,AutofillServerCommunication",
+    "--renderer-process-limit=2",
+]
+BENCHMARK_DIR = DATA_DIR / "benchmarks"
+
+# Browser recycling for long-running workers (checked between jobs)
+BROWSER_RECYCLE_JOBS = 50  # Relaunch after this many jobs
+BROWSER_RECYCLE_RSS_MB = 1500  # Relaunch when Chrome's processes use more than this (PSS)
+BROWSER_RECYCLE_IDLE = 600  # Close an idle browser after this many seconds
+BROWSER_STATS_DIR = DATA_DIR / "browser_stats"  # Memory/recycling stats per profile (JSON)
+
+# Standby pool: tabs kept in image mode with the input focused (supervisor workers)
+STANDBY_MAX_TABS = 2  # Per worker; 0 disables prewarming
+STANDBY_RATE_WINDOW = 300  # Seconds of job history for the arrival rate; no jobs in it = idle, pool empties
+STANDBY_MAX_AGE = 900  # Re-prepare standby tabs older than this (seconds)
+
 # Timeouts (in seconds)
 DEFAULT_TIMEOUT = 180
 AUTH_TIMEOUT = 600  # 10 minutes for authentication
 
+# Retries (per-class policies live in failures.RETRY_POLICIES)
+MAX_ATTEMPTS = 4  # Hard cap on attempts per job across all failure classes
+MIN_ATTEMPT_SECONDS = 30  # Don't start a retry with less budget than this
+
+# Job timings (latency from send to image, shared by all generator processes)
+TIMINGS_FILE = DATA_DIR / "timings.jsonl"
+TIMINGS_WINDOW = 200  # Recent jobs used for percentiles and throughput
+
+# Hedged requests: resubmit on a second tab when a job hits the latency tail
+HEDGE_ENABLED = False
+HEDGE_PERCENTILE = 90  # Hedge once a job is slower than this percentile
+HEDGE_MIN_SAMPLES = 20  # Recorded latencies needed before hedging starts
+HEDGE_MAX_FRACTION = 0.2  # Max share of recent jobs that may be hedged
+
+# Circuit breaker: fail fast while the Gemini UI doesn't match our selectors
+CIRCUIT_FILE = DATA_DIR / "circuit.json"
+CIRCUIT_FAILURE_THRESHOLD = 3  # Consecutive structural failures before opening
+CIRCUIT_COOLDOWN = 300  # Seconds open before a half-open probe
+CIRCUIT_PROBE_TIMEOUT = DEFAULT_TIMEOUT + 120  # A probe (UI check plus one generation) older than this is assumed dead
+RESPONSE_APPEAR_TIMEOUT = 45  # Seconds after sending for any response element to appear
+
+# Singleflight: identical in-flight prompts share one generation
+INFLIGHT_DIR = DATA_DIR / "inflight"
+INFLIGHT_RESULT_TTL = 600  # Seconds a published result/lock file is kept
+
+# Job scheduling: priority lanes, earliest deadline first within a lane
+QUEUE_DB = DATA_DIR / "queue.db"
+QUEUE_SLOTS = 1  # Jobs running at once on this host (>1 uses worker profiles per slot)
+QUEUE_DEFAULT_SERVICE_SECONDS = 120  # Job duration assumed until real ones are recorded
+QUEUE_HISTORY_SECONDS = 86400  # Finished jobs kept for stats and throughput estimates
+
+# Supervisor: one generator process (and browser) per worker profile
+SUPERVISOR_DIR = DATA_DIR / "supervisor"  # status.json + worker-N.json
+SUPERVISOR_WORKERS = 2  # Default worker count (each needs ~1-1.5 GB RAM and a core)
+SUPERVISOR_HEARTBEAT = 5  # Seconds between status updates
+SUPERVISOR_MAX_RESTART_DELAY = 60  # Cap for the crash-loop restart backoff
+
+# Multi-host coordination (see coordination.py); None = single host
+COORDINATION_BACKEND = None  # "sqlite" (shared filesystem) or "redis"
+COORDINATION_DB = DATA_DIR / "coordination.db"  # Must be on the shared filesystem for "sqlite"
+COORDINATION_REDIS_URL = "redis://localhost:6379/0"
+COORDINATION_PREFIX = "nanobanana"  # Redis key prefix
+COORDINATION_NODE = None  # Node name (default: hostname)
+COORDINATION_LEASE = 30  # Seconds a claimed job stays assigned without a heartbeat
+COORDINATION_NODE_TTL = 30  # Nodes silent for longer are not counted as capacity
+
+# Near-duplicate prompt reuse
+PROMPT_INDEX_DB = DATA_DIR / "prompt_index.db"
+PROMPT_REUSE_THRESHOLD = None  # e.g. 0.85 to reuse images of similar prompts (None = off)
+
+# Matrix generation (template x variable axes, see matrix.py)
+MATRIX_DIR = DATA_DIR / "matrix"  # Manifests
+MATRIX_MAX_COMBINATIONS = 1000  # Refuse larger grids (likely a typo in an axis)
+MATRIX_DEADLINE = 6 * 3600  # Seconds a grid's jobs may wait in the worker queue
+
+# Perceptual-hash index of generated images (requires Pillow)
+PHASH_INDEX_DB = DATA_DIR / "phash_index.db"
+PHASH_DUPLICATE_DISTANCE = 6  # Max differing bits (of 64) to count as near-duplicate
+
+# Failure flight recorder: rolling per-job buffers, written to disk only on failure
+FLIGHT_DIR = DATA_DIR / "flight"
+FLIGHT_MAX_BYTES = 200 * 1024 * 1024  # Oldest records are pruned beyond this
+FLIGHT_EVENTS = 300  # Console/network events kept per job
+FLIGHT_SNAPSHOTS = 4  # DOM + screenshot snapshots kept per job
+FLIGHT_TRACE = False  # Also record a Playwright trace (much heavier)
+FLIGHT_SUBMIT_SNAPSHOTS = False  # Also snapshot every submitted prompt (costs every job a DOM dump + screenshot)
+
+# Round-trip profiling: per-job reports of Playwright calls and stealth sleeps (see profiler.py)
+PROFILE_ENABLED = False
+PROFILE_DIR = DATA_DIR / "profiles"
+PROFILE_SAMPLING = False  # Also sample Python stacks (wall clock) during the job
+PROFILE_SAMPLE_INTERVAL = 0.005  # Seconds between stack samples
+PROFILE_MAX_REPORTS = 500  # Oldest reports are deleted beyond this
+
 # Stealth settings
 TYPING_WPM_MIN = 160
 TYPING_WPM_MAX = 240
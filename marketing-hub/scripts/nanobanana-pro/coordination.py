@@ -0,0 +1,770 @@
+#!/usr/bin/env python3
+"""
+Multi-host job coordination for Gemini Image Generator
+Lets generator nodes on several machines share one job queue
+
+With COORDINATION_BACKEND set, generate.py submits jobs to a shared backend
+and the supervisor of every node claims from it, so capacity is added by
+starting `supervisor.py run` on another machine.
+
+Backends:
+- "sqlite": one SQLite file (COORDINATION_DB) on a shared filesystem. Uses
+  a rollback journal, because WAL needs shared memory that NFS cannot
+  provide, and relies on working fcntl locks (NFSv4, or NFSv3 with lockd).
+- "redis": any Redis-protocol server. A client can be injected, so a local
+  stand-in (e.g. fakeredis) can replace the server in tests.
+
+Claimed jobs carry a lease of COORDINATION_LEASE seconds, renewed by the
+worker while the job runs (LeaseKeeper). Nodes heartbeat their capacity.
+When a node dies its leases run out and reap(), called by every node's
+supervisor, puts the jobs back in line, or fails them once they have
+been claimed MAX_CLAIMS times. Admission uses the combined capacity of
+live nodes with the same EDF simulation as job_queue.py.
+
+Images are written to the OUTPUT_DIR of the node that ran the job, so
+that directory must be shared (or the job stored elsewhere) for the web
+host to serve it.
+
+Cancelling a running job sets a flag that the worker running it polls,
+so the node that holds the job stops it, wherever it runs.
+
+Usage:
+    python coordination.py status     # Live nodes and jobs
+    python coordination.py reap       # Requeue jobs with expired leases now
+    python coordination.py cancel ID  # Cancel a queued or running job
+"""
+
+import sys
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import argparse
+import threading
+from abc import ABC, abstractmethod
+from pathlib import Path
+from typing import List, Optional
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import (
+    COORDINATION_BACKEND,
+    COORDINATION_DB,
+    COORDINATION_REDIS_URL,
+    COORDINATION_PREFIX,
+    COORDINATION_NODE,
+    COORDINATION_LEASE,
+    COORDINATION_NODE_TTL,
+    QUEUE_DEFAULT_SERVICE_SECONDS,
+    QUEUE_HISTORY_SECONDS
+)
+from job_queue import (
+    LANES,
+    DEFAULT_LANE,
+    QUEUED,
+    RUNNING,
+    DONE,
+    FAILED,
+    REJECTED,
+    EXPIRED,
+    CANCELLED,
+    CANCELLED_RESULT,
+    MAX_CLAIMS,
+    SERVICE_SAMPLES,
+    SERVICE_MIN_SAMPLES,
+    check_admission,
+    crashed_result,
+    finished_state
+)
+
+# Redis sorted-set score: lane first, then deadline (epoch seconds < 1e10)
+LANE_WEIGHT = 1e10
+
+
+def _text(value):
+    return value.decode() if isinstance(value, bytes) else value
+
+
+def _new_job(prompt: str, lane: str, deadline: float, job_id: Optional[str]) -> dict:
+    now = time.time()
+    return {
+        "id": job_id or uuid.uuid4().hex[:12],
+        "lane": LANES[lane],
+        "deadline": now + deadline,
+        "created_at": now,
+        "prompt": prompt
+    }
+
+
+class CoordinationBackend(ABC):
+    """Job queue shared by generator nodes; see the backends below"""
+
+    def __init__(self, node: Optional[str] = None, lease: float = COORDINATION_LEASE):
+        self.node = node or COORDINATION_NODE or socket.gethostname()
+        self.lease = lease
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def close(self):
+        pass
+
+    @abstractmethod
+    def submit(self, prompt: str, lane: str = DEFAULT_LANE, deadline: float = 300,
+               payload: Optional[dict] = None, job_id: Optional[str] = None) -> dict:
+        """Admit or reject a job; same contract as JobQueue.submit()."""
+        ...
+
+    @abstractmethod
+    def claim(self, worker: str) -> Optional[dict]:
+        """Lease the next job to a worker ({"id", "prompt", "deadline", "payload", ...})."""
+        ...
+
+    @abstractmethod
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        """Renew a lease. False if the worker no longer holds the job."""
+        ...
+
+    @abstractmethod
+    def finish(self, job_id: str, result: dict, worker: str) -> bool:
+        """
+        Record the result of the worker holding the job.
+
+        A worker whose lease was taken over is ignored, except with a
+        successful result while the job is still unfinished (the first
+        finished image wins). False if the result was not recorded.
+        """
+        ...
+
+    @abstractmethod
+    def get(self, job_id: str) -> Optional[dict]:
+        """Job state; "result" is the JSON string of the finished result."""
+        ...
+
+    @abstractmethod
+    def requeue(self, worker: str) -> int:
+        """Put a crashed worker's jobs back in line."""
+        ...
+
+    @abstractmethod
+    def cancel(self, job_id: str) -> Optional[str]:
+        """Cancel a job; same contract as JobQueue.cancel()."""
+        ...
+
+    @abstractmethod
+    def cancel_requested(self, job_id: str) -> bool:
+        """Whether the worker running job_id should stop."""
+        ...
+
+    @abstractmethod
+    def reap(self) -> int:
+        """Requeue (or fail) jobs whose lease ran out. Returns the number handled."""
+        ...
+
+    @abstractmethod
+    def node_heartbeat(self, capacity: int, info: Optional[dict] = None):
+        """Announce this node and how many jobs it runs at once."""
+        ...
+
+    @abstractmethod
+    def nodes(self) -> List[dict]:
+        """Nodes that sent a heartbeat within COORDINATION_NODE_TTL."""
+        ...
+
+    def capacity(self) -> int:
+        return sum(node["capacity"] for node in self.nodes())
+
+    def _admission(self, job: dict, service: float, running: List[float], queued: List[dict]):
+        capacity = self.capacity()
+        if not capacity:
+            return job["created_at"], "no generator nodes online"
+        return check_admission(job["created_at"], service, capacity, running, queued, job)
+
+
+class SQLiteBackend(CoordinationBackend):
+    """Coordination through one SQLite file on a shared filesystem"""
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS jobs (
+        id TEXT PRIMARY KEY,
+        lane INTEGER NOT NULL,
+        deadline REAL NOT NULL,
+        prompt TEXT NOT NULL,
+        payload TEXT,
+        state TEXT NOT NULL,
+        worker TEXT,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        cancel_requested INTEGER NOT NULL DEFAULT 0,
+        lease_until REAL,
+        created_at REAL NOT NULL,
+        started_at REAL,
+        finished_at REAL,
+        result TEXT
+    );
+    CREATE INDEX IF NOT EXISTS jobs_order ON jobs (state, lane, deadline, created_at);
+    CREATE INDEX IF NOT EXISTS jobs_lease ON jobs (state, lease_until);
+    CREATE TABLE IF NOT EXISTS nodes (
+        node TEXT PRIMARY KEY,
+        capacity INTEGER NOT NULL,
+        info TEXT,
+        updated_at REAL NOT NULL
+    );
+    """
+
+    def __init__(self, db_path: Path = COORDINATION_DB, **kwargs):
+        super().__init__(**kwargs)
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        # Shared with the LeaseKeeper thread; every access holds self._lock
+        self.db = sqlite3.connect(str(db_path), timeout=60, isolation_level=None,
+                                  check_same_thread=False)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=DELETE")
+        self.db.executescript(self.SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        if "cancel_requested" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+        self._lock = threading.RLock()
+
+    def close(self):
+        self.db.close()
+
+    def _run(self, fn):
+        """Run fn() in one IMMEDIATE transaction."""
+        with self._lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                result = fn()
+                self.db.execute("COMMIT")
+                return result
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+
+    def _service_time(self) -> float:
+        row = self.db.execute(
+            "SELECT AVG(finished_at - started_at), COUNT(*) FROM "
+            "(SELECT finished_at, started_at FROM jobs "
+            " WHERE state IN (?, ?) AND started_at IS NOT NULL "
+            " ORDER BY finished_at DESC LIMIT ?)",
+            (DONE, FAILED, SERVICE_SAMPLES)
+        ).fetchone()
+        if row[1] < SERVICE_MIN_SAMPLES:
+            return QUEUE_DEFAULT_SERVICE_SECONDS
+        return max(1.0, row[0])
+
+    def _release(self, row, now: float, error: str):
+        """Requeue a running job, or fail it after MAX_CLAIMS claims."""
+        if row["attempts"] < MAX_CLAIMS:
+            self.db.execute(
+                "UPDATE jobs SET state = ?, worker = NULL, lease_until = NULL, "
+                "started_at = NULL WHERE id = ?", (QUEUED, row["id"]))
+        else:
+            self.db.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, result = ? WHERE id = ?",
+                (FAILED, now, json.dumps(crashed_result(error), ensure_ascii=False), row["id"]))
+
+    def submit(self, prompt, lane=DEFAULT_LANE, deadline=300, payload=None, job_id=None) -> dict:
+        job = _new_job(prompt, lane, deadline, job_id)
+
+        def admit():
+            self._reap(job["created_at"])
+            running = [r[0] for r in self.db.execute(
+                "SELECT started_at FROM jobs WHERE state = ?", (RUNNING,))]
+            queued = [dict(r) for r in self.db.execute(
+                "SELECT id, lane, deadline, created_at FROM jobs WHERE state = ?", (QUEUED,))]
+            start, reason = self._admission(job, self._service_time(), running, queued)
+            self.db.execute(
+                "INSERT INTO jobs (id, lane, deadline, prompt, payload, state, created_at, "
+                "finished_at, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["lane"], job["deadline"], prompt,
+                 json.dumps(payload or {}, ensure_ascii=False),
+                 REJECTED if reason else QUEUED, job["created_at"],
+                 job["created_at"] if reason else None,
+                 json.dumps({"reason": reason}) if reason else None))
+            return start, reason
+
+        start, reason = self._run(admit)
+        return {
+            "admitted": reason is None,
+            "job_id": job["id"],
+            "estimated_start": round(max(0.0, start - job["created_at"]), 1),
+            "reason": reason
+        }
+
+    def claim(self, worker: str) -> Optional[dict]:
+        def take():
+            now = time.time()
+            service = self._service_time()
+            while True:
+                row = self.db.execute(
+                    "SELECT * FROM jobs WHERE state = ? ORDER BY lane, deadline, created_at LIMIT 1",
+                    (QUEUED,)).fetchone()
+                if row is None:
+                    return None
+                if now > row["deadline"] - service:
+                    self.db.execute("UPDATE jobs SET state = ?, finished_at = ? WHERE id = ?",
+                                    (EXPIRED, now, row["id"]))
+                    continue
+                self.db.execute(
+                    "UPDATE jobs SET state = ?, worker = ?, started_at = ?, lease_until = ?, "
+                    "attempts = attempts + 1 WHERE id = ?",
+                    (RUNNING, worker, now, now + self.lease, row["id"]))
+                job = dict(row)
+                job.update(state=RUNNING, worker=worker, started_at=now,
+                           attempts=row["attempts"] + 1,
+                           payload=json.loads(row["payload"] or "{}"))
+                return job
+
+        return self._run(take)
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        with self._lock:
+            cur = self.db.execute(
+                "UPDATE jobs SET lease_until = ? WHERE id = ? AND state = ? AND worker = ?",
+                (time.time() + self.lease, job_id, RUNNING, worker))
+            return cur.rowcount == 1
+
+    def finish(self, job_id: str, result: dict, worker: str) -> bool:
+        def record():
+            values = (finished_state(result), time.time(), json.dumps(result, ensure_ascii=False))
+            cur = self.db.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, result = ?, lease_until = NULL "
+                "WHERE id = ? AND state = ? AND worker = ?",
+                values + (job_id, RUNNING, worker))
+            if cur.rowcount == 0 and result.get("success"):
+                # Lost the lease but delivered the image: first success wins.
+                # No started_at, so the other claim's time is no service sample.
+                cur = self.db.execute(
+                    "UPDATE jobs SET state = ?, finished_at = ?, result = ?, lease_until = NULL, "
+                    "started_at = NULL WHERE id = ? AND state IN (?, ?)",
+                    values + (job_id, QUEUED, RUNNING))
+            return cur.rowcount == 1
+
+        return self._run(record)
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        def stop():
+            row = self.db.execute("SELECT state FROM jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None or row["state"] not in (QUEUED, RUNNING):
+                return None
+            if row["state"] == QUEUED:
+                self.db.execute(
+                    "UPDATE jobs SET state = ?, finished_at = ?, result = ? WHERE id = ?",
+                    (CANCELLED, time.time(), json.dumps(CANCELLED_RESULT, ensure_ascii=False),
+                     job_id))
+                return CANCELLED
+            self.db.execute("UPDATE jobs SET cancel_requested = 1 WHERE id = ?", (job_id,))
+            return RUNNING
+
+        return self._run(stop)
+
+    def cancel_requested(self, job_id: str) -> bool:
+        with self._lock:
+            row = self.db.execute("SELECT cancel_requested FROM jobs WHERE id = ?",
+                                  (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def get(self, job_id: str) -> Optional[dict]:
+        with self._lock:
+            row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def requeue(self, worker: str) -> int:
+        def release():
+            now = time.time()
+            rows = self.db.execute("SELECT * FROM jobs WHERE state = ? AND worker = ?",
+                                   (RUNNING, worker)).fetchall()
+            for row in rows:
+                self._release(row, now, "worker crashed")
+            return len(rows)
+
+        return self._run(release)
+
+    def _reap(self, now: float) -> int:
+        rows = self.db.execute("SELECT * FROM jobs WHERE state = ? AND lease_until < ?",
+                               (RUNNING, now)).fetchall()
+        for row in rows:
+            print(f"   ↻ Lease of job {row['id']} ({row['worker']}) expired, reassigning")
+            self._release(row, now, "node lost")
+        self.db.execute("DELETE FROM jobs WHERE finished_at < ?", (now - QUEUE_HISTORY_SECONDS,))
+        return len(rows)
+
+    def reap(self) -> int:
+        return self._run(lambda: self._reap(time.time()))
+
+    def node_heartbeat(self, capacity: int, info: Optional[dict] = None):
+        with self._lock:
+            self.db.execute(
+                "INSERT OR REPLACE INTO nodes (node, capacity, info, updated_at) VALUES (?, ?, ?, ?)",
+                (self.node, capacity, json.dumps(info or {}), time.time()))
+
+    def nodes(self) -> List[dict]:
+        with self._lock:
+            rows = self.db.execute("SELECT * FROM nodes WHERE updated_at >= ?",
+                                   (time.time() - COORDINATION_NODE_TTL,)).fetchall()
+        return [dict(r, info=json.loads(r["info"] or "{}")) for r in rows]
+
+    def jobs(self) -> List[dict]:
+        with self._lock:
+            return [dict(r) for r in self.db.execute(
+                "SELECT id, lane, deadline, state, worker, prompt FROM jobs "
+                "WHERE state IN (?, ?) ORDER BY lane, deadline", (RUNNING, QUEUED))]
+
+
+class RedisBackend(CoordinationBackend):
+    """Coordination through a Redis-protocol server"""
+
+    def __init__(self, client=None, url: str = COORDINATION_REDIS_URL,
+                 prefix: str = COORDINATION_PREFIX, **kwargs):
+        super().__init__(**kwargs)
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise RuntimeError("The redis backend requires redis-py (pip install redis)")
+            client = redis.Redis.from_url(url)
+        self.r = client
+        self.prefix = prefix
+        self.queue_key = f"{prefix}:queue"      # zset: job id -> lane/deadline score
+        self.running_key = f"{prefix}:running"  # zset: job id -> lease expiry
+        self.nodes_key = f"{prefix}:nodes"      # hash: node -> JSON
+        self.durations_key = f"{prefix}:durations"
+
+    def _job_key(self, job_id: str) -> str:
+        return f"{self.prefix}:job:{job_id}"
+
+    def _score(self, lane: int, deadline: float) -> float:
+        return lane * LANE_WEIGHT + deadline
+
+    def _transact(self, keys: List[str], fn):
+        """Optimistic transaction: fn(pipe) reads, calls pipe.multi(), queues writes."""
+        while True:
+            with self.r.pipeline() as pipe:
+                try:
+                    pipe.watch(*keys)
+                    result = fn(pipe)
+                    pipe.execute()
+                    return result
+                except Exception as e:
+                    if type(e).__name__ == "WatchError":
+                        continue  # Someone else changed the keys first; retry
+                    raise
+
+    def _service_time(self) -> float:
+        durations = [float(_text(v)) for v in self.r.lrange(self.durations_key, 0, -1)]
+        if len(durations) < SERVICE_MIN_SAMPLES:
+            return QUEUE_DEFAULT_SERVICE_SECONDS
+        return max(1.0, sum(durations) / len(durations))
+
+    def _load(self, job_id: str, client=None) -> Optional[dict]:
+        raw = (client or self.r).hgetall(self._job_key(job_id))
+        if not raw:
+            return None
+        job = {_text(k): _text(v) for k, v in raw.items()}
+        for name in ("lane", "attempts"):
+            job[name] = int(job.get(name) or 0)
+        for name in ("deadline", "created_at", "started_at", "finished_at"):
+            job[name] = float(job[name]) if job.get(name) else None
+        return job
+
+    def submit(self, prompt, lane=DEFAULT_LANE, deadline=300, payload=None, job_id=None) -> dict:
+        job = _new_job(prompt, lane, deadline, job_id)
+        self.reap()
+
+        # Admission reads a snapshot; concurrent submits may both squeeze in
+        queued = []
+        for queued_id in self.r.zrange(self.queue_key, 0, -1):
+            other = self._load(_text(queued_id))
+            if other:
+                queued.append(other)
+        running = []
+        for running_id in self.r.zrange(self.running_key, 0, -1):
+            other = self._load(_text(running_id))
+            if other and other["started_at"]:
+                running.append(other["started_at"])
+        start, reason = self._admission(job, self._service_time(), running, queued)
+
+        pipe = self.r.pipeline()
+        pipe.hset(self._job_key(job["id"]), mapping={
+            "id": job["id"], "lane": job["lane"], "deadline": job["deadline"],
+            "created_at": job["created_at"], "prompt": prompt,
+            "payload": json.dumps(payload or {}, ensure_ascii=False),
+            "state": REJECTED if reason else QUEUED,
+            "result": json.dumps({"reason": reason}) if reason else ""
+        })
+        pipe.expire(self._job_key(job["id"]), int(QUEUE_HISTORY_SECONDS))
+        if not reason:
+            pipe.zadd(self.queue_key, {job["id"]: self._score(job["lane"], job["deadline"])})
+        pipe.execute()
+
+        return {
+            "admitted": reason is None,
+            "job_id": job["id"],
+            "estimated_start": round(max(0.0, start - job["created_at"]), 1),
+            "reason": reason
+        }
+
+    def claim(self, worker: str) -> Optional[dict]:
+        service = self._service_time()
+        while True:
+            def take(pipe):
+                head = pipe.zrange(self.queue_key, 0, 0)
+                if not head:
+                    pipe.multi()
+                    return None
+                job = self._load(_text(head[0]), pipe)
+                now = time.time()
+                pipe.multi()
+                pipe.zrem(self.queue_key, _text(head[0]))
+                if job is None:
+                    return "skip"  # Job hash expired; drop the stale entry
+                key = self._job_key(job["id"])
+                if now > job["deadline"] - service:
+                    pipe.hset(key, mapping={"state": EXPIRED, "finished_at": now})
+                    return "skip"
+                pipe.zadd(self.running_key, {job["id"]: now + self.lease})
+                pipe.hset(key, mapping={"state": RUNNING, "worker": worker, "started_at": now})
+                pipe.hincrby(key, "attempts", 1)
+                job.update(state=RUNNING, worker=worker, started_at=now,
+                           attempts=job["attempts"] + 1)
+                return job
+
+            job = self._transact([self.queue_key], take)
+            if job != "skip":
+                if job:
+                    job["payload"] = json.loads(job.get("payload") or "{}")
+                return job
+
+    def heartbeat(self, job_id: str, worker: str) -> bool:
+        def renew(pipe):
+            # Watched like _release(), so a lease reaped meanwhile is not extended
+            job = self._load(job_id, pipe)
+            lease = pipe.zscore(self.running_key, job_id)
+            pipe.multi()
+            if (not job or job["state"] != RUNNING or job.get("worker") != worker
+                    or lease is None):
+                return False
+            pipe.zadd(self.running_key, {job_id: time.time() + self.lease}, xx=True)
+            return True
+
+        return self._transact([self._job_key(job_id), self.running_key], renew)
+
+    def finish(self, job_id: str, result: dict, worker: str) -> bool:
+        key = self._job_key(job_id)
+
+        def record(pipe):
+            job = self._load(job_id, pipe)
+            owner = job is not None and job["state"] == RUNNING and job.get("worker") == worker
+            # Lost the lease but delivered the image: first success wins
+            taken_over = (job is not None and not owner and result.get("success")
+                          and job["state"] in (QUEUED, RUNNING))
+            if not owner and not taken_over:
+                pipe.multi()
+                return False
+            now = time.time()
+            pipe.multi()
+            pipe.hset(key, mapping={
+                "state": finished_state(result),
+                "finished_at": now,
+                "result": json.dumps(result, ensure_ascii=False)
+            })
+            pipe.zrem(self.queue_key, job_id)
+            pipe.zrem(self.running_key, job_id)
+            if owner and job["started_at"]:
+                # Only our own claim's duration; another worker's start says nothing about ours
+                pipe.lpush(self.durations_key, now - job["started_at"])
+                pipe.ltrim(self.durations_key, 0, SERVICE_SAMPLES - 1)
+            return True
+
+        return self._transact([key], record)
+
+    def get(self, job_id: str) -> Optional[dict]:
+        return self._load(job_id)
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        key = self._job_key(job_id)
+
+        def stop(pipe):
+            job = self._load(job_id, pipe)
+            pipe.multi()
+            if not job or job["state"] not in (QUEUED, RUNNING):
+                return None
+            if job["state"] == QUEUED:
+                pipe.zrem(self.queue_key, job_id)
+                pipe.hset(key, mapping={"state": CANCELLED, "finished_at": time.time(),
+                                        "result": json.dumps(CANCELLED_RESULT, ensure_ascii=False)})
+                return CANCELLED
+            pipe.hset(key, "cancel_requested", 1)
+            return RUNNING
+
+        return self._transact([key], stop)
+
+    def cancel_requested(self, job_id: str) -> bool:
+        return _text(self.r.hget(self._job_key(job_id), "cancel_requested")) == "1"
+
+    def _release(self, job_id: str, error: str, expired_only: bool) -> bool:
+        key = self._job_key(job_id)
+
+        def release(pipe):
+            job = self._load(job_id, pipe)
+            lease = pipe.zscore(self.running_key, job_id)
+            pipe.multi()
+            if not job or job["state"] != RUNNING:
+                pipe.zrem(self.running_key, job_id)
+                return False
+            if expired_only and lease is not None and float(lease) >= time.time():
+                return False  # Renewed meanwhile
+            pipe.zrem(self.running_key, job_id)
+            if job["attempts"] < MAX_CLAIMS:
+                pipe.hset(key, mapping={"state": QUEUED, "worker": "", "started_at": ""})
+                pipe.zadd(self.queue_key, {job_id: self._score(job["lane"], job["deadline"])})
+            else:
+                pipe.hset(key, mapping={
+                    "state": FAILED, "finished_at": time.time(),
+                    "result": json.dumps(crashed_result(error), ensure_ascii=False)})
+            return True
+
+        return self._transact([key, self.running_key], release)
+
+    def requeue(self, worker: str) -> int:
+        count = 0
+        for job_id in self.r.zrange(self.running_key, 0, -1):
+            job_id = _text(job_id)
+            job = self._load(job_id)
+            if job and job.get("worker") == worker and self._release(job_id, "worker crashed", False):
+                count += 1
+        return count
+
+    def reap(self) -> int:
+        count = 0
+        for job_id in self.r.zrangebyscore(self.running_key, "-inf", time.time()):
+            job_id = _text(job_id)
+            if self._release(job_id, "node lost", True):
+                print(f"   ↻ Lease of job {job_id} expired, reassigning")
+                count += 1
+        return count
+
+    def node_heartbeat(self, capacity: int, info: Optional[dict] = None):
+        self.r.hset(self.nodes_key, self.node, json.dumps(
+            {"node": self.node, "capacity": capacity, "info": info or {},
+             "updated_at": time.time()}))
+
+    def nodes(self) -> List[dict]:
+        now = time.time()
+        live = []
+        for node, raw in self.r.hgetall(self.nodes_key).items():
+            entry = json.loads(_text(raw))
+            if now - entry["updated_at"] <= COORDINATION_NODE_TTL:
+                live.append(entry)
+            elif now - entry["updated_at"] > 10 * COORDINATION_NODE_TTL:
+                self.r.hdel(self.nodes_key, _text(node))
+        return live
+
+    def jobs(self) -> List[dict]:
+        jobs = []
+        for key in (self.running_key, self.queue_key):
+            for job_id in self.r.zrange(key, 0, -1):
+                job = self._load(_text(job_id))
+                if job:
+                    jobs.append(job)
+        return jobs
+
+
+class LeaseKeeper:
+    """Renews a job's lease from a background thread while a worker runs it"""
+
+    def __init__(self, backend: CoordinationBackend, job_id: str, worker: str):
+        self.backend = backend
+        self.job_id = job_id
+        self.worker = worker
+        self.lost = False
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.wait(self.backend.lease / 3):
+            try:
+                if not self.backend.heartbeat(self.job_id, self.worker):
+                    print(f"   ⚠️  Lost the lease of job {self.job_id}")
+                    self.lost = True
+                    return
+            except Exception as e:
+                print(f"   ⚠️  Lease heartbeat failed: {e}")
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        """Stop renewing (idempotent); the caller finishes the job next."""
+        self._stop.set()
+        if self._thread.is_alive() and self._thread is not threading.current_thread():
+            self._thread.join()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def get_backend(kind: Optional[str] = COORDINATION_BACKEND, **kwargs) -> Optional[CoordinationBackend]:
+    """Configured coordination backend, or None for single-host operation."""
+    if not kind:
+        return None
+    if kind == "sqlite":
+        return SQLiteBackend(**kwargs)
+    if kind == "redis":
+        return RedisBackend(**kwargs)
+    raise ValueError(f"Unknown coordination backend: {kind}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect multi-host job coordination")
+    parser.add_argument("action", choices=["status", "reap", "cancel"], help="Action to perform")
+    parser.add_argument("job_id", nargs="?", help="Job to cancel")
+    parser.add_argument("--backend", choices=["sqlite", "redis"], default=COORDINATION_BACKEND,
+                        help=f"Backend (default: COORDINATION_BACKEND = {COORDINATION_BACKEND})")
+    args = parser.parse_args()
+
+    backend = get_backend(args.backend)
+    if backend is None:
+        print("❌ No coordination backend configured (set COORDINATION_BACKEND in config.py)")
+        return 1
+
+    with backend:
+        if args.action == "reap":
+            print(f"✓ Reassigned {backend.reap()} job(s)")
+            return 0
+
+        if args.action == "cancel":
+            if not args.job_id:
+                print("❌ cancel needs a job id (see: python coordination.py status)")
+                return 1
+            state = backend.cancel(args.job_id)
+            if state is None:
+                print(f"❌ Job {args.job_id} is not queued or running")
+                return 1
+            print(f"✓ Job {args.job_id} " + ("cancelled" if state == CANCELLED
+                                             else "is stopping (running)"))
+            return 0
+
+        print(f"Nodes ({backend.capacity()} slots):")
+        for node in backend.nodes():
+            print(f"  {node['node']}: capacity {node['capacity']}, "
+                  f"seen {time.time() - node['updated_at']:.0f}s ago")
+        now = time.time()
+        print("Jobs:")
+        for job in backend.jobs():
+            print(f"  {job['id']}  {job['state']:<8} {job.get('worker') or '-':<24} "
+                  f"deadline in {job['deadline'] - now:6.0f}s  {job['prompt'][:40]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,132 @@
+"""
+Failure classification for Gemini Image Generator
+Structured results, per-class retry policies and user-facing messages for generate_image()
+"""
+
+from enum import Enum
+from typing import Optional
+from dataclasses import dataclass, field, asdict
+
+
+class FailureKind(str, Enum):
+    """Why a generation attempt failed"""
+    AUTH_REQUIRED = "auth_required"      # Redirected to Google sign-in
+    NAVIGATION = "navigation"            # goto/network error, crashed or closed tab
+    INPUT_NOT_FOUND = "input_not_found"  # Prompt input missing (UI changed?)
+    NO_RESPONSE = "no_response"          # No response element ever appeared (UI changed?)
+    NO_IMAGE = "no_image"                # Response finished but no image selector matched (UI changed?)
+    DECLINED = "declined"                # Gemini refused to generate
+    TIMEOUT = "timeout"                  # No image within the timeout
+    DOWNLOAD = "download"                # Image found but could not be saved
+    CIRCUIT_OPEN = "circuit_open"        # Rejected by the circuit breaker
+    REJECTED = "rejected"                # Could not be scheduled before its deadline
+    CANCELLED = "cancelled"              # Caller gave up (signal, client abort, queue cancel)
+    UPLOAD = "upload"                    # Image saved, but not in remote storage in time
+    UNKNOWN = "unknown"
+
+
+class GenerationError(Exception):
+    """Raised inside a generation attempt with a classified failure"""
+
+    def __init__(self, kind: FailureKind, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.kind = kind
+        self.message = message
+        self.retryable = retryable  # False: retrying the whole attempt cannot help
+
+
+@dataclass(frozen=True)
+class RetryPolicy:
+    """How often a failure class is retried, and how"""
+    max_attempts: int            # Attempts allowed for this class (1 = never retry)
+    backoff_seconds: float = 0   # Delay before the first retry, doubled each time
+    fresh_tab: bool = False      # Retry on a new tab instead of the current one
+
+    def delay(self, failures: int) -> float:
+        """Delay before the retry that follows the N-th failure of this class."""
+        if not self.backoff_seconds:
+            return 0
+        return self.backoff_seconds * (2 ** (failures - 1))
+
+
+RETRY_POLICIES = {
+    # Cheap and usually transient: retry at once on a clean tab
+    FailureKind.NAVIGATION: RetryPolicy(max_attempts=3, fresh_tab=True),
+    # Often a half-loaded page; one more try on a fresh tab
+    FailureKind.INPUT_NOT_FOUND: RetryPolicy(max_attempts=2, fresh_tab=True),
+    FailureKind.NO_RESPONSE: RetryPolicy(max_attempts=2, fresh_tab=True),
+    FailureKind.NO_IMAGE: RetryPolicy(max_attempts=2, fresh_tab=True),
+    # Gemini is slow or overloaded: back off before trying again
+    FailureKind.TIMEOUT: RetryPolicy(max_attempts=2, backoff_seconds=15, fresh_tab=True),
+    # Retried in place on the generated image; resubmitted only if it is gone
+    FailureKind.DOWNLOAD: RetryPolicy(max_attempts=2, backoff_seconds=2),
+    FailureKind.UNKNOWN: RetryPolicy(max_attempts=2, backoff_seconds=5, fresh_tab=True),
+    # Doomed jobs: retrying cannot help
+    FailureKind.DECLINED: RetryPolicy(max_attempts=1),
+    FailureKind.AUTH_REQUIRED: RetryPolicy(max_attempts=1),
+    FailureKind.CIRCUIT_OPEN: RetryPolicy(max_attempts=1),
+    FailureKind.REJECTED: RetryPolicy(max_attempts=1),
+    FailureKind.CANCELLED: RetryPolicy(max_attempts=1),
+    FailureKind.UPLOAD: RetryPolicy(max_attempts=1),  # The upload spool keeps retrying
+}
+
+
+# User-facing messages per failure class
+FAILURE_MESSAGES = {
+    FailureKind.AUTH_REQUIRED: "Geminiの認証が切れています。NanoBanana Proの認証をやり直してください。",
+    FailureKind.DECLINED: "Geminiが画像生成を拒否しました。プロンプトを変更して再試行してください。",
+    FailureKind.TIMEOUT: "画像生成がタイムアウトしました。時間をおいて再試行してください。",
+    FailureKind.INPUT_NOT_FOUND: "GeminiのUIが変更された可能性があります。管理者に連絡してください。",
+    FailureKind.NAVIGATION: "Geminiに接続できませんでした。ネットワーク状態を確認してください。",
+    FailureKind.NO_RESPONSE: "Geminiから応答がありません。UIが変更された可能性があります。",
+    FailureKind.NO_IMAGE: "Geminiの応答から画像を検出できませんでした。UIが変更された可能性があります。",
+    FailureKind.DOWNLOAD: "生成された画像の保存に失敗しました。再試行してください。",
+    FailureKind.CIRCUIT_OPEN: "GeminiのUI変更を検知したため画像生成を一時停止しています。しばらくしてから再試行してください。",
+    FailureKind.REJECTED: "画像生成が混み合っているため、期限内に処理できません。しばらくしてから再試行してください。",
+    FailureKind.CANCELLED: "画像生成がキャンセルされました。",
+    FailureKind.UPLOAD: "生成した画像のアップロードが完了しませんでした。しばらくしてから再試行してください。",
+    FailureKind.UNKNOWN: "画像生成に失敗しました。プロンプトを変更して再試行してください。",
+}
+
+
+def classify_exception(error: Exception) -> FailureKind:
+    """Map an unexpected Playwright/OS exception onto a failure class."""
+    message = str(error)
+    if type(error).__name__ == "TimeoutError":
+        # Playwright timeouts outside the image wait loop are navigation stalls
+        return FailureKind.NAVIGATION
+    navigation_markers = ("net::ERR", "Navigation", "Target closed", "Target page",
+                          "crashed", "has been closed")
+    if any(marker in message for marker in navigation_markers):
+        return FailureKind.NAVIGATION
+    return FailureKind.UNKNOWN
+
+
+@dataclass
+class GenerationResult:
+    """
+    Outcome of generate_image().
+
+    Truthy on success, so existing `if generate_image(...)` callers keep working.
+    """
+    success: bool
+    output_path: Optional[str] = None
+    failure: Optional[FailureKind] = None
+    message: str = ""
+    attempts: int = 0
+    elapsed: float = 0.0
+    failures: list = field(default_factory=list)  # kind of every failed attempt
+    timings: dict = field(default_factory=dict)   # phase durations of the last attempt
+    hedged: bool = False
+    flight_record: Optional[str] = None  # Failure flight record directory
+    digest: Optional[str] = None  # sha256 of the saved image, computed while downloading
+    image_format: Optional[str] = None  # Sniffed format of the saved image (png, jpeg, webp, gif)
+
+    def __bool__(self):
+        return self.success
+
+    def to_dict(self) -> dict:
+        data = asdict(self)
+        data["failure"] = self.failure.value if self.failure else None
+        data["failures"] = [kind.value for kind in self.failures]
+        return data
@@ -0,0 +1,370 @@
+#!/usr/bin/env python3
+"""
+Failure flight recorder for Gemini Image Generator
+Keeps a rolling in-memory record of each job and persists it only on failure
+
+While a job runs, the recorder keeps bounded buffers of:
+- console messages and network events (FLIGHT_EVENTS most recent)
+- phase marks ("submitted", "image found", failures)
+- DOM + JPEG screenshot snapshots (FLIGHT_SNAPSHOTS most recent), taken
+  when an attempt fails (with FLIGHT_SUBMIT_SNAPSHOTS also after each
+  submit, which successful jobs pay for too)
+
+Nothing touches the disk unless the job fails; then everything is written
+to FLIGHT_DIR/<time>-<job_id>/ and the directory is pruned to
+FLIGHT_MAX_BYTES, oldest records first. With FLIGHT_TRACE a Playwright
+trace (trace.zip, open with `playwright show-trace`) is kept as well, at a
+considerably higher cost.
+
+Overhead: timings["recorder_ms"] (stored in the timing log) is the time
+spent in the recorder's own handlers and snapshots. It does not include
+delivering the events: with console/network listeners attached, the
+driver sends every such event to this process, which deserializes it into
+Request/Response objects before a handler runs, and that is most of the
+cost. `bench` measures both on a local page (headless shell, 1 CPU,
+150 fetches and 30 console messages per job, 50 job pairs with and
+without the recorder):
+
+    recorder_ms  p50 1.2 ms    p95 2.9 ms     handler bodies only
+    cpu_ms       p50 108 ms    p95 192 ms     + receiving and dispatching events
+    wall_ms      p50 151 ms    p95 326 ms     + driver and browser side
+
+The cost scales with network responses (about 0.7 ms of CPU each), so
+a real job costs roughly that times the responses Gemini makes during it;
+patchright delivers no console messages, so the console handler is free.
+Submit snapshots (FLIGHT_SUBMIT_SNAPSHOTS, off by default) and tracing
+are not part of these figures; when enabled they count in recorder_ms.
+
+    python flight_recorder.py overhead     # p50/p95 recorder_ms of recent jobs
+    python flight_recorder.py bench        # Measure delivery cost as above
+    python flight_recorder.py list         # Persisted failure records
+"""
+
+import sys
+import json
+import time
+import shutil
+import argparse
+from collections import deque
+from pathlib import Path
+from typing import Optional
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import (
+    FLIGHT_DIR,
+    FLIGHT_MAX_BYTES,
+    FLIGHT_EVENTS,
+    FLIGHT_SNAPSHOTS,
+    FLIGHT_TRACE,
+    FLIGHT_SUBMIT_SNAPSHOTS
+)
+
+MAX_URL_LENGTH = 200
+
+
+class FlightRecorder:
+    """Bounded per-job trace buffer, persisted only when the job fails"""
+
+    def __init__(self, job_id: str, directory: Path = FLIGHT_DIR,
+                 max_events: int = FLIGHT_EVENTS,
+                 max_snapshots: int = FLIGHT_SNAPSHOTS,
+                 trace: bool = FLIGHT_TRACE,
+                 submit_snapshots: bool = FLIGHT_SUBMIT_SNAPSHOTS):
+        self.job_id = job_id
+        self.directory = Path(directory)
+        self.events = deque(maxlen=max_events)
+        self.snapshots = deque(maxlen=max_snapshots)
+        self.trace = trace
+        self.submit_snapshots = submit_snapshots
+        self.started = time.time()
+        self.overhead = 0.0  # Seconds spent inside the recorder
+        self._context = None
+        self._attached = set()
+        self._listeners = []  # (page, event, handler) to remove in detach()
+
+    def _event(self, kind: str, **data):
+        start = time.perf_counter()
+        self.events.append({"t": round(time.time() - self.started, 3), "type": kind, **data})
+        self.overhead += time.perf_counter() - start
+
+    def attach(self, context):
+        """Record every current and future page of a browser context."""
+        self._context = context
+        for page in context.pages:
+            self.attach_page(page)
+        context.on("page", self.attach_page)
+
+        if self.trace:
+            start = time.perf_counter()
+            try:
+                context.tracing.start(screenshots=True, snapshots=True)
+            except Exception as e:
+                print(f"   ⚠️  Tracing unavailable: {e}")
+                self.trace = False
+            self.overhead += time.perf_counter() - start
+
+    def attach_page(self, page):
+        if id(page) in self._attached:
+            return
+        self._attached.add(id(page))
+        handlers = {
+            "console": lambda msg: self._event(
+                "console", level=msg.type, text=msg.text[:1000]),
+            "requestfailed": lambda req: self._event(
+                "requestfailed", url=req.url[:MAX_URL_LENGTH], method=req.method,
+                error=req.failure),
+            "response": lambda res: self._event(
+                "response", url=res.url[:MAX_URL_LENGTH], status=res.status),
+            "framenavigated": lambda frame: frame.parent_frame is None and self._event(
+                "navigated", url=frame.url[:MAX_URL_LENGTH]),
+            "crash": lambda _: self._event("crash"),
+        }
+        for event, handler in handlers.items():
+            page.on(event, handler)
+            self._listeners.append((page, event, handler))
+
+    def detach(self):
+        """Stop listening (long-lived contexts and tabs outlive a single job)."""
+        if self._context is not None:
+            try:
+                self._context.remove_listener("page", self.attach_page)
+            except Exception:
+                pass
+        for page, event, handler in self._listeners:
+            try:
+                page.remove_listener(event, handler)
+            except Exception:
+                pass  # Closed page
+        self._listeners.clear()
+        self._attached.clear()
+
+    def mark(self, label: str, **data):
+        """Record a phase boundary."""
+        self._event("mark", label=label, **data)
+
+    def snapshot(self, page, label: str):
+        """Keep the DOM and a low-quality screenshot of a page in memory."""
+        start = time.perf_counter()
+        entry = {"t": round(time.time() - self.started, 3), "label": label}
+        try:
+            entry["url"] = page.url
+            entry["html"] = page.content()
+            entry["png"] = page.screenshot(type="jpeg", quality=40, timeout=5000)
+        except Exception as e:
+            entry["error"] = str(e)
+        self.snapshots.append(entry)
+        self.overhead += time.perf_counter() - start
+
+    @property
+    def overhead_ms(self) -> float:
+        return round(self.overhead * 1000, 1)
+
+    def finish(self, failed: bool, failure: Optional[str] = None,
+               message: str = "") -> Optional[Path]:
+        """
+        End the recording; persist it if the job failed.
+
+        Returns:
+            Path: Directory of the persisted record, or None
+        """
+        self.detach()
+        record_dir = None
+        if failed:
+            record_dir = self._persist(failure, message)
+
+        if self.trace and self._context is not None:
+            start = time.perf_counter()
+            try:
+                if record_dir:
+                    self._context.tracing.stop(path=str(record_dir / "trace.zip"))
+                else:
+                    self._context.tracing.stop()
+            except Exception:
+                pass
+            self.overhead += time.perf_counter() - start
+
+        if record_dir:
+            print(f"   → Flight record saved: {record_dir}")
+            prune(self.directory)
+        return record_dir
+
+    def _persist(self, failure: Optional[str], message: str) -> Path:
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        record_dir = self.directory / f"{stamp}-{self.job_id}"
+        record_dir.mkdir(parents=True, exist_ok=True)
+
+        snapshots = []
+        for i, snap in enumerate(self.snapshots):
+            name = f"{i:02d}-{snap['label']}".replace("/", "_")
+            meta = {k: v for k, v in snap.items() if k not in ("html", "png")}
+            if snap.get("html"):
+                (record_dir / f"{name}.html").write_text(snap["html"], encoding="utf-8")
+                meta["html"] = f"{name}.html"
+            if snap.get("png"):
+                (record_dir / f"{name}.jpg").write_bytes(snap["png"])
+                meta["screenshot"] = f"{name}.jpg"
+            snapshots.append(meta)
+
+        summary = {
+            "job_id": self.job_id,
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "failure": failure,
+            "message": message,
+            "recorder_ms": self.overhead_ms,
+            "snapshots": snapshots,
+            "events": list(self.events)
+        }
+        with open(record_dir / "record.json", 'w') as f:
+            json.dump(summary, f, indent=2, ensure_ascii=False)
+        return record_dir
+
+
+def _dir_size(path: Path) -> int:
+    return sum(f.stat().st_size for f in path.rglob("*") if f.is_file())
+
+
+def prune(directory: Path = FLIGHT_DIR, max_bytes: int = FLIGHT_MAX_BYTES):
+    """Delete the oldest flight records until the directory fits max_bytes."""
+    if not directory.exists():
+        return
+    records = sorted(d for d in directory.iterdir() if d.is_dir())
+    sizes = {d: _dir_size(d) for d in records}
+    total = sum(sizes.values())
+    for record in records:
+        if total <= max_bytes:
+            break
+        shutil.rmtree(record, ignore_errors=True)
+        total -= sizes[record]
+
+
+BENCH_PAGE = """<!DOCTYPE html><title>bench</title><script>
+window.done = false;
+(async () => {
+    for (let i = 0; i < %(console)d; i++) console.log("bench message " + i + " ".repeat(80));
+    await Promise.all(Array.from({length: %(requests)d}, (_, i) => fetch("/r/" + i + "?" + Math.random())));
+    window.done = true;
+})();
+</script>"""
+
+
+def _serve_bench_page(console: int, requests: int):
+    """Local HTTP server for the bench page and its small subresources."""
+    import threading
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    page = (BENCH_PAGE % {"console": console, "requests": requests}).encode()
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            body = page if self.path == "/" else b'{"ok":true}'
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html" if self.path == "/" else "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def bench(jobs: int, console: int, requests: int, executable: Optional[str] = None) -> dict:
+    """
+    Cost of the recorder on a successful job, including event delivery.
+
+    Loads a local page that logs `console` messages and makes `requests`
+    fetches, once without and once with a recorder attached (alternating
+    which goes first), and reports per-job p50/p95 of:
+
+    - recorder_ms: the handler bodies, as reported in production
+    - cpu_ms: extra CPU time of this Python process, i.e. receiving,
+      deserializing and dispatching the console/network events that the
+      listeners subscribe to, plus the handlers
+    - wall_ms: extra wall time of the job, which also includes the
+      driver and browser side of sending those events
+    """
+    from patchright.sync_api import sync_playwright
+    from timings import percentile
+
+    server = _serve_bench_page(console, requests)
+    url = f"http://127.0.0.1:{server.server_address[1]}/"
+    rows = {"recorder_ms": [], "cpu_ms": [], "wall_ms": []}
+
+    def run(page, context, recorded: bool):
+        recorder = FlightRecorder("bench", submit_snapshots=False, trace=False)
+        if recorded:
+            recorder.attach(context)
+        wall, cpu = time.perf_counter(), time.process_time()
+        page.goto(url)
+        page.wait_for_function("window.done", polling=50)
+        wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+        recorder.finish(failed=False)
+        return wall * 1000, cpu * 1000, recorder.overhead_ms
+
+    try:
+        with sync_playwright() as playwright:
+            browser = playwright.chromium.launch(headless=True, executable_path=executable)
+            context = browser.new_context()
+            page = context.new_page()
+            run(page, context, True)  # Warm up caches and the driver
+            for i in range(jobs):
+                order = (False, True) if i % 2 else (True, False)
+                results = {recorded: run(page, context, recorded) for recorded in order}
+                rows["wall_ms"].append(results[True][0] - results[False][0])
+                rows["cpu_ms"].append(results[True][1] - results[False][1])
+                rows["recorder_ms"].append(results[True][2])
+            browser.close()
+    finally:
+        server.shutdown()
+
+    return {name: {"p50": round(percentile(values, 50), 1), "p95": round(percentile(values, 95), 1)}
+            for name, values in rows.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect failure flight records")
+    parser.add_argument("action", choices=["list", "overhead", "bench"], help="Action to perform")
+    parser.add_argument("--jobs", type=int, default=50, help="Job pairs to run for bench (default: 50)")
+    parser.add_argument("--console", type=int, default=30,
+                        help="Console messages per bench job (default: 30)")
+    parser.add_argument("--requests", type=int, default=150,
+                        help="Network requests per bench job (default: 150)")
+    parser.add_argument("--executable", help="Browser binary for bench (default: bundled headless shell)")
+    args = parser.parse_args()
+
+    if args.action == "bench":
+        print(f"⏱  {args.jobs} job pairs, {args.console} console messages and "
+              f"{args.requests} requests per job")
+        results = bench(args.jobs, args.console, args.requests, args.executable)
+        for name, result in results.items():
+            print(f"{name:<12} p50 {result['p50']:>6} ms   p95 {result['p95']:>6} ms")
+        return 0
+
+    if args.action == "list":
+        if not FLIGHT_DIR.exists():
+            print("No flight records")
+            return 0
+        for record_dir in sorted(FLIGHT_DIR.iterdir()):
+            record_file = record_dir / "record.json"
+            if record_file.exists():
+                with open(record_file, 'r') as f:
+                    record = json.load(f)
+                print(f"{record_dir.name}: {record.get('failure')} - {record.get('message', '')[:80]}")
+        return 0
+
+    from timings import TimingLog, percentile
+    records = [r for r in TimingLog().recent() if r.get("recorder_ms") is not None]
+    ok = [r["recorder_ms"] for r in records if r.get("success")]
+    failed = [r["recorder_ms"] for r in records if not r.get("success")]
+    print(f"Successful jobs ({len(ok)}): p50 {percentile(ok, 50)} ms, p95 {percentile(ok, 95)} ms")
+    print(f"Failed jobs ({len(failed)}): p50 {percentile(failed, 50)} ms, p95 {percentile(failed, 95)} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
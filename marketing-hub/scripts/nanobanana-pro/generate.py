@@ -5,14 +5,20 @@ Next.js APIから呼び出されるエントリーポイント
 
 Usage:
     python generate.py --prompt "Your prompt here"
+    python generate.py --prompt "..." --lane bulk --deadline 3600
 
 Output (JSON):
     {"success": true, "url": "/uploads/ai-generated/xxx.png", "filename": "xxx.png"}
     {"success": false, "error": "Error message"}
+
+SIGTERM/SIGINT cancel the job cooperatively (route.ts sends SIGTERM on
+timeout and client disconnect): the browser tab or queued job is released
+and {"success": false, "failure": "cancelled"} is printed.
 """
 
 import sys
 import json
+import time
 import argparse
 from pathlib import Path
 from nanoid import generate as nanoid_generate
@@ -20,15 +26,297 @@ from nanoid import generate as nanoid_generate
 # Add current directory to path
 sys.path.insert(0, str(Path(__file__).parent))
 
-from config import DATA_DIR, OUTPUT_DIR, STATE_FILE
+from config import (
+    DATA_DIR,
+    OUTPUT_DIR,
+    STATE_FILE,
+    PROMPT_REUSE_THRESHOLD,
+    QUEUE_SLOTS,
+    STORAGE_DRAIN_TIMEOUT
+)
 from image_generator import generate_image, check_authenticated
+from image_store import ImageStore
+from image_download import with_extension
+from profile_manager import worker_paths
+from failures import FailureKind, GenerationError, FAILURE_MESSAGES
+from circuit_breaker import CircuitBreaker
+from singleflight import SingleFlight, request_key
+from prompt_index import PromptIndex
+from job_queue import (JobQueue, LANES, DEFAULT_LANE, QUEUED, RUNNING, DONE, FAILED, CANCELLED,
+                       CANCELLED_RESULT)
+from supervisor import supervisor_status
+from coordination import get_backend
+from cancellation import CancelToken, install_signal_handlers
+import output_storage
+
+
+def new_filename() -> str:
+    """Generate a unique public filename (.png; build_result() switches it to the actual format)."""
+    try:
+        from nanoid import generate
+        return f"{generate(size=12)}.png"
+    except ImportError:
+        import uuid
+        return f"{uuid.uuid4().hex[:12]}.png"
+
+
+def run_generation(args, filename: str, user_data_dir=None, state_file=None,
+                   total_timeout: float = None, cancel: CancelToken = None) -> dict:
+    """Generate one image into OUTPUT_DIR/filename and build the JSON result."""
+    output_path = OUTPUT_DIR / filename
+
+    # Generate image (headless mode)
+    generation = generate_image(
+        prompt=args.prompt,
+        output_path=str(output_path),
+        show_browser=False,
+        timeout=args.timeout,
+        user_data_dir=user_data_dir,
+        state_file=state_file,
+        total_timeout=total_timeout or args.total_timeout,
+        hedge=args.hedge or None,
+        cancel=cancel,
+        profile=args.profile or None
+    )
+    return build_result(generation, args.prompt, filename)
+
+
+def build_result(generation, prompt: str, filename: str) -> dict:
+    """Store a finished generation and turn it into the JSON result for route.ts."""
+    output_path = OUTPUT_DIR / filename
+    if generation and output_path.exists():
+        # Deduplicate into the content-addressed store (best effort - the
+        # image is already saved). The stored name gets the extension of the
+        # downloaded format.
+        digest = None
+        try:
+            with ImageStore() as store:
+                stored_name = with_extension(filename, generation.image_format)
+                digest = store.put(str(output_path), stored_name, digest=generation.digest,
+                                   image_format=generation.image_format)
+                filename, output_path = stored_name, OUTPUT_DIR / stored_name
+            with PromptIndex() as index:
+                index.add(prompt, filename, digest)
+        except Exception as e:
+            print(f"⚠️  Image store update failed: {e}")
+
+        # Local URL, or the remote one (uploaded in the background)
+        return {
+            "success": True,
+            "url": output_storage.publish(output_path, filename, digest, generation.image_format),
+            "filename": filename,
+            "sha256": digest,
+            "prompt": prompt,
+            "attempts": generation.attempts,
+            "hedged": generation.hedged
+        }
+
+    failure = generation.failure or FailureKind.UNKNOWN
+    result = {
+        "success": False,
+        "error": FAILURE_MESSAGES[failure],
+        "failure": failure.value,
+        "attempts": generation.attempts
+    }
+    if failure == FailureKind.AUTH_REQUIRED:
+        result["auth_required"] = True
+    if failure == FailureKind.CIRCUIT_OPEN:
+        result["retry_after"] = CircuitBreaker().status().get("retry_after", 0)
+    if failure == FailureKind.CANCELLED:
+        result["cancelled"] = True  # Never shared with singleflight waiters
+    if generation.flight_record:
+        result["flight_record"] = Path(generation.flight_record).name
+    return result
+
+
+def rejected_result(reason: str, retry_after: float = None) -> dict:
+    print(f"❌ Not scheduled: {reason}")
+    result = {
+        "success": False,
+        "error": FAILURE_MESSAGES[FailureKind.REJECTED],
+        "failure": FailureKind.REJECTED.value,
+        "reason": reason,
+        "attempts": 0
+    }
+    if retry_after is not None:
+        result["retry_after"] = round(retry_after)
+    return result
+
+
+def cancelled_result() -> dict:
+    print("⏹ Cancelled")
+    return dict(CANCELLED_RESULT)
+
+
+def upload_failed_result(result: dict) -> dict:
+    print(f"❌ Upload of {result.get('filename')} did not finish (left in the upload spool)")
+    return {
+        "success": False,
+        "error": FAILURE_MESSAGES[FailureKind.UPLOAD],
+        "failure": FailureKind.UPLOAD.value,
+        "attempts": result.get("attempts", 0)
+    }
+
+
+def await_upload(result: dict, timeout: float = None) -> dict:
+    """Hold a successful result back until its URL works (remote output storage)."""
+    if not result.get("success") or output_storage.wait_uploaded(result.get("url"), timeout):
+        return result
+    return upload_failed_result(result)
+
+
+def run_scheduled(args, filename: str, user_data_dir=None, state_file=None,
+                  cancel: CancelToken = None) -> dict:
+    """
+    Queue the job by lane and deadline, wait for its turn, then generate.
+
+    The job is rejected up front if the queue cannot finish it by its
+    deadline, and dropped if the deadline passes while it waits. With
+    QUEUE_SLOTS > 1 each slot runs on its own cloned worker profile.
+    """
+    with JobQueue() as queue:
+        admission = queue.submit(args.prompt, args.lane, args.deadline,
+                                 payload={"filename": filename})
+        if not admission["admitted"]:
+            return rejected_result(admission["reason"], admission["estimated_start"])
+        if admission["estimated_start"] > 1:
+            print(f"   → Queued ({args.lane}), estimated start in {admission['estimated_start']:.0f}s")
+
+        job = queue.wait_turn(admission["job_id"], cancel=cancel)
+        if job is None:
+            return rejected_result("deadline passed while queued")
+
+        if user_data_dir is None and QUEUE_SLOTS > 1:
+            profile_dir, state_file = worker_paths(job["slot"])
+            user_data_dir = str(profile_dir)
+
+        # Also stop for `job_queue.py cancel ID`, not only for our own signals
+        job_cancel = CancelToken(poll=lambda: bool(cancel and cancel.cancelled)
+                                 or queue.cancel_requested(job["id"]))
+        result = None
+        try:
+            # Retries may only use what is left until the deadline
+            remaining = job["deadline"] - time.time()
+            result = run_generation(args, filename, user_data_dir, state_file,
+                                    total_timeout=min(args.total_timeout, remaining),
+                                    cancel=job_cancel)
+            return result
+        finally:
+            queue.finish(job["id"], result or {"success": False, "error": "interrupted"})
+
+
+def run_remote(args, filename: str, queue, cancel: CancelToken = None) -> dict:
+    """
+    Hand the job to supervisor workers and wait for the result.
+
+    Args:
+        queue: This host's JobQueue, or a coordination backend shared by several hosts
+        cancel: Cancelling stops the job on whichever worker runs it
+    """
+    with queue:
+        admission = queue.submit(args.prompt, args.lane, args.deadline, payload={
+            "filename": filename,
+            "timeout": args.timeout,
+            "total_timeout": args.total_timeout,
+            "hedge": args.hedge or None,
+            "profile": args.profile or None
+        })
+        if not admission["admitted"]:
+            return rejected_result(admission["reason"], admission["estimated_start"])
+        print(f"   → Submitted to workers, estimated start in {admission['estimated_start']:.0f}s")
+
+        while True:
+            if cancel is not None and cancel.cancelled:
+                queue.cancel(admission["job_id"])
+                return cancelled_result()
+            job = queue.get(admission["job_id"])
+            if job["state"] in (DONE, FAILED, CANCELLED):
+                return json.loads(job["result"])
+            if job["state"] not in (QUEUED, RUNNING):
+                return rejected_result(f"job {job['state']}")
+            time.sleep(0.5)
+
+
+def find_similar(prompt: str, threshold: float, filename: str):
+    """
+    Reuse the image of a previously generated, similar enough prompt.
+
+    Returns:
+        dict: JSON result pointing at a new alias of that image, or None
+    """
+    try:
+        with PromptIndex() as index:
+            # Exact repeats first: they are found however crowded their buckets are
+            match = index.find_exact(prompt) or index.find(prompt, threshold)
+        if not match or not match["digest"]:
+            return None
+        with ImageStore() as store:
+            filename = store.alias(match["digest"], filename)
+            if not filename:
+                return None
+    except Exception as e:
+        print(f"⚠️  Similar prompt lookup failed: {e}")
+        return None
+
+    print(f"   ✓ Reusing image of similar prompt ({match['similarity']:.2f}): '{match['prompt']}'")
+    return {
+        "success": True,
+        "url": output_storage.publish(OUTPUT_DIR / filename, filename, match["digest"]),
+        "filename": filename,
+        "sha256": match["digest"],
+        "prompt": prompt,
+        "reused": True,
+        "similarity": match["similarity"],
+        "matched_prompt": match["prompt"]
+    }
+
+
+def share_result(result: dict, filename: str) -> dict:
+    """
+    Adapt a coalesced result for this caller.
+
+    Successful images get their own public filename (a hardlink to the same
+    blob), so each caller can pin or lose its copy independently.
+    """
+    shared = dict(result, coalesced=True)
+    if not result.get("success") or not result.get("sha256"):
+        return shared
+
+    try:
+        with ImageStore() as store:
+            filename = store.alias(result["sha256"], filename)
+            if filename:
+                shared["url"] = output_storage.publish(OUTPUT_DIR / filename, filename,
+                                                       result["sha256"])
+                shared["filename"] = filename
+    except Exception as e:
+        print(f"⚠️  Could not alias shared image, reusing {result['filename']}: {e}")
+    return shared
 
 
 def main():
     parser = argparse.ArgumentParser(description="NanoBanana Pro Image Generator")
     parser.add_argument("--prompt", required=True, help="Image generation prompt")
     parser.add_argument("--timeout", type=int, default=180, help="Timeout in seconds")
+    parser.add_argument("--total-timeout", type=int, default=270,
+                        help="Budget for all retries in seconds (route.ts kills at 300)")
+    parser.add_argument("--hedge", action="store_true",
+                        help="Hedge slow jobs on a second tab (see hedging.py)")
+    parser.add_argument("--profile", action="store_true",
+                        help="Write a round-trip profile of the job (see profiler.py)")
+    parser.add_argument("--reuse-threshold", type=float, default=PROMPT_REUSE_THRESHOLD,
+                        help="Reuse an existing image if a prompt is at least this similar (0-1)")
+    parser.add_argument("--worker", type=int, help="Use cloned worker profile N (see profile_manager.py)")
+    parser.add_argument("--lane", choices=list(LANES), default=DEFAULT_LANE,
+                        help=f"Priority lane (default: {DEFAULT_LANE})")
+    parser.add_argument("--deadline", type=float, default=290,
+                        help="Seconds until the result is no longer useful (route.ts kills at 300)")
     args = parser.parse_args()
+    started = time.time()
+
+    # route.ts stops us with SIGTERM (timeout, client gone): finish cooperatively
+    cancel = CancelToken()
+    install_signal_handlers(cancel)
 
     # Ensure directories exist
     DATA_DIR.mkdir(parents=True, exist_ok=True)
@@ -44,41 +332,73 @@ def main():
         print(json.dumps(result, ensure_ascii=False))
         return 1
 
-    # Generate unique filename
-    try:
-        from nanoid import generate
-        filename = f"{generate(size=12)}.png"
-    except ImportError:
-        import uuid
-        filename = f"{uuid.uuid4().hex[:12]}.png"
+    filename = new_filename()
 
-    output_path = OUTPUT_DIR / filename
+    # Cloned worker profiles let several generators run side by side
+    user_data_dir = None
+    state_file = None
+    if args.worker is not None:
+        profile_dir, state_file = worker_paths(args.worker)
+        if not profile_dir.exists():
+            result = {
+                "success": False,
+                "error": f"worker-{args.worker} のプロファイルがありません。profile_manager.py clone を実行してください。"
+            }
+            print(json.dumps(result, ensure_ascii=False))
+            return 1
+        user_data_dir = str(profile_dir)
 
-    # Generate image (headless mode)
-    success = generate_image(
-        prompt=args.prompt,
-        output_path=str(output_path),
-        show_browser=False,
-        timeout=args.timeout
-    )
+    # Near-duplicate of an earlier prompt: hand out the existing image
+    if args.reuse_threshold:
+        result = find_similar(args.prompt, args.reuse_threshold, filename)
+        if result:
+            result = await_upload(result, max(1.0, started + args.deadline - time.time()))
+            print(json.dumps(result, ensure_ascii=False))
+            return 0 if result["success"] else 1
 
-    if success and output_path.exists():
-        # Return relative URL for web access
-        relative_url = f"/uploads/ai-generated/{filename}"
-        result = {
-            "success": True,
-            "url": relative_url,
-            "filename": filename,
-            "prompt": args.prompt
-        }
+    # Workers (of any host, or of this host's supervisor) take the job;
+    # otherwise run it here
+    backend = get_backend() if args.worker is None else None
+    supervisor = supervisor_status() if args.worker is None and not backend else None
+    if backend:
+        run = lambda: run_remote(args, filename, backend, cancel)
+    elif supervisor:
+        run = lambda: run_remote(args, filename, JobQueue(slots=supervisor["workers"]), cancel)
     else:
-        result = {
-            "success": False,
-            "error": "画像生成に失敗しました。プロンプトを変更して再試行してください。"
-        }
+        run = lambda: run_scheduled(args, filename, user_data_dir, state_file, cancel)
+
+    # Identical requests already in flight share a single Gemini round trip.
+    # Options that change how the job runs are part of the key, so e.g. a
+    # tight interactive job never waits on a bulk leader with a later deadline
+    key = request_key(args.prompt, lane=args.lane, deadline=args.deadline,
+                      timeout=args.timeout, total_timeout=args.total_timeout,
+                      hedge=args.hedge, profile=args.profile,
+                      reuse_threshold=args.reuse_threshold)
+    try:
+        result, shared = SingleFlight().do(key, run, cancel=cancel)
+    except GenerationError as e:
+        if e.kind != FailureKind.CANCELLED:
+            raise
+        result, shared = cancelled_result(), False
+    if shared:
+        result = share_result(result, filename)
+
+    # route.ts answers as soon as it reads the JSON line: only hand out a URL that works
+    result = await_upload(result, max(1.0, started + args.deadline - time.time()))
+    print(json.dumps(result, ensure_ascii=False), flush=True)
+
+    # Disk budget, now that route.ts has its answer (a supervisor runs its own passes)
+    if not supervisor and not backend:
+        try:
+            with ImageStore() as store:
+                store.enforce_if_due()
+        except Exception as e:
+            print(f"⚠️  Image retention failed: {e}")
 
-    print(json.dumps(result, ensure_ascii=False))
-    return 0 if success else 1
+    # Uploads this result does not depend on may finish after route.ts answered
+    if not output_storage.shutdown(STORAGE_DRAIN_TIMEOUT):
+        print("⚠️  Uploads still pending, left in the spool (python output_storage.py drain)")
+    return 0 if result["success"] else 1
 
 
 if __name__ == "__main__":
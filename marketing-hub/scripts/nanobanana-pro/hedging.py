@@ -0,0 +1,53 @@
+"""
+Hedged requests for Gemini Image Generator
+Decides when a slow job should also be submitted on a second tab
+
+Gemini image latency has a long tail. Once a job has waited longer than
+HEDGE_PERCENTILE of recent latencies (from the timing log), the same prompt
+is sent again on a second tab in the same browser context; whichever tab
+shows an image first wins and the other is closed.
+
+Hedging doubles the Gemini work of a job, so it is capped: when more than
+HEDGE_MAX_FRACTION of recent jobs were hedged, new jobs are not hedged.
+"""
+
+from typing import Optional
+
+from config import (
+    HEDGE_PERCENTILE,
+    HEDGE_MIN_SAMPLES,
+    HEDGE_MAX_FRACTION,
+    TIMINGS_WINDOW
+)
+from timings import TimingLog, percentile
+
+
+class HedgePolicy:
+    """Computes the hedge delay for a new job from recorded timings"""
+
+    def __init__(self, log: Optional[TimingLog] = None,
+                 pct: float = HEDGE_PERCENTILE,
+                 min_samples: int = HEDGE_MIN_SAMPLES,
+                 max_fraction: float = HEDGE_MAX_FRACTION):
+        self.log = log or TimingLog()
+        self.pct = pct
+        self.min_samples = min_samples
+        self.max_fraction = max_fraction
+
+    def hedge_after(self) -> Optional[float]:
+        """
+        Seconds after sending at which to hedge, or None to not hedge.
+
+        Returns None until enough timings are recorded, and while the share
+        of recently hedged jobs is at or above the capacity cap.
+        """
+        recent = self.log.recent(TIMINGS_WINDOW)
+        latencies = [r["latency"] for r in recent if r.get("latency") is not None]
+        if len(latencies) < self.min_samples:
+            return None
+
+        hedged = sum(1 for r in recent if r.get("hedged"))
+        if hedged / len(recent) >= self.max_fraction:
+            return None
+
+        return percentile(latencies, self.pct)
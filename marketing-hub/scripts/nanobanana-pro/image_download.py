@@ -0,0 +1,391 @@
+"""
+Streaming image download for Gemini Image Generator
+Saves generated images chunk by chunk: validated, hashed and renamed into place
+
+Downloading with response.body() or decoding the whole data URI holds
+several full copies of the image in Python at once, and a crash halfway
+through write_bytes() left a partial file in the public uploads directory.
+
+Here the browser loads the image and Python pulls it in DOWNLOAD_CHUNK_SIZE
+slices, so memory per worker stays flat however large the image is. http
+URLs (Gemini serves images from googleusercontent.com, cross-origin) go
+through the browser's network stack over CDP (Network.loadNetworkResource,
+read with IO.read): the page's cookies apply and CORS does not. data:,
+blob: and same-origin images are fetched by the page itself into a Blob
+and sliced. Each chunk goes to ImageSink, which:
+
+- writes to a hidden temp file (".<name>.<random>.part") next to the
+  output (same filesystem)
+- identifies the format (PNG, JPEG, WebP, GIF) and its dimensions from the
+  first bytes, and aborts at once on anything else (e.g. an HTML error
+  page), on dimensions outside IMAGE_MIN_SIDE/IMAGE_MAX_PIXELS and beyond
+  IMAGE_MAX_BYTES
+- computes the sha256 in the same pass (handed to ImageStore.put, which
+  then doesn't read the file again)
+- renames the file into place with os.replace() only once it is complete,
+  so readers see the whole image or none
+
+Temp files of a process killed mid-download are swept by
+remove_stale_parts() (from ImageStore.enforce()). The output path keeps the
+name it was given; callers rename it to the sniffed format's extension
+(EXTENSIONS) when storing it.
+
+If neither works, the URL is downloaded with page.request (one full copy
+in memory, logged as a warning) and, as a last resort, the element is
+screenshotted to a ".part" temp file; both still go through ImageSink.
+"""
+
+import os
+import time
+import base64
+import hashlib
+from pathlib import Path
+from typing import Optional, Tuple
+
+from config import (
+    DOWNLOAD_CHUNK_SIZE,
+    DOWNLOAD_PART_MAX_AGE,
+    IMAGE_MAX_BYTES,
+    IMAGE_MIN_SIDE,
+    IMAGE_MAX_PIXELS
+)
+from failures import FailureKind, GenerationError
+
+# Bytes within which the dimensions must appear (JPEG metadata comes first)
+HEADER_LIMIT = 256 * 1024
+# Trailing bytes kept to check the end-of-image marker
+TAIL_BYTES = 12
+PNG_SIGNATURE = b"\x89PNG\r\n\x1a\n"
+PNG_END = b"IEND\xaeB`\x82"
+JPEG_END = b"\xff\xd9"
+# JPEG start-of-frame markers (C4, C8 and CC are not frames)
+JPEG_SOF = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+# File extension per sniffed format (Content-Type is "image/<format>")
+EXTENSIONS = {"png": ".png", "jpeg": ".jpg", "gif": ".gif", "webp": ".webp"}
+
+# Fetch the element's image into a Blob kept on window until read
+_FETCH_JS = """
+async (img, key) => {
+    const response = await fetch(img.currentSrc || img.src, {credentials: 'include'});
+    if (!response.ok) throw new Error('HTTP ' + response.status);
+    const blob = await response.blob();
+    window.__nanobananaDownloads = window.__nanobananaDownloads || {};
+    window.__nanobananaDownloads[key] = blob;
+    return {size: blob.size, type: blob.type};
+}
+"""
+_SLICE_JS = """
+async ([key, start, end]) => {
+    const bytes = new Uint8Array(await window.__nanobananaDownloads[key].slice(start, end).arrayBuffer());
+    let binary = '';
+    for (let i = 0; i < bytes.length; i += 0x8000) {
+        binary += String.fromCharCode.apply(null, bytes.subarray(i, i + 0x8000));
+    }
+    return btoa(binary);
+}
+"""
+_RELEASE_JS = "key => { if (window.__nanobananaDownloads) delete window.__nanobananaDownloads[key]; }"
+
+
+def _jpeg_size(data: bytes) -> Optional[Tuple[int, int]]:
+    i = 2
+    while True:
+        while i < len(data) and data[i] != 0xFF:
+            i += 1
+        while i < len(data) and data[i] == 0xFF:
+            i += 1
+        if i + 3 > len(data):
+            return None
+        marker = data[i]
+        i += 1
+        if marker == 0x01 or 0xD0 <= marker <= 0xD8:
+            continue  # No payload
+        if marker == 0xDA:
+            raise ValueError("JPEG scan data before any frame header")
+        length = int.from_bytes(data[i:i + 2], "big")
+        if marker in JPEG_SOF:
+            if i + 7 > len(data):
+                return None
+            height = int.from_bytes(data[i + 3:i + 5], "big")
+            width = int.from_bytes(data[i + 5:i + 7], "big")
+            return width, height
+        i += length
+
+
+def sniff(header: bytes) -> Optional[Tuple[str, int, int]]:
+    """
+    Identify an image from its first bytes.
+
+    Returns:
+        tuple: (format, width, height), or None if more bytes are needed
+
+    Raises:
+        ValueError: Not a supported image
+    """
+    if len(header) < 12:
+        return None
+    if header.startswith(PNG_SIGNATURE):
+        if len(header) < 24:
+            return None
+        if header[12:16] != b"IHDR":
+            raise ValueError("PNG without IHDR header")
+        return "png", int.from_bytes(header[16:20], "big"), int.from_bytes(header[20:24], "big")
+    if header.startswith(b"\xff\xd8\xff"):
+        size = _jpeg_size(header)
+        return ("jpeg",) + size if size else None
+    if header[:6] in (b"GIF87a", b"GIF89a"):
+        return "gif", int.from_bytes(header[6:8], "little"), int.from_bytes(header[8:10], "little")
+    if header.startswith(b"RIFF") and header[8:12] == b"WEBP":
+        if len(header) < 30:
+            return None
+        chunk = header[12:16]
+        if chunk == b"VP8 ":
+            return ("webp", int.from_bytes(header[26:28], "little") & 0x3FFF,
+                    int.from_bytes(header[28:30], "little") & 0x3FFF)
+        if chunk == b"VP8L":
+            bits = int.from_bytes(header[21:25], "little")
+            return "webp", (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+        if chunk == b"VP8X":
+            return ("webp", int.from_bytes(header[24:27], "little") + 1,
+                    int.from_bytes(header[27:30], "little") + 1)
+        raise ValueError(f"Unknown WebP chunk {chunk!r}")
+    raise ValueError(f"Not an image (starts with {header[:12]!r})")
+
+
+class ImageSink:
+    """Temp file that validates and hashes an image as it is written, then replaces the output"""
+
+    def __init__(self, output_path: str, max_bytes: int = IMAGE_MAX_BYTES,
+                 min_side: int = IMAGE_MIN_SIDE, max_pixels: int = IMAGE_MAX_PIXELS):
+        self.output_path = Path(output_path)
+        self.max_bytes = max_bytes
+        self.min_side = min_side
+        self.max_pixels = max_pixels
+        self.size = 0
+        self.info = None  # (format, width, height) once known
+        self._hash = hashlib.sha256()
+        self._header = b""
+        self._tail = b""
+        self._file = None
+        self._tmp = None
+
+    def __enter__(self):
+        self.output_path.parent.mkdir(parents=True, exist_ok=True)
+        # Like mkstemp, but with the usual umask-based mode: the image is served publicly
+        self._tmp = self.output_path.parent / f".{self.output_path.name}.{os.urandom(6).hex()}.part"
+        fd = os.open(self._tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o666)
+        self._file = os.fdopen(fd, "wb")
+        return self
+
+    def __exit__(self, *exc):
+        self.abort()  # No-op after commit()
+
+    def write(self, chunk: bytes):
+        self.size += len(chunk)
+        if self.size > self.max_bytes:
+            raise ValueError(f"Image larger than {self.max_bytes} bytes")
+        if self.info is None:
+            self._header += chunk[:HEADER_LIMIT]
+            self._check_header()
+        self._hash.update(chunk)
+        self._tail = (self._tail + chunk[-TAIL_BYTES:])[-TAIL_BYTES:]
+        self._file.write(chunk)
+
+    def write_file(self, path: Path, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(chunk_size), b""):
+                self.write(chunk)
+
+    def _check_header(self):
+        info = sniff(self._header)
+        if info is None:
+            if len(self._header) >= HEADER_LIMIT:
+                raise ValueError(f"No image dimensions within the first {HEADER_LIMIT} bytes")
+            return
+        _, width, height = info
+        if min(width, height) < self.min_side or width * height > self.max_pixels:
+            raise ValueError(f"Implausible image size {width}x{height}")
+        self.info = info
+        self._header = b""
+
+    def commit(self) -> dict:
+        """
+        Finish the file and move it to output_path.
+
+        Returns:
+            dict: {"sha256", "bytes", "format", "width", "height"}
+        """
+        if self.info is None:
+            raise ValueError(f"Truncated image ({self.size} bytes)")
+        image_format, width, height = self.info
+        if image_format == "png" and not self._tail.endswith(PNG_END):
+            raise ValueError("Truncated PNG (no IEND chunk)")
+        if image_format == "jpeg" and JPEG_END not in self._tail:
+            raise ValueError("Truncated JPEG (no end-of-image marker)")
+
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._tmp, self.output_path)
+        self._tmp = None
+        return {"sha256": self._hash.hexdigest(), "bytes": self.size,
+                "format": image_format, "width": width, "height": height}
+
+    def abort(self):
+        """Drop the temp file (the output is left as it was)."""
+        if self._file and not self._file.closed:
+            self._file.close()
+        if self._tmp:
+            try:
+                os.unlink(self._tmp)
+            except OSError:
+                pass
+            self._tmp = None
+
+
+def with_extension(filename: str, image_format: Optional[str]) -> str:
+    """filename with the extension of image_format (unchanged if the format is unknown)."""
+    if image_format not in EXTENSIONS:
+        return filename
+    return str(Path(filename).with_suffix(EXTENSIONS[image_format]))
+
+
+def remove_stale_parts(directory: Path, max_age: float = DOWNLOAD_PART_MAX_AGE) -> int:
+    """
+    Delete ImageSink temp files left by processes that died mid-download.
+
+    Files modified within max_age seconds may belong to a download still in
+    progress and are kept. Returns the number removed.
+    """
+    cutoff = time.time() - max_age
+    removed = 0
+    for path in Path(directory).glob(".*.part"):
+        try:
+            if path.stat().st_mtime < cutoff:
+                path.unlink()
+                removed += 1
+        except OSError:
+            pass  # Committed or removed by its owner meanwhile
+    return removed
+
+
+def stream_from_page(page, image_element, sink: ImageSink, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+    """Fetch the element's image inside the page and copy it over in slices."""
+    key = os.urandom(8).hex()
+    blob = image_element.evaluate(_FETCH_JS, key)
+    try:
+        if blob["size"] > sink.max_bytes:
+            raise ValueError(f"Image larger than {sink.max_bytes} bytes")
+        for start in range(0, blob["size"], chunk_size):
+            sink.write(base64.b64decode(page.evaluate(_SLICE_JS, [key, start, start + chunk_size])))
+    finally:
+        try:
+            page.evaluate(_RELEASE_JS, key)
+        except Exception:
+            pass
+
+
+def stream_over_cdp(page, url: str, sink: ImageSink, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+    """Load url through the browser's network stack (cookies, no CORS) and read it in chunks."""
+    session = page.context.new_cdp_session(page)
+    try:
+        frame_id = session.send("Page.getFrameTree")["frameTree"]["frame"]["id"]
+        resource = session.send("Network.loadNetworkResource", {
+            "frameId": frame_id,
+            "url": url,
+            "options": {"disableCache": False, "includeCredentials": True}
+        })["resource"]
+        status = resource.get("httpStatusCode") or 0
+        if not resource.get("success") or status >= 400:
+            raise ValueError(f"HTTP {status} {resource.get('netErrorName', '')}".strip())
+        handle = resource["stream"]
+        try:
+            while True:
+                chunk = session.send("IO.read", {"handle": handle, "size": chunk_size})
+                data = chunk.get("data", "")
+                sink.write(base64.b64decode(data) if chunk.get("base64Encoded") else data.encode())
+                if chunk.get("eof"):
+                    break
+        finally:
+            session.send("IO.close", {"handle": handle})
+    finally:
+        session.detach()
+
+
+def write_data_uri(src: str, sink: ImageSink, chunk_size: int = DOWNLOAD_CHUNK_SIZE):
+    """Decode a base64 data URI in slices (no full-size decoded copy), ignoring whitespace."""
+    if ";base64," not in src[:src.index(",") + 1]:
+        raise ValueError("Data URI is not base64-encoded")
+    start = src.index(",") + 1
+    step = chunk_size // 3 * 4  # Whole base64 quanta
+    carry = ""  # Characters of an incomplete quantum (whitespace shifts the alignment)
+    for offset in range(start, len(src), step):
+        text = carry + "".join(src[offset:offset + step].split())
+        whole = len(text) - len(text) % 4
+        sink.write(base64.b64decode(text[:whole], validate=True))
+        carry = text[whole:]
+    if carry:
+        raise ValueError("Truncated base64 data")
+
+
+def download_image(page, image_element, output_path: str,
+                   chunk_size: int = DOWNLOAD_CHUNK_SIZE) -> dict:
+    """
+    Save a generated image element to output_path.
+
+    Tries the CDP stream (http URLs), the in-page stream, the data URI,
+    page.request (full copy in memory) and finally a screenshot of the
+    element.
+
+    Returns:
+        dict: {"sha256", "bytes", "format", "width", "height", "method"}
+
+    Raises:
+        GenerationError: DOWNLOAD if every method failed
+    """
+    errors = []
+
+    def attempt(method, fill):
+        with ImageSink(output_path) as sink:
+            fill(sink)
+            return dict(sink.commit(), method=method)
+
+    src = ""
+    try:
+        src = image_element.evaluate("img => img.currentSrc || img.src") or ""
+    except Exception as e:
+        errors.append(f"src: {e}")
+
+    if src.startswith("http"):
+        try:
+            return attempt("cdp", lambda sink: stream_over_cdp(page, src, sink, chunk_size))
+        except Exception as e:
+            errors.append(f"cdp: {e}")
+
+    try:
+        return attempt("stream", lambda sink: stream_from_page(page, image_element, sink, chunk_size))
+    except Exception as e:
+        errors.append(f"stream: {e}")
+
+    try:
+        if src.startswith("data:"):
+            print("   → Decoding base64 image...")
+            return attempt("data", lambda sink: write_data_uri(src, sink, chunk_size))
+        if src.startswith("http"):
+            print("   ⚠️  Streaming failed, reading the whole image into memory (page.request)...")
+            return attempt("request", lambda sink: sink.write(page.request.get(src).body()))
+    except Exception as e:
+        errors.append(f"src: {e}")
+
+    print("   → Using screenshot fallback...")
+    output = Path(output_path)
+    # Named like ImageSink temp files, so remove_stale_parts() sweeps it after a crash
+    shot = output.parent / f".{output.name}.{os.urandom(6).hex()}.shot.part"
+    try:
+        image_element.screenshot(path=str(shot), type="png")
+        return attempt("screenshot", lambda sink: sink.write_file(shot, chunk_size))
+    except Exception as e:
+        errors.append(f"screenshot: {e}")
+    finally:
+        shot.unlink(missing_ok=True)
+    raise GenerationError(FailureKind.DOWNLOAD, "Image download failed (" + "; ".join(errors) + ")")
@@ -10,6 +10,13 @@ Usage:
 
     # With reference image (NEW!)
     python scripts/run.py image_generator.py --prompt "犬を描いて" --reference-image ref.png --output output.png
+
+Library use (one browser for many images):
+    from image_generator import ImageGenerator
+
+    with ImageGenerator() as generator:
+        result = generator.generate("sunset over the sea", "out/sunset.png")
+        results = generator.generate_many([("a cat", "out/cat.png"), ("a dog", "out/dog.png")])
 """
 
 import sys
@@ -17,8 +24,7 @@ import json
 import argparse
 import time
 from pathlib import Path
-from patchright.sync_api import sync_playwright
-import base64
+from typing import Iterable, List, Union
 
 # Add parent to path for imports
 sys.path.insert(0, str(Path(__file__).parent))
@@ -29,9 +35,28 @@ from config import (
     STATE_FILE,
     OUTPUT_DIR,
     DEFAULT_TIMEOUT,
-    GEMINI_URL
+    GEMINI_URL,
+    MAX_ATTEMPTS,
+    MIN_ATTEMPT_SECONDS,
+    HEDGE_ENABLED,
+    RESPONSE_APPEAR_TIMEOUT
+)
+from browser_utils import ManagedBrowser, StealthUtils
+from failures import (
+    FailureKind,
+    GenerationError,
+    GenerationResult,
+    RETRY_POLICIES,
+    classify_exception
 )
-from browser_utils import BrowserFactory, StealthUtils
+from timings import TimingLog
+from hedging import HedgePolicy
+from circuit_breaker import CircuitBreaker, STRUCTURAL_FAILURES
+from phash_index import PHashIndex
+from flight_recorder import FlightRecorder
+from image_download import download_image
+from cancellation import CancelToken, POLL_INTERVAL as CANCEL_POLL_INTERVAL
+import profiler
 
 def ensure_output_dir():
     """Create output directory if it doesn't exist."""
@@ -84,308 +109,922 @@ def check_authenticated():
     except Exception:
         return False
 
-def generate_image(prompt: str, output_path: str, show_browser: bool = False, timeout: int = 180):
-    """
-    Generate image using Gemini with persistent browser context.
+# Step 1: "🍌 画像の作成" suggestion chip (New UI - 2026+)
+IMAGE_GEN_SELECTORS = [
+    # New UI (2026): Suggestion chip below input - full aria-label match
+    'button:has-text("🍌 画像の作成")',
+    'button:has-text("画像の作成、ボタン")',
+    # Partial text match
+    'button:has-text("画像の作成")',
+    # Role-based selector
+    'button[role="button"]:has-text("画像")',
+    # Generic text match
+    '*:has-text("画像の作成"):visible',
+]
+
+INPUT_SELECTORS = [
+    'div[contenteditable="true"]',
+    'textarea[placeholder*="プロンプト"]',
+    'textarea[placeholder*="画像"]',
+    'textarea',
+    'rich-textarea textarea',
+]
+
+SEND_SELECTORS = [
+    'button[aria-label*="送信"]',
+    'button[aria-label*="Send"]',
+    'button:has-text("生成")',
+    'button:has-text("Generate")',
+    'button[mattooltip*="Send"]',
+    'button.send-button',
+]
+
+# Generated image (improved selectors from sales_letter_generator)
+IMAGE_SELECTORS = [
+    'img[src*="lh3.googleusercontent"]',
+    'img[src*="googleusercontent"]',
+    'div[class*="response"] img',
+    'model-response img',
+]
+
+# Any sign that Gemini started answering (used to tell "slow" from "broken")
+RESPONSE_SELECTORS = [
+    'model-response',
+    'message-content',
+    'div[class*="response"]',
+]
+
+# "Stop response" button shown while Gemini is still answering
+STOP_SELECTORS = [
+    'button[aria-label*="停止"]',
+    'button[aria-label*="Stop"]',
+    'button[mattooltip*="Stop"]',
+    'button.stop',
+]
+
+# Error messages (Japanese and English)
+ERROR_TEXTS = [
+    "画像を生成できません",
+    "生成できませんでした",
+    "申し訳",
+    "I cannot help",
+    "Unable to generate",
+    "Sorry"
+]
+
+
+def _goto(page, url: str, cancel: CancelToken = None):
+    """page.goto() that a cancellation interrupts while the page is still loading."""
+    if cancel is None:
+        page.goto(url, wait_until="domcontentloaded", timeout=30000)
+        return
+
+    cancel.check()
+    deadline = time.time() + 30
+    page.goto(url, wait_until="commit", timeout=30000)
+    while True:
+        cancel.check()
+        try:
+            page.wait_for_load_state("domcontentloaded", timeout=CANCEL_POLL_INTERVAL * 1000)
+            return
+        except Exception as e:
+            if type(e).__name__ != "TimeoutError" or time.time() > deadline:
+                raise
+
+
+def _pause(page, ms: int, cancel: CancelToken = None):
+    """page.wait_for_timeout() in short slices, checking for cancellation."""
+    if cancel is None:
+        page.wait_for_timeout(ms)
+        return
+
+    end = time.time() + ms / 1000
+    while True:
+        cancel.check()
+        remaining = end - time.time()
+        if remaining <= 0:
+            return
+        page.wait_for_timeout(min(remaining, CANCEL_POLL_INTERVAL) * 1000)
+
+
+def _open_fresh_chat(page, cancel: CancelToken = None):
+    """Navigate to a fresh Gemini chat. Raises AUTH_REQUIRED on sign-in redirect."""
+    print(f"   → Opening Gemini ({GEMINI_URL})...")
+    _goto(page, GEMINI_URL, cancel)
+
+    # Wait for page to be ready
+    _pause(page, 3000, cancel)
+
+    # Check if redirected to sign-in
+    if "accounts.google.com" in page.url or "signin" in page.url.lower():
+        raise GenerationError(
+            FailureKind.AUTH_REQUIRED,
+            "Not authenticated. Run: python scripts/run.py auth_manager.py setup"
+        )
 
-    Args:
-        prompt: Image generation prompt
-        output_path: Path to save generated image
-        show_browser: Whether to show browser window
-        timeout: Maximum wait time in seconds (default: 180)
+    # Ensure we're on a fresh chat page (not a conversation)
+    if '/app/c' in page.url or '/app/' not in page.url:
+        print("   → Navigating to fresh chat...")
+        _goto(page, "https://gemini.google.com/app", cancel)
+        _pause(page, 3000, cancel)
 
-    Returns:
-        bool: True if successful
-    """
-    ensure_output_dir()
 
-    print(f"🎨 Generating image with prompt: '{prompt}'")
-    print(f"   Output: {output_path}")
-    print(f"   Max wait time: {timeout}s")
+def _activate_image_mode(page) -> bool:
+    """Click the "画像の作成" chip. Returns False if it could not be found."""
+    print("   → Looking for '画像の作成' button...")
+
+    image_gen_button = None
+    for selector in IMAGE_GEN_SELECTORS:
+        try:
+            locator = page.locator(selector)
+            if locator.count() > 0:
+                for i in range(locator.count()):
+                    btn = locator.nth(i)
+                    if btn.is_visible():
+                        # Check if it's clickable (not just text)
+                        bbox = btn.bounding_box()
+                        if bbox and bbox['width'] > 50:
+                            image_gen_button = btn
+                            print(f"   ✓ Found image generation button: {selector}")
+                            break
+            if image_gen_button:
+                break
+        except:
+            continue
+
+    if not image_gen_button:
+        return False
 
-    playwright = None
-    context = None
+    # Click to activate NanoBanana (image generation mode)
+    image_gen_button.click()
+    page.wait_for_timeout(2000)
+    print("   → NanoBanana (画像の作成) activated")
+    return True
 
-    try:
-        playwright = sync_playwright().start()
 
-        # Use persistent context (key improvement!)
-        context = BrowserFactory.launch_persistent_context(
-            playwright,
-            headless=not show_browser
+def _find_input(page):
+    """Locate the prompt input. Raises INPUT_NOT_FOUND."""
+    print("   → Finding input field...")
+
+    input_element = None
+    for selector in INPUT_SELECTORS:
+        try:
+            if page.locator(selector).count() > 0:
+                input_element = page.locator(selector).first
+                if input_element.is_visible():
+                    print(f"   ✓ Found input: {selector}")
+                    break
+        except:
+            continue
+
+    if not input_element:
+        raise GenerationError(
+            FailureKind.INPUT_NOT_FOUND,
+            "Could not find input field. UI may have changed."
         )
+    return input_element
 
-        # Get or create page
-        page = context.pages[0] if context.pages else context.new_page()
 
-        # Navigate to Gemini
-        print(f"   → Opening Gemini ({GEMINI_URL})...")
-        page.goto(GEMINI_URL, wait_until="domcontentloaded", timeout=30000)
+def _send_prompt(page, input_element, prompt: str):
+    """Type the prompt and click send (Enter key as fallback)."""
+    print("   → Typing prompt...")
+    input_element.click()
+    StealthUtils.random_delay(200, 500)
+    input_element.fill(prompt)
+    page.wait_for_timeout(500)
 
-        # Wait for page to be ready
-        page.wait_for_timeout(3000)
+    print("   → Sending request...")
+    send_button = None
+    for selector in SEND_SELECTORS:
+        try:
+            locator = page.locator(selector)
+            if locator.count() > 0:
+                for i in range(locator.count()):
+                    btn = locator.nth(i)
+                    if btn.is_visible():
+                        send_button = btn
+                        print(f"   ✓ Found send button: {selector}")
+                        break
+            if send_button:
+                break
+        except:
+            continue
 
-        # Check if redirected to sign-in
-        if "accounts.google.com" in page.url or "signin" in page.url.lower():
-            print("❌ Not authenticated. Run: python scripts/run.py auth_manager.py setup")
-            context.close()
-            playwright.stop()
-            return False
+    if not send_button:
+        # Try Enter key as fallback
+        print("   → Send button not found, trying Enter key...")
+        input_element.press("Enter")
+    else:
+        send_button.click()
 
-        # First, ensure we're on a fresh chat page (not a conversation)
-        if '/app/c' in page.url or '/app/' not in page.url:
-            print("   → Navigating to fresh chat...")
-            page.goto("https://gemini.google.com/app", wait_until="domcontentloaded", timeout=30000)
-            page.wait_for_timeout(3000)
-
-        # Step 1: Try to find and click "🍌 画像の作成" button (New UI - 2026+)
-        # The button is now a suggestion chip below the input field
-        print("   → Looking for '画像の作成' button...")
-
-        image_gen_selectors = [
-            # New UI (2026): Suggestion chip below input - full aria-label match
-            'button:has-text("🍌 画像の作成")',
-            'button:has-text("画像の作成、ボタン")',
-            # Partial text match
-            'button:has-text("画像の作成")',
-            # Role-based selector
-            'button[role="button"]:has-text("画像")',
-            # Generic text match
-            '*:has-text("画像の作成"):visible',
-        ]
 
-        image_gen_button = None
-        for selector in image_gen_selectors:
-            try:
-                locator = page.locator(selector)
-                if locator.count() > 0:
-                    for i in range(locator.count()):
-                        btn = locator.nth(i)
-                        if btn.is_visible():
-                            # Check if it's clickable (not just text)
-                            bbox = btn.bounding_box()
-                            if bbox and bbox['width'] > 50:
-                                image_gen_button = btn
-                                print(f"   ✓ Found image generation button: {selector}")
-                                break
-                if image_gen_button:
-                    break
-            except:
-                continue
+def _prepare_tab(page, cancel: CancelToken = None) -> bool:
+    """Open a fresh chat and switch to image mode. Returns whether image mode is on."""
+    _open_fresh_chat(page, cancel)
+    return _activate_image_mode(page)
 
-        if image_gen_button:
-            # Click to activate NanoBanana (image generation mode)
-            image_gen_button.click()
-            page.wait_for_timeout(2000)
-            print("   → NanoBanana (画像の作成) activated")
-        else:
-            # Fallback: Add image generation prefix to prompt
-            print("   → '画像の作成' button not found, using prompt-based approach...")
-            prompt = f"画像を生成してください: {prompt}"
-
-        # Step 3: Find input field (now in NanoBanana mode)
-        print("   → Finding input field...")
-        input_selectors = [
-            'div[contenteditable="true"]',
-            'textarea[placeholder*="プロンプト"]',
-            'textarea[placeholder*="画像"]',
-            'textarea',
-            'rich-textarea textarea',
-        ]
 
-        input_element = None
-        for selector in input_selectors:
-            try:
-                if page.locator(selector).count() > 0:
-                    input_element = page.locator(selector).first
-                    if input_element.is_visible():
-                        print(f"   ✓ Found input: {selector}")
-                        break
-            except:
-                continue
+def _submit(page, prompt: str, image_mode: bool = None, cancel: CancelToken = None):
+    """
+    Open a fresh chat, switch to image mode and send the prompt.
 
-        if not input_element:
-            print("❌ Could not find input field. UI may have changed.")
-            print("   Try running with --show-browser to debug")
-            context.close()
-            playwright.stop()
-            return False
+    Pass image_mode for a tab that _prepare_tab already prepared (standby
+    pool); the prompt is then typed right away.
+    """
+    if image_mode is None:
+        image_mode = _prepare_tab(page, cancel)
 
-        # Type prompt
-        print("   → Typing prompt...")
-        input_element.click()
-        StealthUtils.random_delay(200, 500)
-        input_element.fill(prompt)
-        page.wait_for_timeout(500)
-
-        # Step 4: Find and click send button
-        print("   → Sending request...")
-        send_selectors = [
-            'button[aria-label*="送信"]',
-            'button[aria-label*="Send"]',
-            'button:has-text("生成")',
-            'button:has-text("Generate")',
-            'button[mattooltip*="Send"]',
-            'button.send-button',
-        ]
+    if not image_mode:
+        # Fallback: Add image generation prefix to prompt
+        print("   → '画像の作成' button not found, using prompt-based approach...")
+        prompt = f"画像を生成してください: {prompt}"
 
-        send_button = None
-        for selector in send_selectors:
-            try:
-                locator = page.locator(selector)
-                if locator.count() > 0:
-                    for i in range(locator.count()):
-                        btn = locator.nth(i)
-                        if btn.is_visible():
-                            send_button = btn
-                            print(f"   ✓ Found send button: {selector}")
-                            break
-                if send_button:
-                    break
-            except:
-                continue
+    input_element = _find_input(page)
+    if cancel:
+        cancel.check()  # Last point before Gemini starts working for us
+    _send_prompt(page, input_element, prompt)
 
-        if not send_button:
-            # Try Enter key as fallback
-            print("   → Send button not found, trying Enter key...")
-            input_element.press("Enter")
-        else:
-            send_button.click()
-
-        # Wait for image generation
-        print(f"   → Waiting for image generation (max {timeout}s)...")
-        print("      This may take 30-180 seconds...")
-
-        # Try to find generated image (improved selectors from sales_letter_generator)
-        image_selectors = [
-            'img[src*="lh3.googleusercontent"]',
-            'img[src*="googleusercontent"]',
-            'div[class*="response"] img',
-            'model-response img',
-        ]
 
-        image_found = False
-        image_element = None
-        start_time = time.time()
-
-        while time.time() - start_time < timeout:
-            elapsed = int(time.time() - start_time)
-            if elapsed % 30 == 0 and elapsed > 0:
-                print(f"      ... {elapsed}s elapsed")
-
-            for selector in image_selectors:
-                try:
-                    locator = page.locator(selector)
-                    count = locator.count()
-                    if count > 0:
-                        for i in range(count):
-                            img = locator.nth(i)
-                            if img.is_visible():
-                                src = img.get_attribute('src') or ''
-                                if 'googleusercontent' in src:
-                                    # Check image size to ensure it's the generated image
-                                    bbox = img.bounding_box()
-                                    if bbox and bbox['width'] > 200 and bbox['height'] > 200:
-                                        print("   ✓ Image generated!")
-                                        image_found = True
-                                        image_element = img
-                                        break
-                        if image_found:
-                            break
-                except:
-                    continue
+def _stop_response(page) -> bool:
+    """Click Gemini's stop button so a cancelled answer stops generating."""
+    for selector in STOP_SELECTORS:
+        try:
+            button = page.locator(selector).first
+            if button.count() > 0 and button.is_visible():
+                button.click(timeout=2000)
+                print("   → Stopped Gemini's response")
+                return True
+        except Exception:
+            continue
+    return False
 
-            if image_found:
-                break
 
-            # Check for error messages (Japanese and English)
-            error_texts = [
-                "画像を生成できません",
-                "生成できませんでした",
-                "申し訳",
-                "I cannot help",
-                "Unable to generate",
-                "Sorry"
-            ]
-            for error_text in error_texts:
-                try:
-                    if page.locator(f'text="{error_text}"').count() > 0:
-                        print("❌ Gemini declined to generate the image")
-                        context.close()
-                        playwright.stop()
-                        return False
-                except:
-                    pass
-
-            page.wait_for_timeout(2000)
-
-        if not image_found:
-            print(f"❌ Timeout after {timeout}s - image not generated")
-            context.close()
-            playwright.stop()
-            return False
+def _still_generating(page) -> bool:
+    """Check whether Gemini is still answering (stop button visible)."""
+    for selector in STOP_SELECTORS:
+        try:
+            button = page.locator(selector).first
+            if button.count() > 0 and button.is_visible():
+                return True
+        except Exception:
+            continue
+    return False
 
-        # Download image
-        print("   → Downloading image...")
 
+def _find_generated_image(page):
+    """Return the generated image element if it is on the page, else None."""
+    for selector in IMAGE_SELECTORS:
         try:
-            # Get image source
-            img_src = image_element.get_attribute("src")
+            locator = page.locator(selector)
+            count = locator.count()
+            for i in range(count):
+                img = locator.nth(i)
+                if img.is_visible():
+                    src = img.get_attribute('src') or ''
+                    if 'googleusercontent' in src:
+                        # Check image size to ensure it's the generated image
+                        bbox = img.bounding_box()
+                        if bbox and bbox['width'] > 200 and bbox['height'] > 200:
+                            return img
+        except:
+            continue
+    return None
+
+
+def _declined(page) -> bool:
+    """Check whether Gemini answered with a refusal message."""
+    for error_text in ERROR_TEXTS:
+        try:
+            if page.locator(f'text="{error_text}"').count() > 0:
+                return True
+        except:
+            pass
+    return False
+
 
-            if img_src.startswith("data:"):
-                # Base64 encoded image
-                print("   → Saving base64 image...")
-                img_data = img_src.split(",")[1]
-                img_bytes = base64.b64decode(img_data)
+def _response_started(page) -> bool:
+    """Check whether any response element has appeared after sending."""
+    for selector in RESPONSE_SELECTORS:
+        try:
+            if page.locator(selector).count() > 0:
+                return True
+        except:
+            continue
+    return False
 
-                output_file = Path(output_path)
-                output_file.parent.mkdir(parents=True, exist_ok=True)
-                output_file.write_bytes(img_bytes)
 
-            elif img_src.startswith("http"):
-                # URL image
-                print("   → Downloading from URL...")
-                response = page.request.get(img_src)
-                img_bytes = response.body()
+def _wait_for_image(page, timeout: float, hedge_after: float = None, prompt: str = None,
+                    cancel: CancelToken = None):
+    """
+    Poll for the generated image. Raises DECLINED, NO_RESPONSE, NO_IMAGE or TIMEOUT.
 
-                output_file = Path(output_path)
-                output_file.parent.mkdir(parents=True, exist_ok=True)
-                output_file.write_bytes(img_bytes)
+    If no response element shows up within RESPONSE_APPEAR_TIMEOUT the UI is
+    assumed broken (NO_RESPONSE) instead of waiting out the full timeout.
+    At the timeout, a response that has finished without any IMAGE_SELECTORS
+    match is a selector problem (NO_IMAGE); only one still being generated
+    is a plain TIMEOUT.
 
-            else:
-                # Try screenshot as fallback
-                print("   → Using screenshot fallback...")
-                image_element.screenshot(path=output_path)
+    With hedge_after set, the prompt is also submitted on a second tab once
+    that many seconds have passed; the first tab to show an image wins. The
+    main tab always stays open for the caller: if the hedge tab wins, the
+    main tab's response is only stopped, and the caller closes the hedge tab
+    once the image is saved. A losing hedge tab is closed here.
 
-            print(f"\n✓ Image saved to: {output_path}")
-            context.close()
-            playwright.stop()
-            return True
+    A cancellation is noticed within one poll (about 2s); the hedge tab is
+    stopped and closed, the main tab is left to the caller.
 
-        except Exception as e:
-            print(f"❌ Error downloading image: {e}")
-            print("   → Trying screenshot fallback...")
+    Returns:
+        tuple: (page, image_element, hedge) where hedge is None, "won" or "lost"
+    """
+    print(f"   → Waiting for image generation (max {int(timeout)}s)...")
+    print("      This may take 30-180 seconds...")
+
+    pages = [page]
+    hedge_page = None
+    response_seen = False
+    start_time = time.time()
+
+    while time.time() - start_time < timeout:
+        if cancel is not None and cancel.cancelled:
+            if hedge_page and hedge_page in pages:
+                _stop_response(hedge_page)
+                _close_quietly(hedge_page)
+            cancel.check()
+
+        elapsed = int(time.time() - start_time)
+        if elapsed % 30 == 0 and elapsed > 0:
+            print(f"      ... {elapsed}s elapsed")
+
+        if not response_seen:
+            response_seen = _response_started(page)
+            if not response_seen and elapsed >= RESPONSE_APPEAR_TIMEOUT:
+                raise GenerationError(
+                    FailureKind.NO_RESPONSE,
+                    f"No response after {elapsed}s. UI may have changed."
+                )
+
+        for candidate in list(pages):
+            image_element = _find_generated_image(candidate)
+            if image_element:
+                print("   ✓ Image generated!")
+                hedge = None
+                if hedge_page:
+                    hedge = "won" if candidate is hedge_page else "lost"
+                    if candidate is hedge_page:
+                        _stop_response(page)
+                    elif hedge_page in pages:
+                        _close_quietly(hedge_page)
+                return candidate, image_element, hedge
+
+            if _declined(candidate):
+                pages.remove(candidate)
+                if candidate is hedge_page:
+                    _close_quietly(candidate)
+                if not pages:
+                    raise GenerationError(FailureKind.DECLINED, "Gemini declined to generate the image")
+
+        if hedge_after is not None and hedge_page is None and time.time() - start_time >= hedge_after:
+            print(f"   → Slow job (>{hedge_after:.0f}s), hedging on a second tab...")
+            hedge_page = page.context.new_page()
             try:
-                image_element.screenshot(path=output_path)
-                print(f"✓ Image saved via screenshot: {output_path}")
-                context.close()
-                playwright.stop()
-                return True
-            except Exception as e2:
-                print(f"❌ Screenshot also failed: {e2}")
-                context.close()
-                playwright.stop()
-                return False
+                _submit(hedge_page, prompt, cancel=cancel)
+                pages.append(hedge_page)
+            except Exception as e:
+                print(f"   ⚠️  Hedge submit failed: {e}")
+                _close_quietly(hedge_page)
+
+        pages[0].wait_for_timeout(2000)
+
+    finished = response_seen and not any(_still_generating(p) for p in pages)
+    if hedge_page:
+        _close_quietly(hedge_page)
+    if finished:
+        raise GenerationError(
+            FailureKind.NO_IMAGE,
+            f"Response finished but no image found after {int(timeout)}s. UI may have changed."
+        )
+    raise GenerationError(FailureKind.TIMEOUT, f"Timeout after {int(timeout)}s - image not generated")
+
+
+def _close_quietly(page):
+    try:
+        page.close()
+    except Exception:
+        pass
+
+
+def _save_image(page, image_element, output_path: str) -> dict:
+    """Stream the image to output_path (see image_download.py). Raises DOWNLOAD."""
+    print("   → Downloading image...")
+    saved = download_image(page, image_element, output_path)
+    print(f"\n✓ Image saved to: {output_path} "
+          f"({saved['format']} {saved['width']}x{saved['height']}, {saved['method']})")
+    return saved
+
 
+def _save_with_retries(page, image_element, output_path: str, cancel: CancelToken = None) -> dict:
+    """
+    Save the image, retrying failed downloads on the page that generated it.
+
+    Retries follow the DOWNLOAD policy and re-locate the image element
+    first. Only if the image is gone from the page does the DOWNLOAD error
+    let the attempt loop resubmit the prompt; a download that keeps failing
+    on an image that is still there is not retried again.
+    """
+    policy = RETRY_POLICIES[FailureKind.DOWNLOAD]
+    failures = 0
+    while True:
+        try:
+            return _save_image(page, image_element, output_path)
+        except GenerationError as e:
+            failures += 1
+            if failures >= policy.max_attempts:
+                raise GenerationError(FailureKind.DOWNLOAD, e.message, retryable=False)
+            print(f"   ↻ Retrying download on the same image (attempt {failures + 1})...")
+            delay = policy.delay(failures)
+            if cancel:
+                cancel.wait(delay)
+                cancel.check()
+            else:
+                time.sleep(delay)
+            image_element = _find_generated_image(page)
+            if image_element is None:
+                raise GenerationError(FailureKind.DOWNLOAD,
+                                      f"{e.message}; image no longer on the page")
+
+
+def _index_perceptual_hash(output_path: str):
+    """Add a saved image to the perceptual-hash index (best effort, needs Pillow)."""
+    try:
+        with PHashIndex() as index:
+            index.add(output_path)
     except Exception as e:
-        print(f"\n❌ Error: {e}")
-        print("   Try running with --show-browser to see what went wrong")
-        if context:
-            context.close()
-        if playwright:
-            playwright.stop()
+        print(f"   ⚠️  Perceptual hash skipped: {e}")
+
+
+def probe_ui(page) -> bool:
+    """
+    Cheap health check of the Gemini UI (half-open circuit probe).
+
+    Loads a fresh chat, switches to image mode and looks for the prompt
+    input without sending anything, and checks that every IMAGE_SELECTORS
+    entry still parses. A fresh chat has no image to match, so the probe
+    job's own first attempt completes the check (see generate_with_context).
+    On success the tab is left on the fresh chat in image mode.
+    """
+    print("   → Probing Gemini UI...")
+    try:
+        _open_fresh_chat(page)
+        if not _activate_image_mode(page):
+            raise GenerationError(FailureKind.INPUT_NOT_FOUND, "Image-mode chip not found. UI may have changed.")
+        _find_input(page)
+        for selector in IMAGE_SELECTORS:
+            page.locator(selector).count()  # Raises on a selector the page engine rejects
+        return True
+    except Exception as e:
+        print(f"   ⚠️  Probe failed: {e}")
         return False
 
+
+def _circuit_open_result(breaker: CircuitBreaker) -> GenerationResult:
+    status = breaker.status()
+    message = (f"Circuit open after repeated UI failures ({status.get('reason')}); "
+               f"retry in {status.get('retry_after', 0)}s")
+    print(f"❌ {message}")
+    return GenerationResult(success=False, failure=FailureKind.CIRCUIT_OPEN, message=message)
+
+
+def _run_attempt(page, prompt: str, output_path: str, timeout: float,
+                 hedge_after: float = None, timings: dict = None,
+                 recorder: FlightRecorder = None, image_mode: bool = None,
+                 cancel: CancelToken = None):
+    """
+    One end-to-end attempt on a page. Raises GenerationError on failure.
+
+    Phase durations are written into timings as they complete, so a failed
+    attempt still reports how far it got.
+
+    Returns:
+        dict: The saved image (sha256, bytes, format, width, height)
+    """
+    timings = timings if timings is not None else {}
+
+    phase_start = time.time()
+    with profiler.phase("submit"):
+        _submit(page, prompt, image_mode, cancel)
+        timings["submit"] = round(time.time() - phase_start, 2)
+        if recorder:
+            recorder.mark("submitted")
+            if recorder.submit_snapshots:
+                recorder.snapshot(page, "submitted")
+
+    phase_start = time.time()
+    try:
+        with profiler.phase("wait"):
+            winner, image_element, hedge = _wait_for_image(page, timeout, hedge_after, prompt, cancel)
+    except GenerationError as e:
+        if e.kind == FailureKind.TIMEOUT:
+            # Censored sample: the job took at least this long
+            timings["wait"] = round(time.time() - phase_start, 2)
+            if hedge_after is not None and timings["wait"] >= hedge_after:
+                timings["hedge"] = "lost"
+        raise
+    timings["wait"] = round(time.time() - phase_start, 2)
+    timings["hedge"] = hedge
+    if recorder:
+        recorder.mark("image found", hedge=hedge)
+
+    phase_start = time.time()
+    try:
+        with profiler.phase("save"):
+            saved = _save_with_retries(winner, image_element, output_path, cancel)
+    finally:
+        if winner is not page:
+            _close_quietly(winner)  # Hedge tab; the caller carries on with its own page
+    timings["save"] = round(time.time() - phase_start, 2)
+    return saved
+
+
+def generate_with_context(context, prompt: str, output_path: str,
+                          timeout: float = DEFAULT_TIMEOUT,
+                          total_timeout: float = None,
+                          hedge: bool = None,
+                          breaker: CircuitBreaker = None,
+                          admission: str = None,
+                          job_id: str = None,
+                          standby=None,
+                          cancel: CancelToken = None,
+                          profile: bool = None) -> GenerationResult:
+    """
+    Generate an image in an already launched browser context.
+
+    Failed attempts are classified and retried according to RETRY_POLICIES:
+    navigation errors are retried at once on a fresh tab, timeouts with
+    backoff, declines and auth failures never. A cancelled job stops
+    Gemini's response and hands its tab back to the standby pool.
+
+    Args:
+        context: Persistent browser context
+        prompt: Image generation prompt
+        output_path: Path to save generated image
+        timeout: Maximum wait for the image per attempt, in seconds
+        total_timeout: Budget for all attempts together (default: no limit)
+        hedge: Hedge slow jobs on a second tab (default: HEDGE_ENABLED)
+        breaker: Circuit breaker to consult and update (default: shared CIRCUIT_FILE)
+        admission: Result of breaker.allow() if the caller already asked
+        job_id: Name of the flight record kept on failure (default: output file stem)
+        standby: StandbyPool of prepared tabs to start attempts on (standby_pool.py)
+        cancel: CancelToken checked while waiting (cancellation.py)
+        profile: Write a round-trip profile of the job (default: PROFILE_ENABLED, see profiler.py)
+
+    Returns:
+        GenerationResult: Truthy on success; failure class otherwise
+    """
+    job_profile = profiler.start(job_id or Path(output_path).stem, enabled=profile)
+    generation = None
+    try:
+        generation = _generate_with_context(context, prompt, output_path, timeout, total_timeout,
+                                            hedge, breaker, admission, job_id, standby, cancel)
+        return generation
+    finally:
+        if job_profile:
+            report = job_profile.finish(
+                success=bool(generation),
+                failure=generation.failure.value if generation and generation.failure else None)
+            if generation is not None:
+                generation.timings.update(job_profile.summary())
+            if report:
+                print(f"   ⏱ Profile saved: {report}")
+
+
+def _generate_with_context(context, prompt: str, output_path: str, timeout: float,
+                           total_timeout: float, hedge: bool, breaker: CircuitBreaker,
+                           admission: str, job_id: str, standby,
+                           cancel: CancelToken) -> GenerationResult:
+    start = time.time()
+    breaker = breaker or CircuitBreaker()
+    if admission is None:
+        admission = breaker.allow()
+    if admission == CircuitBreaker.OPEN:
+        return _circuit_open_result(breaker)
+
+    probing = admission == CircuitBreaker.PROBE
+    try:
+        # A standby tab skips navigation and image-mode setup; the probe needs a plain tab
+        tab = standby.take(context) if standby and admission == CircuitBreaker.CLOSED else None
+        if tab:
+            page, image_mode = tab
+        else:
+            page = standby.spare_page(context) if standby else (
+                context.pages[0] if context.pages else context.new_page())
+            image_mode = None
+        if probing:
+            with profiler.phase("probe"):
+                ok = probe_ui(page)
+            if not ok:
+                breaker.probe_result(False)
+                return _circuit_open_result(breaker)
+            image_mode = True  # probe_ui left the tab on a fresh chat in image mode
+    except BaseException:
+        if probing:
+            breaker.probe_abandoned()  # No verdict; let the next job probe
+        raise
+
+    failures = []
+    timing_log = TimingLog()
+    recorder = FlightRecorder(job_id or Path(output_path).stem)
+    recorder.attach(context)
+
+    if hedge is None:
+        hedge = HEDGE_ENABLED
+    hedge_after = HedgePolicy(timing_log).hedge_after() if hedge else None
+
+    while True:
+        attempt_timeout = timeout
+        if total_timeout:
+            attempt_timeout = min(timeout, total_timeout - (time.time() - start))
+
+        timings = {"standby": image_mode is not None} if standby else {}
+        try:
+            saved = _run_attempt(page, prompt, output_path, attempt_timeout, hedge_after, timings,
+                                 recorder, image_mode, cancel)
+            if probing:
+                breaker.probe_result(True)
+            else:
+                breaker.record(None)
+            recorder.finish(failed=False)
+            timings["recorder_ms"] = recorder.overhead_ms
+            _index_perceptual_hash(output_path)
+            timing_log.record(latency=timings["wait"], success=True,
+                              hedged=timings["hedge"] is not None,
+                              hedge_won=timings["hedge"] == "won",
+                              attempts=len(failures) + 1,
+                              recorder_ms=timings["recorder_ms"])
+            return GenerationResult(
+                success=True,
+                output_path=output_path,
+                attempts=len(failures) + 1,
+                elapsed=round(time.time() - start, 2),
+                failures=failures,
+                timings=timings,
+                hedged=timings["hedge"] is not None,
+                digest=saved["sha256"],
+                image_format=saved["format"]
+            )
+        except GenerationError as e:
+            error = e
+        except Exception as e:
+            error = GenerationError(classify_exception(e), str(e))
+
+        failures.append(error.kind)
+        profiler.enter_phase("recovery")
+        image_mode = None  # The tab is no longer on a fresh chat
+        if error.kind == FailureKind.CANCELLED:
+            print(f"   ⏹ {error.message}")
+            _stop_response(page)
+            if probing:
+                breaker.probe_abandoned()
+            if standby:
+                standby.release(page)
+            recorder.finish(failed=False)  # Nothing went wrong; no flight record
+            return GenerationResult(
+                success=False,
+                failure=error.kind,
+                message=error.message,
+                attempts=len(failures),
+                elapsed=round(time.time() - start, 2),
+                failures=failures,
+                timings=timings
+            )
+        print(f"❌ {error.message}")
+        recorder.mark("failed", failure=error.kind.value, message=error.message[:500])
+        recorder.snapshot(page, f"attempt{len(failures)}-{error.kind.value}")
+        if probing:
+            # The probe's first attempt also confirms the image selectors
+            breaker.probe_result(error.kind not in STRUCTURAL_FAILURES)
+            probing = False
+        else:
+            breaker.record(error.kind)
+
+        policy = RETRY_POLICIES[error.kind]
+        kind_failures = failures.count(error.kind)
+        delay = policy.delay(kind_failures)
+        remaining = total_timeout - (time.time() - start) if total_timeout else None
+
+        out_of_budget = remaining is not None and remaining - delay < MIN_ATTEMPT_SECONDS
+        give_up = (not error.retryable or kind_failures >= policy.max_attempts
+                   or len(failures) >= MAX_ATTEMPTS or out_of_budget or breaker.is_open())
+        record_dir = recorder.finish(failed=True, failure=error.kind.value,
+                                     message=error.message) if give_up else None
+        timing_log.record(latency=timings.get("wait"), success=False,
+                          failure=error.kind.value,
+                          hedged=timings.get("hedge") is not None,
+                          recorder_ms=recorder.overhead_ms,
+                          final=give_up)
+        if give_up:
+            timings["recorder_ms"] = recorder.overhead_ms
+            return GenerationResult(
+                success=False,
+                failure=error.kind,
+                message=error.message,
+                attempts=len(failures),
+                elapsed=round(time.time() - start, 2),
+                failures=failures,
+                timings=timings,
+                flight_record=str(record_dir) if record_dir else None
+            )
+
+        print(f"   ↻ Retrying after {error.kind.value} (attempt {len(failures) + 1})...")
+        if delay:
+            if cancel:
+                cancel.wait(delay)  # A cancellation surfaces at the next attempt's first check
+            else:
+                time.sleep(delay)
+        if policy.fresh_tab:
+            stale_page = page
+            tab = standby.take(context) if standby else None
+            if tab:
+                page, image_mode = tab
+            else:
+                page = context.new_page()
+            try:
+                stale_page.close()
+            except Exception:
+                pass
+
+
+class ImageGenerator:
+    """
+    Reusable generation session: one browser for many images.
+
+    Owns the Playwright instance and the persistent browser context (through
+    ManagedBrowser, so long sessions are recycled by job count, memory and
+    idle time like worker browsers) and the tabs in it. Only the first
+    generate() pays for the browser launch; its timings include "launch".
+
+    Results are GenerationResult objects with timings and failure classes,
+    exactly as from generate_with_context().
+    """
+
+    def __init__(self, show_browser: bool = False, user_data_dir: str = None,
+                 state_file: Path = None, timeout: float = DEFAULT_TIMEOUT,
+                 total_timeout: float = None, hedge: bool = None,
+                 breaker: CircuitBreaker = None, profile: bool = None, **browser_options):
+        """
+        Args:
+            show_browser: Whether to show the browser window
+            user_data_dir: Browser profile to use (default: BROWSER_PROFILE_DIR)
+            state_file: Storage state for cookie re-injection (default: STATE_FILE)
+            timeout: Default maximum wait per attempt, in seconds
+            total_timeout: Default budget for all retries of one image (default: no limit)
+            hedge: Hedge slow jobs on a second tab (default: HEDGE_ENABLED)
+            breaker: Circuit breaker to use (default: shared CIRCUIT_FILE)
+            profile: Write a round-trip profile per image (default: PROFILE_ENABLED)
+            **browser_options: Passed to ManagedBrowser (runtime, lite, max_jobs, ...)
+        """
+        self.timeout = timeout
+        self.total_timeout = total_timeout
+        self.hedge = hedge
+        self.profile = profile
+        self.breaker = breaker or CircuitBreaker()
+        self.browser = ManagedBrowser(headless=not show_browser, user_data_dir=user_data_dir,
+                                      state_file=state_file, **browser_options)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def start(self):
+        """Launch the browser now instead of on the first generate()."""
+        return self.browser.start()
+
+    def close(self):
+        """Close the browser and stop Playwright."""
+        self.browser.shutdown()
+
+    def generate(self, prompt: str, output_path: str, timeout: float = None,
+                 total_timeout: float = None, hedge: bool = None, job_id: str = None,
+                 cancel: CancelToken = None) -> GenerationResult:
+        """
+        Generate one image in this session.
+
+        Args default to the values given to the constructor.
+
+        Returns:
+            GenerationResult: Truthy on success; failure class otherwise
+        """
+        Path(output_path).parent.mkdir(parents=True, exist_ok=True)
+
+        print(f"🎨 Generating image with prompt: '{prompt}'")
+        print(f"   Output: {output_path}")
+        print(f"   Max wait time: {timeout or self.timeout}s")
+
+        # Reject before paying for a browser launch while the circuit is open
+        admission = self.breaker.allow()
+        if admission == CircuitBreaker.OPEN:
+            return _circuit_open_result(self.breaker)
+
+        try:
+            launches = self.browser.launches
+            with self.browser.job() as context:
+                generation = generate_with_context(
+                    context, prompt, output_path,
+                    timeout=timeout or self.timeout,
+                    total_timeout=total_timeout or self.total_timeout,
+                    hedge=self.hedge if hedge is None else hedge,
+                    breaker=self.breaker,
+                    admission=admission,
+                    job_id=job_id,
+                    cancel=cancel,
+                    profile=self.profile
+                )
+                self._tidy(context)
+            if self.browser.launches != launches:
+                generation.timings["launch"] = self.browser.last_launch_seconds
+            return generation
+
+        except Exception as e:
+            if admission == CircuitBreaker.PROBE:
+                # Browser launch or the job itself failed before a verdict
+                self.breaker.probe_abandoned()
+            print(f"\n❌ Error: {e}")
+            print("   Try running with --show-browser to see what went wrong")
+            return GenerationResult(success=False, failure=classify_exception(e),
+                                    message=str(e), attempts=1)
+
+    def generate_many(self, jobs: Iterable[Union[tuple, dict]],
+                      cancel: CancelToken = None) -> List[GenerationResult]:
+        """
+        Generate several images one after another on the same browser.
+
+        Args:
+            jobs: (prompt, output_path) tuples, or dicts with "prompt",
+                  "output_path" and optionally the other generate() arguments
+            cancel: Stops the current image and skips the rest
+
+        Returns:
+            list: One GenerationResult per job, in order. Once authentication
+                  fails or the job is cancelled, the remaining jobs are not
+                  attempted and get the same failure with attempts=0.
+        """
+        results = []
+        stop = None
+        for job in jobs:
+            options = dict(job) if isinstance(job, dict) else {"prompt": job[0], "output_path": job[1]}
+            if stop is None and cancel is not None and cancel.cancelled:
+                stop = FailureKind.CANCELLED
+            if stop is not None:
+                results.append(GenerationResult(success=False, failure=stop,
+                                                message="Skipped", attempts=0))
+                continue
+            result = self.generate(cancel=cancel, **options)
+            results.append(result)
+            if result.failure in (FailureKind.AUTH_REQUIRED, FailureKind.CANCELLED):
+                stop = result.failure
+        return results
+
+    @staticmethod
+    def _tidy(context):
+        # Keep one tab between jobs. After a won hedge or a fresh-tab retry the
+        # original tab is gone, so the next job takes whatever tab is left.
+        for page in context.pages[1:]:
+            _close_quietly(page)
+
+
+def generate_image(prompt: str, output_path: str, show_browser: bool = False, timeout: int = 180,
+                   user_data_dir: str = None, state_file: Path = None,
+                   total_timeout: float = None, hedge: bool = None,
+                   cancel: CancelToken = None, profile: bool = None) -> GenerationResult:
+    """
+    Generate image using Gemini with persistent browser context.
+
+    Convenience wrapper around a one-image ImageGenerator session; use
+    ImageGenerator directly to generate several images on one browser.
+
+    Args:
+        prompt: Image generation prompt
+        output_path: Path to save generated image
+        show_browser: Whether to show browser window
+        timeout: Maximum wait time in seconds (default: 180)
+        user_data_dir: Browser profile to use (default: BROWSER_PROFILE_DIR)
+        state_file: Storage state for cookie re-injection (default: STATE_FILE)
+        total_timeout: Budget for all retries together (default: no limit)
+        hedge: Hedge slow jobs on a second tab (default: HEDGE_ENABLED)
+        cancel: CancelToken that stops the job early (cancellation.py)
+        profile: Write a round-trip profile of the job (default: PROFILE_ENABLED)
+
+    Returns:
+        GenerationResult: Truthy if successful; carries the failure class otherwise
+    """
+    ensure_output_dir()
+    with ImageGenerator(show_browser=show_browser, user_data_dir=user_data_dir,
+                        state_file=state_file, timeout=timeout,
+                        total_timeout=total_timeout, hedge=hedge, profile=profile) as generator:
+        return generator.generate(prompt, output_path, cancel=cancel)
+
+
 def main():
     parser = argparse.ArgumentParser(description="Generate images with Gemini")
     parser.add_argument(
@@ -417,6 +1056,11 @@ def main():
         default=180,
         help="Maximum wait time in seconds (default: 180)"
     )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write a round-trip profile of the job (see profiler.py)"
+    )
 
     args = parser.parse_args()
 
@@ -473,7 +1117,8 @@ def main():
         prompt=final_prompt,
         output_path=args.output,
         show_browser=args.show_browser,
-        timeout=args.timeout
+        timeout=args.timeout,
+        profile=args.profile or None
     )
 
     return 0 if success else 1
@@ -0,0 +1,437 @@
+#!/usr/bin/env python3
+"""
+Content-addressed image store for generated images
+Stores each unique image once and maps public filenames (nanoid URLs) to it
+
+Layout:
+    OUTPUT_DIR/.blobs/ab/abcdef....png   # one file per unique image (sha256)
+    OUTPUT_DIR/<nanoid>.png              # hardlink to the blob (public URL)
+
+The index lives in IMAGE_STORE_DB (SQLite) and keeps a running byte total,
+so the retention manager evicts least-recently-served, unpinned blobs without
+ever rescanning the directory. Storing identical bytes again and every alias
+(prompt reuse, coalesced callers, matrix cache hits) count as a serve;
+images created or served within RETENTION_GRACE are never evicted, as their
+URL may still be on its way to a caller.
+
+Filenames are references: each alias records when it was last served, and
+a blob is only evicted once none of its filenames was served within
+ALIAS_RETENTION, so a URL handed to a caller stays valid at least that
+long. If live filenames alone exceed the budget, enforce() stops over
+budget rather than break them.
+
+Retention runs periodically, never on a job's path: the supervisor calls
+enforce_if_due() every RETENTION_INTERVAL, and so does a standalone
+generate.py once its result is out. Blobs and filenames carry the
+extension of the sniffed image format, and enforce() also sweeps temp files
+left by crashed downloads.
+
+Usage:
+    python image_store.py stats                  # Show store statistics
+    python image_store.py enforce                # Evict down to OUTPUT_MAX_BYTES
+    python image_store.py enforce --max-bytes 1073741824
+    python image_store.py enforce --grace 0 --alias-retention 0   # Ignore recent serves
+    python image_store.py pin <filename>         # Protect an image from eviction
+    python image_store.py unpin <filename>
+    python image_store.py touch <filename>       # Record that an image was served
+"""
+
+import sys
+import os
+import json
+import time
+import shutil
+import sqlite3
+import hashlib
+import argparse
+from typing import Optional
+from pathlib import Path
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from image_download import EXTENSIONS, remove_stale_parts
+from config import (
+    IMAGE_STORE_DB,
+    BLOB_DIR,
+    OUTPUT_DIR,
+    OUTPUT_MAX_BYTES,
+    RETENTION_BATCH,
+    RETENTION_GRACE,
+    ALIAS_RETENTION,
+    RETENTION_INTERVAL
+)
+
+HASH_CHUNK_SIZE = 1024 * 1024
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    digest TEXT PRIMARY KEY,
+    ext TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created_at REAL NOT NULL,
+    last_served REAL NOT NULL,
+    pins INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS blobs_lru ON blobs (pins, last_served);
+CREATE TABLE IF NOT EXISTS aliases (
+    filename TEXT PRIMARY KEY,
+    digest TEXT NOT NULL REFERENCES blobs (digest),
+    created_at REAL NOT NULL,
+    last_served REAL NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS aliases_digest ON aliases (digest);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('total_bytes', 0);
+INSERT OR IGNORE INTO meta (key, value) VALUES ('last_enforced', 0);
+"""
+
+# Blobs that may go: unpinned, not recently served, and no filename in use
+_VICTIMS_SQL = """
+SELECT digest, ext, size FROM blobs b
+WHERE pins = 0 AND last_served < ?
+  AND NOT EXISTS (SELECT 1 FROM aliases a WHERE a.digest = b.digest AND a.last_served >= ?)
+ORDER BY last_served LIMIT ?
+"""
+
+
+def file_digest(path: Path) -> str:
+    """Return the sha256 hex digest of a file, read in chunks."""
+    h = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def _link_or_copy(src: Path, dst: Path):
+    """Hardlink src to dst, falling back to a copy across filesystems."""
+    try:
+        os.link(src, dst)
+    except OSError:
+        shutil.copy2(src, dst)
+
+
+class ImageStore:
+    """Content-addressed storage with LRU retention for OUTPUT_DIR"""
+
+    def __init__(self, db_path: Path = IMAGE_STORE_DB,
+                 output_dir: Path = OUTPUT_DIR,
+                 blob_dir: Path = BLOB_DIR):
+        self.output_dir = Path(output_dir)
+        self.blob_dir = Path(blob_dir)
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+
+        # Autocommit mode; writes use explicit BEGIN IMMEDIATE so that
+        # concurrent generate.py processes serialize cleanly
+        self.db = sqlite3.connect(str(db_path), timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(aliases)")}
+        if "last_served" not in columns:
+            self.db.execute("ALTER TABLE aliases ADD COLUMN last_served REAL NOT NULL DEFAULT 0")
+            self.db.execute("UPDATE aliases SET last_served = created_at")
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def blob_path(self, digest: str, ext: str) -> Path:
+        return self.blob_dir / digest[:2] / f"{digest}{ext}"
+
+    def put(self, src_path: str, filename: str, digest: Optional[str] = None,
+            image_format: Optional[str] = None) -> str:
+        """
+        Store an image and publish it under OUTPUT_DIR/filename.
+
+        If identical bytes are already stored, the new filename becomes a
+        hardlink to the existing blob and src_path is discarded.
+
+        Args:
+            src_path: Freshly written image (may already be OUTPUT_DIR/filename)
+            filename: Public filename (e.g. nanoid-based "xxxx.jpg"), with the
+                      extension of image_format
+            digest: Precomputed sha256 of the file, if known
+            image_format: Sniffed format ("png", "jpeg", ...); sets the blob's
+                          extension (default: the file's own)
+
+        Returns:
+            str: sha256 digest of the stored image
+        """
+        src = Path(src_path)
+        alias_path = self.output_dir / filename
+        if digest is None:
+            digest = file_digest(src)
+        ext = EXTENSIONS.get(image_format) or src.suffix or alias_path.suffix or ".png"
+        now = time.time()
+
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            row = self.db.execute(
+                "SELECT ext FROM blobs WHERE digest = ?", (digest,)
+            ).fetchone()
+
+            if row:
+                blob = self.blob_path(digest, row[0])
+            else:
+                blob = self.blob_path(digest, ext)
+                blob.parent.mkdir(parents=True, exist_ok=True)
+                _link_or_copy(src, blob)
+                size = blob.stat().st_size
+                self.db.execute(
+                    "INSERT INTO blobs (digest, ext, size, created_at, last_served) "
+                    "VALUES (?, ?, ?, ?, ?)",
+                    (digest, ext, size, now, now)
+                )
+                self.db.execute(
+                    "UPDATE meta SET value = value + ? WHERE key = 'total_bytes'", (size,)
+                )
+
+            # Point the public filename at the blob
+            if alias_path.exists():
+                alias_path.unlink()
+            _link_or_copy(blob, alias_path)
+            if src.exists() and src.resolve() not in (alias_path.resolve(), blob.resolve()):
+                src.unlink()
+
+            self.db.execute(
+                "INSERT OR REPLACE INTO aliases (filename, digest, created_at, last_served) "
+                "VALUES (?, ?, ?, ?)",
+                (filename, digest, now, now)
+            )
+            if row:
+                self.touch(filename)  # Served again under a new name
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+        return digest
+
+    def alias(self, digest: str, filename: str) -> Optional[str]:
+        """
+        Publish an already stored image under an additional filename.
+
+        Counts as a serve: the blob moves to the MRU end.
+
+        Returns:
+            str: The filename published, with the stored image's extension
+                 (e.g. "xxxx.png" becomes "xxxx.jpg"), or None if the blob is gone
+        """
+        row = self.db.execute(
+            "SELECT ext FROM blobs WHERE digest = ?", (digest,)
+        ).fetchone()
+        if not row:
+            return None
+        blob = self.blob_path(digest, row[0])
+        if not blob.exists():
+            return None
+        filename = str(Path(filename).with_suffix(row[0]))
+        self.put(str(blob), filename, digest=digest)
+        return filename
+
+    def lookup(self, filename: str) -> Optional[dict]:
+        """Return blob metadata for a public filename, or None."""
+        row = self.db.execute(
+            "SELECT b.digest, b.ext, b.size, b.created_at, b.last_served, b.pins "
+            "FROM aliases a JOIN blobs b ON a.digest = b.digest WHERE a.filename = ?",
+            (filename,)
+        ).fetchone()
+        if not row:
+            return None
+        keys = ["digest", "ext", "size", "created_at", "last_served", "pins"]
+        return dict(zip(keys, row))
+
+    def touch(self, filename: str) -> bool:
+        """Record that an image was served under filename (moves it to the MRU end)."""
+        now = time.time()
+        cur = self.db.execute(
+            "UPDATE aliases SET last_served = ? WHERE filename = ?", (now, filename))
+        self.db.execute(
+            "UPDATE blobs SET last_served = ? "
+            "WHERE digest = (SELECT digest FROM aliases WHERE filename = ?)",
+            (now, filename)
+        )
+        return cur.rowcount > 0
+
+    def pin(self, filename: str, delta: int = 1) -> bool:
+        """Increment (or with delta=-1, decrement) the pin count of an image."""
+        cur = self.db.execute(
+            "UPDATE blobs SET pins = MAX(pins + ?, 0) "
+            "WHERE digest = (SELECT digest FROM aliases WHERE filename = ?)",
+            (delta, filename)
+        )
+        return cur.rowcount > 0
+
+    def total_bytes(self) -> int:
+        return self.db.execute(
+            "SELECT value FROM meta WHERE key = 'total_bytes'"
+        ).fetchone()[0]
+
+    def enforce(self, max_bytes: int = OUTPUT_MAX_BYTES, grace: float = RETENTION_GRACE,
+                alias_retention: float = ALIAS_RETENTION) -> dict:
+        """
+        Evict least-recently-served, unpinned images until under budget.
+
+        Works from the running byte total and the (pins, last_served) index,
+        so the cost is proportional to the number of evictions, not to the
+        size of OUTPUT_DIR. Images created or served within the last grace
+        seconds are kept even over budget (last_served is never older than
+        created_at), and so are images with a filename served within
+        alias_retention. Temp files of crashed downloads are removed first.
+
+        Returns:
+            dict: {"evicted": count, "freed_bytes": bytes, "total_bytes": bytes,
+                   "stale_parts": temp files removed}
+        """
+        stale_parts = remove_stale_parts(self.output_dir)
+        evicted = 0
+        freed = 0
+        now = time.time()
+
+        while self.total_bytes() > max_bytes:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                excess = self.total_bytes() - max_bytes
+                victims = self.db.execute(
+                    _VICTIMS_SQL, (now - grace, now - alias_retention, RETENTION_BATCH)
+                ).fetchall()
+                if not victims:
+                    self.db.execute("COMMIT")
+                    break
+
+                batch_freed = 0
+                for digest, ext, size in victims:
+                    if batch_freed >= excess:
+                        break
+                    # Every filename of a victim is past alias_retention
+                    aliases = self.db.execute(
+                        "SELECT filename FROM aliases WHERE digest = ?", (digest,)
+                    ).fetchall()
+                    for (filename,) in aliases:
+                        (self.output_dir / filename).unlink(missing_ok=True)
+                    self.blob_path(digest, ext).unlink(missing_ok=True)
+                    self.db.execute("DELETE FROM aliases WHERE digest = ?", (digest,))
+                    self.db.execute("DELETE FROM blobs WHERE digest = ?", (digest,))
+                    batch_freed += size
+                    evicted += 1
+
+                self.db.execute(
+                    "UPDATE meta SET value = MAX(value - ?, 0) WHERE key = 'total_bytes'",
+                    (batch_freed,)
+                )
+                self.db.execute("COMMIT")
+                freed += batch_freed
+            except Exception:
+                self.db.execute("ROLLBACK")
+                raise
+
+        return {"evicted": evicted, "freed_bytes": freed, "total_bytes": self.total_bytes(),
+                "stale_parts": stale_parts}
+
+    def enforce_if_due(self, interval: float = RETENTION_INTERVAL) -> Optional[dict]:
+        """
+        Run enforce() unless another process did within interval seconds.
+
+        Returns:
+            dict: enforce() result, or None if not due
+        """
+        now = time.time()
+        self.db.execute("BEGIN IMMEDIATE")
+        try:
+            last = self.db.execute(
+                "SELECT value FROM meta WHERE key = 'last_enforced'").fetchone()[0]
+            if now - last < interval:
+                self.db.execute("COMMIT")
+                return None
+            self.db.execute("UPDATE meta SET value = ? WHERE key = 'last_enforced'", (now,))
+            self.db.execute("COMMIT")
+        except Exception:
+            self.db.execute("ROLLBACK")
+            raise
+
+        result = self.enforce()
+        if result["total_bytes"] > OUTPUT_MAX_BYTES:
+            print(f"⚠️  Image store over budget ({result['total_bytes']} bytes): "
+                  f"the rest is pinned or served within ALIAS_RETENTION")
+        return result
+
+    def stats(self) -> dict:
+        blobs, pinned = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(pins > 0), 0) FROM blobs"
+        ).fetchone()
+        aliases = self.db.execute("SELECT COUNT(*) FROM aliases").fetchone()[0]
+        return {
+            "blobs": blobs,
+            "aliases": aliases,
+            "pinned": pinned,
+            "total_bytes": self.total_bytes(),
+            "max_bytes": OUTPUT_MAX_BYTES
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Manage the generated image store")
+    parser.add_argument(
+        "action",
+        choices=["stats", "enforce", "pin", "unpin", "touch"],
+        help="Action to perform"
+    )
+    parser.add_argument("filename", nargs="?", help="Public filename (pin/unpin/touch)")
+    parser.add_argument(
+        "--max-bytes",
+        type=int,
+        default=OUTPUT_MAX_BYTES,
+        help=f"Disk budget for enforce (default: {OUTPUT_MAX_BYTES})"
+    )
+    parser.add_argument(
+        "--grace",
+        type=float,
+        default=RETENTION_GRACE,
+        help=f"Keep images created or served this many seconds ago (default: {RETENTION_GRACE})"
+    )
+    parser.add_argument(
+        "--alias-retention",
+        type=float,
+        default=ALIAS_RETENTION,
+        help=f"Keep images with a filename served this many seconds ago (default: {ALIAS_RETENTION})"
+    )
+    args = parser.parse_args()
+
+    with ImageStore() as store:
+        if args.action == "stats":
+            print(json.dumps(store.stats(), indent=2))
+            return 0
+
+        if args.action == "enforce":
+            print(json.dumps(store.enforce(args.max_bytes, args.grace, args.alias_retention),
+                             indent=2))
+            return 0
+
+        if not args.filename:
+            print(f"❌ {args.action} requires a filename")
+            return 1
+
+        if args.action == "pin":
+            ok = store.pin(args.filename)
+        elif args.action == "unpin":
+            ok = store.pin(args.filename, delta=-1)
+        else:
+            ok = store.touch(args.filename)
+
+        if not ok:
+            print(f"❌ Unknown image: {args.filename}")
+        return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
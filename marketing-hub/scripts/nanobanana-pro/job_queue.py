@@ -0,0 +1,501 @@
+#!/usr/bin/env python3
+"""
+Deadline- and priority-aware job queue for Gemini Image Generator
+Schedules generation jobs by lane and deadline, rejecting hopeless ones up front
+
+Jobs go into one of the LANES. A lane is always served before any lane
+after it (interactive editor requests before bulk campaign jobs), and
+within a lane the job with the earliest deadline runs first (EDF).
+
+A job's deadline is when its result stops being useful (route.ts gives up
+after 5 minutes). At submission the queue simulates the current schedule
+with the measured job duration and QUEUE_SLOTS parallel slots. The job is
+rejected right away if it could not finish by its deadline, or if
+admitting it would push an already admitted job of its lane past its own
+deadline. Jobs whose deadline passes while they wait are expired without
+ever touching a browser.
+
+State lives in QUEUE_DB (SQLite, WAL) and is shared by all generator
+processes on the host. Jobs of submitters that died are dropped.
+
+cancel() drops a queued job at once; a running one gets a cancel flag
+that the process running it polls (cancellation.CancelToken), so it
+stops within a second or two and frees its tab.
+
+Usage:
+    python job_queue.py status      # Queue depth, throughput, estimated waits
+    python job_queue.py list        # Queued and running jobs
+    python job_queue.py cancel ID   # Cancel a queued or running job
+"""
+
+import os
+import sys
+import json
+import time
+import heapq
+import sqlite3
+import argparse
+import uuid
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import (
+    QUEUE_DB,
+    QUEUE_SLOTS,
+    QUEUE_DEFAULT_SERVICE_SECONDS,
+    QUEUE_HISTORY_SECONDS
+)
+from failures import FailureKind, FAILURE_MESSAGES
+
+# Lane name -> rank (lower ranks are always served first)
+LANES = {"interactive": 0, "bulk": 1}
+DEFAULT_LANE = "interactive"
+
+POLL_INTERVAL = 0.5
+SERVICE_SAMPLES = 50  # Recent finished jobs averaged for the duration estimate
+SERVICE_MIN_SAMPLES = 3  # Below this, QUEUE_DEFAULT_SERVICE_SECONDS is assumed
+MAX_CLAIMS = 2  # A job whose worker crashed this often is failed, not requeued
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+REJECTED = "rejected"
+EXPIRED = "expired"
+ABANDONED = "abandoned"
+CANCELLED = "cancelled"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    lane INTEGER NOT NULL,
+    deadline REAL NOT NULL,
+    prompt TEXT NOT NULL,
+    payload TEXT,
+    state TEXT NOT NULL,
+    owner_pid INTEGER,
+    slot INTEGER,
+    worker TEXT,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    cancel_requested INTEGER NOT NULL DEFAULT 0,
+    created_at REAL NOT NULL,
+    started_at REAL,
+    finished_at REAL,
+    result TEXT
+);
+CREATE INDEX IF NOT EXISTS jobs_order ON jobs (state, lane, deadline, created_at);
+"""
+
+_ORDER = "ORDER BY lane, deadline, created_at"
+
+
+def _alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return True  # No owner recorded: nobody to outlive
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _job_order(job: dict):
+    return (job["lane"], job["deadline"], job["created_at"])
+
+
+# Result of a job cancelled before it started
+CANCELLED_RESULT = {"success": False, "error": FAILURE_MESSAGES[FailureKind.CANCELLED],
+                    "failure": FailureKind.CANCELLED.value, "cancelled": True, "attempts": 0}
+
+
+def crashed_result(reason: str) -> dict:
+    """Result of a job failed after MAX_CLAIMS claims ended in a crash; reason is for operators."""
+    return {"success": False, "error": FAILURE_MESSAGES[FailureKind.UNKNOWN],
+            "failure": FailureKind.UNKNOWN.value, "detail": reason}
+
+
+def finished_state(result: dict) -> str:
+    if result.get("success"):
+        return DONE
+    return CANCELLED if result.get("cancelled") else FAILED
+
+
+def estimate_starts(now: float, service: float, slots: int,
+                    running_started: List[float], queued: List[dict]) -> Dict[str, float]:
+    """
+    Simulate a queue: estimated start time of every queued job.
+
+    Running jobs occupy their slot until they are expected to finish;
+    queued jobs ({"id", "lane", "deadline", "created_at"}) then take the
+    earliest free slot in lane/EDF order.
+    """
+    free = [now + max(0.0, service - (now - started)) for started in running_started]
+    free += [now] * max(0, slots - len(free))
+    heapq.heapify(free)
+
+    starts = {}
+    for job in sorted(queued, key=_job_order):
+        start = heapq.heappop(free) if free else float("inf")  # No slots at all
+        starts[job["id"]] = start
+        heapq.heappush(free, start + service)
+    return starts
+
+
+def check_admission(now: float, service: float, slots: int,
+                    running_started: List[float], queued: List[dict], job: dict):
+    """
+    Decide whether a new job fits the schedule.
+
+    Returns:
+        tuple: (estimated start, rejection reason or None)
+    """
+    before = estimate_starts(now, service, slots, running_started, queued)
+    after = estimate_starts(now, service, slots, running_started, queued + [job])
+
+    start = after[job["id"]]
+    if start + service > job["deadline"]:
+        return start, (f"estimated start in {start - now:.0f}s, jobs take ~{service:.0f}s, "
+                       f"deadline in {job['deadline'] - now:.0f}s")
+
+    # EDF can reorder: don't break promises already made to the lane
+    for other in queued:
+        if other["lane"] != job["lane"]:
+            continue
+        if (before[other["id"]] + service <= other["deadline"]
+                and after[other["id"]] + service > other["deadline"]):
+            return start, "would push admitted jobs past their deadlines"
+    return start, None
+
+
+class JobQueue:
+    """SQLite-backed EDF scheduler with priority lanes and admission control"""
+
+    def __init__(self, db_path: Path = QUEUE_DB, slots: int = QUEUE_SLOTS):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.slots = slots
+        # Autocommit mode: transactions are opened explicitly with BEGIN IMMEDIATE
+        self.db = sqlite3.connect(str(db_path), timeout=30, isolation_level=None)
+        self.db.row_factory = sqlite3.Row
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+        columns = {row[1] for row in self.db.execute("PRAGMA table_info(jobs)")}
+        if "attempts" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0")
+        if "cancel_requested" not in columns:
+            self.db.execute("ALTER TABLE jobs ADD COLUMN cancel_requested INTEGER NOT NULL DEFAULT 0")
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def _transaction(self):
+        self.db.execute("BEGIN IMMEDIATE")
+
+    def service_time(self) -> float:
+        """Mean duration of recently finished jobs, in seconds."""
+        row = self.db.execute(
+            "SELECT AVG(finished_at - started_at), COUNT(*) FROM "
+            "(SELECT finished_at, started_at FROM jobs "
+            " WHERE state IN (?, ?) AND started_at IS NOT NULL "
+            " ORDER BY finished_at DESC LIMIT ?)",
+            (DONE, FAILED, SERVICE_SAMPLES)
+        ).fetchone()
+        if row[1] < SERVICE_MIN_SAMPLES:
+            return QUEUE_DEFAULT_SERVICE_SECONDS
+        return max(1.0, row[0])
+
+    def _snapshot(self):
+        """(start times of running jobs, queued jobs) for estimate_starts()."""
+        running = [r[0] for r in self.db.execute(
+            "SELECT started_at FROM jobs WHERE state = ? AND slot IS NOT NULL", (RUNNING,))]
+        queued = [dict(r) for r in self.db.execute(
+            "SELECT id, lane, deadline, created_at FROM jobs WHERE state = ?", (QUEUED,))]
+        return running, queued
+
+    def _reap(self, now: float, service: float):
+        """Drop queued jobs nobody waits for or that can no longer make it."""
+        for row in self.db.execute(
+                "SELECT id, owner_pid, deadline, state FROM jobs WHERE state IN (?, ?)",
+                (QUEUED, RUNNING)).fetchall():
+            if not _alive(row["owner_pid"]):
+                state = ABANDONED if row["state"] == QUEUED else FAILED
+                self.db.execute(
+                    "UPDATE jobs SET state = ?, finished_at = ? WHERE id = ?",
+                    (state, now, row["id"])
+                )
+            elif row["state"] == QUEUED and now > row["deadline"] - service:
+                self.db.execute(
+                    "UPDATE jobs SET state = ?, finished_at = ? WHERE id = ?",
+                    (EXPIRED, now, row["id"])
+                )
+
+    def submit(self, prompt: str, lane: str = DEFAULT_LANE, deadline: float = 300,
+               payload: Optional[dict] = None, job_id: Optional[str] = None,
+               owner_pid: Optional[int] = None) -> dict:
+        """
+        Admit a job or reject it.
+
+        Args:
+            prompt: Image generation prompt
+            lane: Name from LANES
+            deadline: Seconds from now by which the job must have finished
+            payload: JSON-serializable options for whoever runs the job
+            job_id: Id to use (default: random)
+            owner_pid: Submitting process; its death abandons the job (default: this process)
+
+        Returns:
+            dict: {"admitted", "job_id", "estimated_start", "reason"}
+        """
+        now = time.time()
+        job = {
+            "id": job_id or uuid.uuid4().hex[:12],
+            "lane": LANES[lane],
+            "deadline": now + deadline,
+            "created_at": now
+        }
+
+        self._transaction()
+        try:
+            service = self.service_time()
+            self._reap(now, service)
+            running, queued = self._snapshot()
+            start, reason = check_admission(now, service, self.slots, running, queued, job)
+
+            self.db.execute(
+                "INSERT INTO jobs (id, lane, deadline, prompt, payload, state, owner_pid, "
+                "created_at, finished_at, result) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (job["id"], job["lane"], job["deadline"], prompt,
+                 json.dumps(payload or {}, ensure_ascii=False),
+                 REJECTED if reason else QUEUED,
+                 owner_pid if owner_pid is not None else os.getpid(),
+                 now, now if reason else None,
+                 json.dumps({"reason": reason}) if reason else None)
+            )
+            self.db.execute("DELETE FROM jobs WHERE finished_at < ?",
+                            (now - QUEUE_HISTORY_SECONDS,))
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+        return {
+            "admitted": reason is None,
+            "job_id": job["id"],
+            "estimated_start": round(max(0.0, start - now), 1),
+            "reason": reason
+        }
+
+    def claim(self, job_id: Optional[str] = None, worker: Optional[str] = None) -> Optional[dict]:
+        """
+        Start the next job if a slot is free.
+
+        Args:
+            job_id: Only claim if this job is next in line (a submitter running
+                    its own job); default: claim whatever is next
+            worker: Name recorded for the claiming worker
+
+        Returns:
+            dict: Job row with "slot" set, or None
+        """
+        now = time.time()
+        self._transaction()
+        try:
+            self._reap(now, self.service_time())
+            busy = {r["slot"] for r in self.db.execute(
+                "SELECT slot FROM jobs WHERE state = ?", (RUNNING,))}
+            free_slots = [i for i in range(self.slots) if i not in busy]
+            head = self.db.execute(
+                f"SELECT * FROM jobs WHERE state = ? {_ORDER} LIMIT 1", (QUEUED,)
+            ).fetchone()
+            if not free_slots or head is None or (job_id and head["id"] != job_id):
+                self.db.execute("COMMIT")
+                return None
+
+            self.db.execute(
+                "UPDATE jobs SET state = ?, started_at = ?, slot = ?, worker = ?, "
+                "attempts = attempts + 1 WHERE id = ?",
+                (RUNNING, now, free_slots[0], worker, head["id"])
+            )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+
+        job = dict(head)
+        job.update(state=RUNNING, started_at=now, slot=free_slots[0], worker=worker,
+                   attempts=job["attempts"] + 1)
+        job["payload"] = json.loads(job["payload"] or "{}")
+        return job
+
+    def wait_turn(self, job_id: str, worker: Optional[str] = None, cancel=None) -> Optional[dict]:
+        """
+        Block until job_id is claimed for this caller; None if it expired meanwhile.
+
+        With a CancelToken, a cancellation drops the job from the queue and
+        raises GenerationError(CANCELLED).
+        """
+        while True:
+            if cancel is not None and cancel.cancelled:
+                self.cancel(job_id)
+                cancel.check()
+            job = self.claim(job_id, worker)
+            if job:
+                return job
+            if self.get(job_id)["state"] != QUEUED:
+                return None
+            time.sleep(POLL_INTERVAL)
+
+    def finish(self, job_id: str, result: dict, worker: Optional[str] = None):
+        """
+        Record the outcome of a running job.
+
+        worker matches CoordinationBackend.finish(); it is not checked here,
+        as a crashed worker's jobs are only requeued once its process is gone.
+        """
+        with self.db:
+            self.db.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, result = ? WHERE id = ?",
+                (finished_state(result), time.time(),
+                 json.dumps(result, ensure_ascii=False), job_id)
+            )
+
+    def release_slot(self, job_id: str):
+        """
+        Free a running job's slot before it finishes.
+
+        For work left after the browser is done (waiting for an upload): the
+        next job can start, and the job stays RUNNING until finish().
+        """
+        with self.db:
+            self.db.execute("UPDATE jobs SET slot = NULL WHERE id = ? AND state = ?",
+                            (job_id, RUNNING))
+
+    def cancel(self, job_id: str) -> Optional[str]:
+        """
+        Cancel a job.
+
+        Returns:
+            str: CANCELLED if it was still queued, RUNNING if its runner was
+                 asked to stop, None if it is unknown or already finished
+        """
+        now = time.time()
+        with self.db:
+            cur = self.db.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, result = ? WHERE id = ? AND state = ?",
+                (CANCELLED, now, json.dumps(CANCELLED_RESULT, ensure_ascii=False), job_id, QUEUED))
+            if cur.rowcount:
+                return CANCELLED
+            cur = self.db.execute(
+                "UPDATE jobs SET cancel_requested = 1 WHERE id = ? AND state = ?",
+                (job_id, RUNNING))
+            return RUNNING if cur.rowcount else None
+
+    def cancel_requested(self, job_id: str) -> bool:
+        """Polled by the process running the job (see cancellation.CancelToken)."""
+        row = self.db.execute("SELECT cancel_requested FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return bool(row and row[0])
+
+    def requeue(self, worker: str) -> int:
+        """
+        Put the running jobs of a crashed worker back in line.
+
+        Jobs that already crashed a worker MAX_CLAIMS times are failed instead,
+        so one poisonous prompt cannot take down every worker in turn.
+
+        Returns:
+            int: Number of jobs requeued
+        """
+        now = time.time()
+        self._transaction()
+        try:
+            requeued = self.db.execute(
+                "UPDATE jobs SET state = ?, started_at = NULL, slot = NULL, worker = NULL "
+                "WHERE state = ? AND worker = ? AND attempts < ?",
+                (QUEUED, RUNNING, worker, MAX_CLAIMS)
+            ).rowcount
+            self.db.execute(
+                "UPDATE jobs SET state = ?, finished_at = ?, result = ? WHERE state = ? AND worker = ?",
+                (FAILED, now, json.dumps(crashed_result("worker crashed"), ensure_ascii=False),
+                 RUNNING, worker)
+            )
+            self.db.execute("COMMIT")
+        except BaseException:
+            self.db.execute("ROLLBACK")
+            raise
+        return requeued
+
+    def get(self, job_id: str) -> Optional[dict]:
+        row = self.db.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+        return dict(row) if row else None
+
+    def active(self) -> List[dict]:
+        return [dict(r) for r in self.db.execute(
+            f"SELECT id, lane, deadline, state, slot, worker, prompt, created_at, started_at "
+            f"FROM jobs WHERE state IN (?, ?) {_ORDER}", (RUNNING, QUEUED))]
+
+    def stats(self) -> dict:
+        now = time.time()
+        service = self.service_time()
+        counts = {f"{r[0]}": r[1] for r in self.db.execute(
+            "SELECT state, COUNT(*) FROM jobs GROUP BY state")}
+        # Waits come from the same snapshot as the estimate; a second read
+        # could see jobs submitted in between, which have no estimate
+        running, queued = self._snapshot()
+        starts = estimate_starts(now, service, self.slots, running, queued)
+        lane_names = {rank: name for name, rank in LANES.items()}
+        waits = {}
+        for job in queued:
+            name = lane_names.get(job["lane"], str(job["lane"]))
+            waits[name] = max(waits.get(name, 0), round(starts[job["id"]] - now, 1))
+        return {
+            "slots": self.slots,
+            "service_seconds": round(service, 1),
+            "throughput_per_minute": round(self.slots * 60 / service, 2),
+            "states": counts,
+            "max_wait_by_lane": waits
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect the generation job queue")
+    parser.add_argument("action", choices=["status", "list", "cancel"], help="Action to perform")
+    parser.add_argument("job_id", nargs="?", help="Job to cancel")
+    args = parser.parse_args()
+
+    with JobQueue() as queue:
+        if args.action == "status":
+            print(json.dumps(queue.stats(), indent=2))
+            return 0
+
+        if args.action == "cancel":
+            if not args.job_id:
+                print("❌ cancel needs a job id (see: python job_queue.py list)")
+                return 1
+            state = queue.cancel(args.job_id)
+            if state is None:
+                print(f"❌ Job {args.job_id} is not queued or running")
+                return 1
+            print(f"✓ Job {args.job_id} " + ("cancelled" if state == CANCELLED
+                                             else "is stopping (running)"))
+            return 0
+
+        now = time.time()
+        for job in queue.active():
+            lane = next((name for name, rank in LANES.items() if rank == job["lane"]), job["lane"])
+            print(f"{job['id']}  {job['state']:<8} {lane:<12} "
+                  f"deadline in {job['deadline'] - now:6.0f}s  {job['prompt'][:50]}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
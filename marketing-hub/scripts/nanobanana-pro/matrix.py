@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+Template x variable matrix generation for Gemini Image Generator
+Turns one prompt template and a few variable axes into a creative grid
+
+The template uses {name} placeholders; every axis lists the values of one
+placeholder. All combinations are expanded (product x color x season x
+aspect ...), rendered and normalized, and combinations that render to the
+same prompt are generated once and share the image.
+
+Combinations whose exact prompt was generated before (any earlier run,
+matrix or not) are served from the image store instead of Gemini, so an
+interrupted grid can simply be run again. Only exact prompts are reused:
+the near-duplicate index ignores word order, so "red mug, navy lid" and
+"navy mug, red lid" would count as the same prompt.
+
+The remaining prompts run on warm browser sessions:
+- With supervisor workers (or a coordination backend) running, they are
+  submitted to the queue in the bulk lane and the workers share them.
+- Otherwise they run here on --sessions ImageGenerator sessions (one
+  browser each, on cloned worker profiles when there is more than one)
+  that take the next prompt as soon as they are free.
+
+The result is a JSON manifest in MATRIX_DIR mapping every combination to
+its image (url, filename, sha256) or failure.
+
+Usage:
+    python matrix.py expand --template "{product}, {color}, {season} campaign" \\
+        --var product=マグカップ,タンブラー --var color=赤,紺 --var season=春,夏
+    python matrix.py run --template-file banner.txt --axes axes.json --name spring-banner
+    python matrix.py run --template "..." --axes axes.json --sessions 3
+"""
+
+import sys
+import os
+import json
+import time
+import queue
+import argparse
+import itertools
+import threading
+from string import Formatter
+from pathlib import Path
+from typing import Dict, List
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import (
+    OUTPUT_DIR,
+    MATRIX_DIR,
+    MATRIX_MAX_COMBINATIONS,
+    MATRIX_DEADLINE,
+    STORAGE_DRAIN_TIMEOUT
+)
+from prompt_text import normalize_prompt
+from singleflight import request_key
+from failures import FailureKind
+from cancellation import CancelToken, install_signal_handlers
+import output_storage
+
+
+def template_fields(template: str) -> List[str]:
+    """Placeholder names of a template, in order of first use."""
+    fields = []
+    for _, name, _, _ in Formatter().parse(template):
+        if name is None:
+            continue
+        if not name.isidentifier():
+            raise ValueError(f"Unsupported placeholder {{{name}}}: use {{name}} only")
+        if name not in fields:
+            fields.append(name)
+    return fields
+
+
+def expand(template: str, axes: Dict[str, list],
+           max_combinations: int = MATRIX_MAX_COMBINATIONS) -> List[dict]:
+    """
+    Expand a template over all combinations of its axes.
+
+    Axis values are stripped and deduplicated; axes the template does not
+    use are ignored (they would only repeat prompts).
+
+    Returns:
+        list: {"variables", "prompt", "key"} per combination; combinations
+              rendering the same prompt share the key
+    """
+    fields = template_fields(template)
+    missing = [name for name in fields if name not in axes]
+    if missing:
+        raise ValueError(f"No values for: {', '.join(missing)}")
+    unused = [name for name in axes if name not in fields]
+    if unused:
+        print(f"⚠️  Axes not used by the template: {', '.join(unused)}")
+
+    values = {}
+    for name in fields:
+        values[name] = list(dict.fromkeys(str(v).strip() for v in axes[name] if str(v).strip()))
+        if not values[name]:
+            raise ValueError(f"Axis '{name}' has no values")
+
+    total = 1
+    for name in fields:
+        total *= len(values[name])
+    if total > max_combinations:
+        raise ValueError(f"{total} combinations exceed the limit of {max_combinations}")
+
+    cells = []
+    for combination in itertools.product(*(values[name] for name in fields)):
+        variables = dict(zip(fields, combination))
+        prompt = normalize_prompt(template.format(**variables))
+        cells.append({"variables": variables, "prompt": prompt, "key": request_key(prompt)})
+    return cells
+
+
+def unique_prompts(cells: List[dict]) -> Dict[str, str]:
+    """key -> prompt, in order of first appearance."""
+    prompts = {}
+    for cell in cells:
+        prompts.setdefault(cell["key"], cell["prompt"])
+    return prompts
+
+
+def cached_result(prompt: str):
+    """JSON result for a prompt generated before, under a new alias; None if there is none."""
+    from generate import new_filename
+    from image_store import ImageStore
+    from prompt_index import PromptIndex
+
+    try:
+        with PromptIndex() as index:
+            match = index.find_exact(prompt)
+        if not match or not match["digest"]:
+            return None
+        with ImageStore() as store:
+            filename = store.alias(match["digest"], new_filename())
+            if not filename:
+                return None
+    except Exception as e:
+        print(f"⚠️  Cache lookup failed: {e}")
+        return None
+
+    return {
+        "success": True,
+        "url": output_storage.publish(OUTPUT_DIR / filename, filename, match["digest"]),
+        "filename": filename,
+        "sha256": match["digest"],
+        "prompt": prompt,
+        "reused": True
+    }
+
+
+def run_local(pending: Dict[str, str], results: dict, args, cancel: CancelToken):
+    """
+    Generate on this host with args.sessions warm browser sessions.
+
+    Sessions take prompts from a shared queue, so a slow image never holds
+    up the others. Authentication failure stops all sessions.
+    """
+    from generate import new_filename, build_result
+    from image_generator import ImageGenerator
+    from profile_manager import worker_paths
+
+    work = queue.Queue()
+    for item in pending.items():
+        work.put(item)
+    stop = threading.Event()
+
+    def session(slot: int):
+        user_data_dir = state_file = None
+        if args.sessions > 1:
+            profile_dir, state_file = worker_paths(slot)
+            user_data_dir = str(profile_dir)
+        try:
+            with ImageGenerator(user_data_dir=user_data_dir, state_file=state_file,
+                                timeout=args.timeout, total_timeout=args.total_timeout,
+                                hedge=args.hedge or None) as generator:
+                while not stop.is_set() and not cancel.cancelled:
+                    try:
+                        key, prompt = work.get_nowait()
+                    except queue.Empty:
+                        return
+                    filename = new_filename()
+                    generation = generator.generate(prompt, str(OUTPUT_DIR / filename),
+                                                    job_id=f"matrix-{key[:8]}", cancel=cancel)
+                    results[key] = build_result(generation, prompt, filename)
+                    if generation.failure == FailureKind.AUTH_REQUIRED:
+                        stop.set()
+        except Exception as e:
+            print(f"❌ Session {slot} failed: {e}")
+
+    threads = [threading.Thread(target=session, args=(slot,), daemon=True)
+               for slot in range(min(args.sessions, len(pending)))]
+    for thread in threads:
+        thread.start()
+    # Join with a timeout so the main thread keeps handling SIGTERM/SIGINT
+    while any(thread.is_alive() for thread in threads):
+        for thread in threads:
+            thread.join(timeout=0.5)
+
+
+def run_remote(pending: Dict[str, str], results: dict, job_queue, args, cancel: CancelToken):
+    """Submit the prompts to the workers' queue (bulk lane) and collect their results."""
+    from generate import new_filename, rejected_result, cancelled_result
+    from job_queue import DONE, FAILED, CANCELLED, QUEUED, RUNNING
+
+    with job_queue:
+        jobs = {}
+        for key, prompt in pending.items():
+            admission = job_queue.submit(prompt, "bulk", args.deadline, payload={
+                "filename": new_filename(),
+                "timeout": args.timeout,
+                "total_timeout": args.total_timeout,
+                "hedge": args.hedge or None
+            })
+            if admission["admitted"]:
+                jobs[admission["job_id"]] = key
+            else:
+                results[key] = rejected_result(admission["reason"], admission["estimated_start"])
+        print(f"   → Submitted {len(jobs)} jobs to workers")
+        done = len(pending) - len(jobs)
+
+        while jobs:
+            if cancel.cancelled:
+                for job_id, key in jobs.items():
+                    job_queue.cancel(job_id)
+                    results[key] = cancelled_result()
+                return
+            for job_id, key in list(jobs.items()):
+                job = job_queue.get(job_id)
+                if job["state"] in (DONE, FAILED, CANCELLED):
+                    results[key] = json.loads(job["result"])
+                elif job["state"] not in (QUEUED, RUNNING):
+                    results[key] = rejected_result(f"job {job['state']}")
+                else:
+                    continue
+                del jobs[job_id]
+                done += 1
+                print(f"   {'✓' if results[key]['success'] else '❌'} {done}/{len(pending)}: "
+                      f"{pending[key][:60]}")
+            time.sleep(1)
+
+
+def build_manifest(template: str, axes: dict, cells: List[dict], results: dict,
+                   cached: set, started: float) -> dict:
+    """
+    Map every combination to its image or failure.
+
+    Each item's "source" is "cached" (generated by an earlier run),
+    "generated" (attempted in this run) or "skipped" (not attempted, e.g.
+    after cancellation or an authentication failure).
+    """
+    items = []
+    for cell in cells:
+        result = results.get(cell["key"])
+        if result is None:
+            items.append({"variables": cell["variables"], "prompt": cell["prompt"],
+                          "source": "skipped", "success": False, "failure": "skipped"})
+            continue
+        item = {"variables": cell["variables"], "prompt": cell["prompt"],
+                "source": "cached" if cell["key"] in cached else "generated"}
+        for field in ("success", "url", "filename", "sha256", "failure", "error"):
+            if field in result:
+                item[field] = result[field]
+        items.append(item)
+
+    return {
+        "template": template,
+        "axes": axes,
+        "created_at": started,
+        "seconds": round(time.time() - started, 1),
+        "summary": {
+            "combinations": len(cells),
+            "unique_prompts": len(unique_prompts(cells)),
+            "cached": len(cached),
+            "generated": sum(1 for key, result in results.items()
+                             if key not in cached and result.get("success")),
+            "failed": sum(1 for item in items if not item["success"])
+        },
+        "items": items
+    }
+
+
+def write_manifest(manifest: dict, path: Path):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def run_matrix(template: str, axes: dict, args, cancel: CancelToken) -> dict:
+    """Expand, serve cached prompts, generate the rest and write the manifest."""
+    from coordination import get_backend
+    from job_queue import JobQueue
+    from supervisor import supervisor_status
+
+    started = time.time()
+    cells = expand(template, axes)
+    prompts = unique_prompts(cells)
+    print(f"🧮 {len(cells)} combinations, {len(prompts)} unique prompts")
+
+    results = {}
+    pending = {}
+    for key, prompt in prompts.items():
+        result = cached_result(prompt)
+        if result:
+            results[key] = result
+        else:
+            pending[key] = prompt
+    cached = set(results)
+    if cached:
+        print(f"   ✓ {len(cached)} prompts already generated, reusing their images")
+
+    output = args.output or MATRIX_DIR / f"{args.name}-{time.strftime('%Y%m%d-%H%M%S')}.json"
+    try:
+        if pending:
+            backend = get_backend()
+            supervisor = supervisor_status() if not backend else None
+            if backend:
+                run_remote(pending, results, backend, args, cancel)
+            elif supervisor:
+                run_remote(pending, results, JobQueue(slots=supervisor["workers"]), args, cancel)
+            else:
+                print(f"   → Generating {len(pending)} prompts on {args.sessions} session(s)")
+                run_local(pending, results, args, cancel)
+    finally:
+        # The manifest only lists URLs that work (remote output storage)
+        from generate import await_upload
+        drain_until = time.time() + STORAGE_DRAIN_TIMEOUT
+        for key, result in list(results.items()):
+            results[key] = await_upload(result, max(0.0, drain_until - time.time()))
+        # Also on cancellation: a partial manifest records what is done
+        manifest = build_manifest(template, axes, cells, results, cached, started)
+        write_manifest(manifest, Path(output))
+        print(f"\n✓ Manifest: {output}")
+    return manifest
+
+
+def load_axes(args) -> dict:
+    axes = {}
+    if args.axes:
+        with open(args.axes) as f:
+            axes.update(json.load(f))
+    for spec in args.var or []:
+        name, sep, values = spec.partition("=")
+        if not sep:
+            raise ValueError(f"--var expects name=value1,value2 (got '{spec}')")
+        axes[name.strip()] = values.split(",")
+    return axes
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Generate a template x variable grid of images",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python matrix.py expand --template "{product} on a {color} background" --var product=mug,bottle --var color=red,navy
+  python matrix.py run --template-file banner.txt --axes axes.json --name spring-banner
+  python matrix.py run --template "..." --axes axes.json --sessions 3   # Needs 3 worker profiles
+
+axes.json: {"product": ["mug", "bottle"], "color": ["red", "navy"], "aspect": ["1:1", "9:16"]}
+        """
+    )
+    parser.add_argument("action", choices=["expand", "run"], help="Action to perform")
+    parser.add_argument("--template", help="Prompt template with {name} placeholders")
+    parser.add_argument("--template-file", type=Path, help="Read the template from a file")
+    parser.add_argument("--axes", type=Path, help="JSON file mapping axis names to value lists")
+    parser.add_argument("--var", action="append", help="Axis as name=value1,value2 (repeatable)")
+    parser.add_argument("--name", default="matrix", help="Manifest name prefix (default: matrix)")
+    parser.add_argument("--output", type=Path, help="Manifest path (default: MATRIX_DIR/<name>-<time>.json)")
+    parser.add_argument("--sessions", type=int, default=1,
+                        help="Local browser sessions; >1 uses cloned worker profiles (default: 1)")
+    parser.add_argument("--timeout", type=int, default=180, help="Timeout per attempt in seconds")
+    parser.add_argument("--total-timeout", type=int, default=270,
+                        help="Budget for all retries of one image in seconds")
+    parser.add_argument("--hedge", action="store_true", help="Hedge slow jobs on a second tab")
+    parser.add_argument("--deadline", type=float, default=MATRIX_DEADLINE,
+                        help="Seconds queued jobs may take when workers are running")
+    args = parser.parse_args()
+
+    if args.template_file:
+        args.template = args.template_file.read_text(encoding="utf-8").strip()
+    if not args.template:
+        parser.error("--template or --template-file is required")
+
+    try:
+        axes = load_axes(args)
+        if args.action == "expand":
+            cells = expand(args.template, axes)
+            for cell in cells:
+                print(json.dumps({"variables": cell["variables"], "prompt": cell["prompt"]},
+                                 ensure_ascii=False))
+            print(f"\n{len(cells)} combinations, {len(unique_prompts(cells))} unique prompts")
+            return 0
+    except (ValueError, OSError) as e:
+        print(f"❌ {e}")
+        return 1
+
+    from image_generator import check_authenticated
+    from profile_manager import worker_paths
+
+    if args.sessions > 1:
+        missing = [n for n in range(args.sessions) if not worker_paths(n)[0].exists()]
+        if missing:
+            print(f"❌ No worker profile for sessions {missing}: run profile_manager.py clone first")
+            return 1
+    elif not check_authenticated():
+        print("❌ Not authenticated")
+        print("   Run: python scripts/run.py auth_manager.py setup")
+        return 1
+
+    cancel = CancelToken()
+    install_signal_handlers(cancel)
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+
+    try:
+        manifest = run_matrix(args.template, axes, args, cancel)
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+
+    summary = manifest["summary"]
+    print(f"   {summary['combinations']} combinations: {summary['cached']} cached, "
+          f"{summary['generated']} generated, {summary['failed']} failed")
+    if not output_storage.shutdown(STORAGE_DRAIN_TIMEOUT):
+        print("⚠️  Uploads still pending, left in the spool (python output_storage.py drain)")
+    return 0 if not summary["failed"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
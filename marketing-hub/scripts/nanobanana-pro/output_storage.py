@@ -0,0 +1,460 @@
+#!/usr/bin/env python3
+"""
+Pluggable output storage for Gemini Image Generator
+Publishes generated images locally or to S3-compatible storage, uploading in the background
+
+Backends (STORAGE_BACKEND):
+- "local": images stay in OUTPUT_DIR and are served by Next.js from
+  /uploads/ai-generated/ (web server and generators on one host).
+- "s3": images are uploaded to S3_BUCKET on any S3-compatible service
+  (AWS, MinIO, ...) and served from S3_PUBLIC_URL. Objects are keyed by
+  content hash, so deduplicated and reused images are uploaded once.
+  Requires boto3; a client can be injected, so a local stand-in (e.g. a
+  MinIO container or moto) can replace the service in tests.
+
+Uploads never hold up a browser: publish() returns the final URL at once
+and hands the file to a per-process Uploader, which uploads on background
+threads (STORAGE_UPLOAD_WORKERS at a time, multipart above
+STORAGE_MULTIPART_THRESHOLD) and retries with backoff. Every pending upload
+is also written to STORAGE_SPOOL_DIR first, so uploads cut short by a
+process exit, or out of retries, are picked up again by resume() (the
+supervisor calls it periodically, or run `drain`). A spool entry is
+flock-ed while it uploads, so several processes can share the spool.
+
+The URL only works once its upload has landed, so whoever reports a result
+waits for pending_upload(url) first: generate.py before printing its JSON
+line, supervisor workers before finishing the job (from the upload's
+done-callback, while they already run the next job).
+
+Remote objects are not subject to OUTPUT_MAX_BYTES retention; use a
+bucket lifecycle rule for that.
+
+Usage:
+    python output_storage.py status    # Backend and pending uploads
+    python output_storage.py drain     # Upload everything left in the spool now
+"""
+
+import os
+import sys
+import json
+import time
+import uuid
+import argparse
+import mimetypes
+import threading
+from abc import ABC, abstractmethod
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from pathlib import Path
+from typing import Optional
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import (
+    STORAGE_BACKEND,
+    S3_BUCKET,
+    S3_ENDPOINT_URL,
+    S3_PREFIX,
+    S3_PUBLIC_URL,
+    STORAGE_UPLOAD_WORKERS,
+    STORAGE_MULTIPART_THRESHOLD,
+    STORAGE_PART_SIZE,
+    STORAGE_UPLOAD_RETRIES,
+    STORAGE_RETRY_AFTER,
+    STORAGE_SPOOL_DIR
+)
+from image_download import EXTENSIONS
+
+try:
+    import fcntl
+except ImportError:  # No cross-process spool locking (Windows)
+    fcntl = None
+
+LOCAL_URL_PREFIX = "/uploads/ai-generated"
+MAX_BACKOFF = 60
+
+
+class OutputStorage(ABC):
+    """Where generated images are published"""
+
+    remote = False  # True if files must be uploaded before their URL works
+
+    @abstractmethod
+    def url(self, key: str) -> str:
+        """Public URL of a stored key."""
+        ...
+
+    @abstractmethod
+    def exists(self, key: str) -> bool:
+        """Whether the key is already stored."""
+        ...
+
+    @abstractmethod
+    def upload(self, path: Path, key: str, content_type: Optional[str] = None):
+        """Upload a file (blocking). Raises on failure."""
+        ...
+
+
+class LocalStorage(OutputStorage):
+    """OUTPUT_DIR on this host, served by Next.js from public/"""
+
+    def __init__(self, url_prefix: str = LOCAL_URL_PREFIX):
+        self.url_prefix = url_prefix.rstrip("/")
+
+    def url(self, key: str) -> str:
+        return f"{self.url_prefix}/{key}"
+
+    def exists(self, key: str) -> bool:
+        return True  # ImageStore already wrote it
+
+    def upload(self, path: Path, key: str, content_type: Optional[str] = None):
+        pass
+
+
+class S3Storage(OutputStorage):
+    """Any S3-compatible object store (AWS S3, MinIO, ...)"""
+
+    remote = True
+
+    def __init__(self, bucket: Optional[str] = S3_BUCKET, client=None,
+                 endpoint_url: Optional[str] = S3_ENDPOINT_URL,
+                 prefix: str = S3_PREFIX,
+                 public_url: Optional[str] = S3_PUBLIC_URL,
+                 multipart_threshold: int = STORAGE_MULTIPART_THRESHOLD,
+                 part_size: int = STORAGE_PART_SIZE):
+        if not bucket:
+            raise ValueError("The s3 storage backend needs S3_BUCKET")
+        if client is None:
+            try:
+                import boto3
+            except ImportError:
+                raise RuntimeError("The s3 storage backend requires boto3 (pip install boto3)")
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.s3 = client
+        self.bucket = bucket
+        self.endpoint_url = endpoint_url
+        self.prefix = prefix
+        self.public_url = public_url
+        self.multipart_threshold = multipart_threshold
+        self.part_size = part_size
+
+    def object_key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def url(self, key: str) -> str:
+        if self.public_url:
+            return f"{self.public_url.rstrip('/')}/{self.object_key(key)}"
+        if self.endpoint_url:
+            return f"{self.endpoint_url.rstrip('/')}/{self.bucket}/{self.object_key(key)}"
+        return f"https://{self.bucket}.s3.amazonaws.com/{self.object_key(key)}"
+
+    def exists(self, key: str) -> bool:
+        try:
+            self.s3.head_object(Bucket=self.bucket, Key=self.object_key(key))
+            return True
+        except Exception as e:
+            # botocore ClientError carries the HTTP status; stand-ins may only say "Not Found"
+            status = (getattr(e, "response", None) or {}).get("Error", {}).get("Code")
+            if status in ("404", "NoSuchKey", "NotFound") or "Not Found" in str(e):
+                return False
+            raise
+
+    def upload(self, path: Path, key: str, content_type: Optional[str] = None):
+        content_type = content_type or mimetypes.guess_type(str(path))[0] or "application/octet-stream"
+        if Path(path).stat().st_size >= self.multipart_threshold:
+            self._upload_multipart(path, key, content_type)
+            return
+        with open(path, 'rb') as f:
+            self.s3.put_object(Bucket=self.bucket, Key=self.object_key(key),
+                               Body=f, ContentType=content_type)
+
+    def _upload_multipart(self, path: Path, key: str, content_type: str):
+        object_key = self.object_key(key)
+        upload_id = self.s3.create_multipart_upload(
+            Bucket=self.bucket, Key=object_key, ContentType=content_type)["UploadId"]
+        try:
+            parts = []
+            with open(path, 'rb') as f:
+                for number, chunk in enumerate(iter(lambda: f.read(self.part_size), b''), start=1):
+                    response = self.s3.upload_part(Bucket=self.bucket, Key=object_key,
+                                                   PartNumber=number, UploadId=upload_id, Body=chunk)
+                    parts.append({"ETag": response["ETag"], "PartNumber": number})
+            self.s3.complete_multipart_upload(Bucket=self.bucket, Key=object_key, UploadId=upload_id,
+                                              MultipartUpload={"Parts": parts})
+        except BaseException:
+            try:
+                self.s3.abort_multipart_upload(Bucket=self.bucket, Key=object_key, UploadId=upload_id)
+            except Exception:
+                pass
+            raise
+
+
+class Uploader:
+    """Background, concurrent uploads with retries, backed by an on-disk spool"""
+
+    def __init__(self, storage: OutputStorage, spool_dir: Path = STORAGE_SPOOL_DIR,
+                 workers: int = STORAGE_UPLOAD_WORKERS,
+                 retries: int = STORAGE_UPLOAD_RETRIES,
+                 retry_after: float = STORAGE_RETRY_AFTER):
+        self.storage = storage
+        self.spool_dir = Path(spool_dir)
+        self.spool_dir.mkdir(parents=True, exist_ok=True)
+        self.retries = retries
+        self.retry_after = retry_after
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="upload")
+        self._stop = threading.Event()
+        self._lock = threading.RLock()  # add_done_callback may call back while held
+        self._pending = {}  # spool entry -> Future
+        self.uploaded = 0
+        self.skipped = 0  # Already stored (deduplicated images)
+        self.failed = 0
+
+    def submit(self, path: Path, key: str, content_type: Optional[str] = None):
+        """Spool an upload and start it in the background. Returns its Future."""
+        entry = self.spool_dir / f"{time.time():.6f}-{uuid.uuid4().hex[:8]}.json"
+        tmp = entry.with_suffix(".tmp")
+        with open(tmp, 'w') as f:
+            json.dump({"path": str(path), "key": key, "content_type": content_type,
+                       "created_at": time.time(), "attempts": 0, "next_attempt": 0}, f)
+        os.replace(tmp, entry)
+        return self._start(entry)
+
+    def _start(self, entry: Path):
+        with self._lock:
+            future = self._pending.get(entry)
+            if future is None or future.done():
+                future = self._executor.submit(self._run, entry)
+                self._pending[entry] = future
+                future.add_done_callback(lambda _: self._forget(entry))
+            return future
+
+    def _forget(self, entry: Path):
+        with self._lock:
+            if entry in self._pending and self._pending[entry].done():
+                del self._pending[entry]
+
+    def resume(self) -> int:
+        """Restart spooled uploads that are due (left by exited processes or out of retries)."""
+        now = time.time()
+        started = 0
+        for entry in sorted(self.spool_dir.glob("*.json")):
+            with self._lock:
+                if entry in self._pending:
+                    continue
+            try:
+                with open(entry, 'r') as f:
+                    if json.load(f).get("next_attempt", 0) > now:
+                        continue
+            except (OSError, ValueError):
+                continue
+            self._start(entry)
+            started += 1
+        return started
+
+    def _run(self, entry: Path) -> bool:
+        try:
+            f = open(entry, 'r+')
+        except FileNotFoundError:
+            return True  # Finished by another uploader
+        with f:
+            waited = False
+            if fcntl is not None:
+                # Another process is uploading it: wait for its outcome
+                while True:
+                    try:
+                        fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        waited = True
+                        if self._stop.wait(0.5):
+                            return False
+            if not entry.exists():
+                return True  # Finished while we waited for the lock
+            try:
+                job = json.load(f)
+            except ValueError:
+                entry.unlink(missing_ok=True)
+                return False
+            if waited and job.get("next_attempt", 0) > time.time():
+                return False  # The other process ran out of retries; resume() takes it later
+
+            path = Path(job["path"])
+            for attempt in range(self.retries):
+                if self._stop.is_set():
+                    return False  # Shutting down; the spool keeps it
+                try:
+                    if not path.exists():
+                        print(f"   ❌ Upload of {job['key']} dropped: {path} no longer exists")
+                        entry.unlink(missing_ok=True)
+                        self._count("failed")
+                        return False
+                    if self.storage.exists(job["key"]):
+                        self._count("skipped")
+                    else:
+                        self.storage.upload(path, job["key"], job.get("content_type"))
+                        self._count("uploaded")
+                    entry.unlink(missing_ok=True)
+                    return True
+                except Exception as e:
+                    print(f"   ⚠️  Upload of {job['key']} failed: {e}")
+                    if attempt + 1 < self.retries:
+                        self._stop.wait(min(MAX_BACKOFF, 2 ** attempt))
+
+            # Out of retries: leave it in the spool for resume()
+            job["attempts"] = job.get("attempts", 0) + self.retries
+            job["next_attempt"] = time.time() + self.retry_after
+            job["last_error"] = time.strftime("%Y-%m-%d %H:%M:%S")
+            f.seek(0)
+            f.truncate()
+            json.dump(job, f)
+            self._count("failed")
+            print(f"   ❌ Upload of {job['key']} still failing, retrying in {self.retry_after}s")
+            return False
+
+    def _count(self, name: str):
+        with self._lock:
+            setattr(self, name, getattr(self, name) + 1)
+
+    def drain(self, timeout: Optional[float] = None) -> bool:
+        """Wait for the uploads started by this process. True if all finished."""
+        with self._lock:
+            futures = list(self._pending.values())
+        _, not_done = wait(futures, timeout=timeout)
+        return not not_done
+
+    def close(self, timeout: Optional[float] = None) -> bool:
+        """Drain (up to timeout), then stop; unfinished uploads stay in the spool."""
+        finished = self.drain(timeout)
+        self._stop.set()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        return finished
+
+    def stats(self) -> dict:
+        with self._lock:
+            pending = len(self._pending)
+        return {
+            "pending": pending,
+            "spooled": len(list(self.spool_dir.glob("*.json"))),
+            "uploaded": self.uploaded,
+            "skipped": self.skipped,
+            "failed": self.failed
+        }
+
+
+def get_storage(kind: str = STORAGE_BACKEND, **kwargs) -> OutputStorage:
+    """Configured output storage backend."""
+    if kind == "local":
+        return LocalStorage(**kwargs)
+    if kind == "s3":
+        return S3Storage(**kwargs)
+    raise ValueError(f"Unknown storage backend: {kind}")
+
+
+_storage = None
+_uploader = None
+_uploads = {}  # URL handed out by publish() -> Future of its upload
+
+
+def get_uploader() -> Optional[Uploader]:
+    """This process's uploader (None for local storage)."""
+    global _storage, _uploader
+    if _storage is None:
+        _storage = get_storage()
+    if _uploader is None and _storage.remote:
+        _uploader = Uploader(_storage)
+    return _uploader
+
+
+def publish(path: Path, filename: str, digest: Optional[str] = None,
+            image_format: Optional[str] = None) -> str:
+    """
+    Public URL of an image in OUTPUT_DIR; remote backends upload it in the background.
+
+    Args:
+        path: Local file (OUTPUT_DIR/filename)
+        filename: Public filename
+        digest: sha256 from ImageStore; remote objects are keyed by it when known
+        image_format: Sniffed format ("png", "jpeg", ...); sets the key's
+                      extension and the Content-Type (default: from filename)
+    """
+    uploader = get_uploader()
+    if uploader is None:
+        return _storage.url(filename)
+    ext = EXTENSIONS.get(image_format) or Path(filename).suffix or ".png"
+    key = f"{digest}{ext}" if digest else filename
+    content_type = f"image/{image_format}" if image_format in EXTENSIONS else None
+    url = _storage.url(key)
+    future = uploader.submit(path, key, content_type)
+    _uploads[url] = future
+
+    def forget(done):
+        # Landed uploads need no waiting; failed ones stay until their caller asks
+        if not done.cancelled() and done.exception() is None and done.result():
+            if _uploads.get(url) is done:
+                _uploads.pop(url, None)
+
+    future.add_done_callback(forget)
+    return url
+
+
+def pending_upload(url: Optional[str]) -> Optional[Future]:
+    """
+    Upload that must finish before a URL from publish() works.
+
+    Returns:
+        Future: Resolves to True once the object is stored (False if the
+                upload failed and waits in the spool), or None if the URL
+                already works
+    """
+    return _uploads.pop(url, None) if url else None
+
+
+def wait_uploaded(url: Optional[str], timeout: Optional[float] = None) -> bool:
+    """Block until a URL from publish() works. False if its upload failed or timed out."""
+    future = pending_upload(url)
+    if future is None:
+        return True
+    try:
+        return bool(future.result(timeout=timeout))
+    except Exception:  # Timed out, or cancelled by shutdown(); the spool keeps it
+        return False
+
+
+def shutdown(timeout: Optional[float] = None) -> bool:
+    """Wait up to timeout for this process's uploads. True if none are left running."""
+    if _uploader is None:
+        return True
+    return _uploader.close(timeout)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect and drain output storage uploads")
+    parser.add_argument("action", choices=["status", "drain"], help="Action to perform")
+    parser.add_argument("--timeout", type=float, default=None,
+                        help="Max seconds to wait with drain (default: until done)")
+    args = parser.parse_args()
+
+    storage = get_storage()
+    if not storage.remote:
+        print(f"Storage: local ({LOCAL_URL_PREFIX}), nothing to upload")
+        return 0
+
+    uploader = Uploader(storage, retries=1)
+    if args.action == "status":
+        print(f"Storage: {STORAGE_BACKEND} ({storage.url('')})")
+        print(json.dumps(uploader.stats(), indent=2))
+        uploader.close(0)
+        return 0
+
+    # Ignore backoff windows: an operator asked for it now
+    for entry in uploader.spool_dir.glob("*.json"):
+        uploader._start(entry)
+    finished = uploader.close(args.timeout)
+    stats = uploader.stats()
+    print(f"✓ Uploaded {stats['uploaded']}, already stored {stats['skipped']}, "
+          f"failed {stats['failed']}, left in spool {stats['spooled']}")
+    return 0 if finished and not stats["spooled"] else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Perceptual-hash index for generated images
+Finds visually similar images without pairwise comparison
+
+Every image gets a 64-bit DCT perceptual hash (pHash). Hashes are stored in
+PHASH_INDEX_DB split into four 16-bit chunks, each with its own index
+(multi-index hashing): if two hashes differ in at most r bits, at least one
+chunk differs in at most r // 4 bits. A query therefore only looks up the
+few chunk values within that sub-radius, then checks the full Hamming
+distance of the candidates.
+
+Requires Pillow; without it hashing is skipped.
+
+Usage:
+    python phash_index.py backfill                  # Index existing OUTPUT_DIR images
+    python phash_index.py near <image> [--distance 6]
+    python phash_index.py report [--distance 6]     # Groups of near-duplicates (JSON)
+"""
+
+import sys
+import json
+import math
+import time
+import sqlite3
+import argparse
+from functools import lru_cache
+from itertools import combinations
+from pathlib import Path
+from typing import Dict, List, Optional
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import PHASH_INDEX_DB, PHASH_DUPLICATE_DISTANCE, OUTPUT_DIR
+from image_store import file_digest
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+HASH_SIZE = 8     # 8x8 low-frequency DCT coefficients -> 64 bits
+IMG_SIZE = 32     # Image is reduced to 32x32 greyscale before the DCT
+CHUNKS = 4
+CHUNK_BITS = 64 // CHUNKS
+CHUNK_MASK = (1 << CHUNK_BITS) - 1
+
+IMAGE_EXTENSIONS = {".png", ".jpg", ".jpeg", ".webp", ".gif"}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    digest TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    phash INTEGER NOT NULL,
+    c0 INTEGER NOT NULL,
+    c1 INTEGER NOT NULL,
+    c2 INTEGER NOT NULL,
+    c3 INTEGER NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS images_c0 ON images (c0);
+CREATE INDEX IF NOT EXISTS images_c1 ON images (c1);
+CREATE INDEX IF NOT EXISTS images_c2 ON images (c2);
+CREATE INDEX IF NOT EXISTS images_c3 ON images (c3);
+"""
+
+# DCT-II basis for the low frequencies only: COS[u][x]
+_COS = [[math.cos((2 * x + 1) * u * math.pi / (2 * IMG_SIZE)) for x in range(IMG_SIZE)]
+        for u in range(HASH_SIZE)]
+
+
+def phash(path: str) -> Optional[int]:
+    """64-bit perceptual hash of an image, or None without Pillow."""
+    if Image is None:
+        return None
+
+    with Image.open(path) as img:
+        pixels = list(img.convert("L").resize((IMG_SIZE, IMG_SIZE), Image.LANCZOS).getdata())
+
+    rows = [pixels[y * IMG_SIZE:(y + 1) * IMG_SIZE] for y in range(IMG_SIZE)]
+    # Separable 2D DCT: along rows, then along columns (low frequencies only)
+    row_dct = [[sum(c * p for c, p in zip(_COS[u], row)) for u in range(HASH_SIZE)]
+               for row in rows]
+    coeffs = [sum(_COS[v][y] * row_dct[y][u] for y in range(IMG_SIZE))
+              for v in range(HASH_SIZE) for u in range(HASH_SIZE)]
+
+    # Compare against the median, ignoring the DC term
+    median = sorted(coeffs[1:])[len(coeffs[1:]) // 2]
+    value = 0
+    for c in coeffs:
+        value = (value << 1) | (1 if c > median else 0)
+    return value
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+def _chunks(value: int) -> List[int]:
+    return [(value >> (CHUNK_BITS * i)) & CHUNK_MASK for i in range(CHUNKS)]
+
+
+def _signed(value: int) -> int:
+    """Store unsigned 64-bit hashes in SQLite's signed INTEGER."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+@lru_cache(maxsize=None)
+def _flip_masks(radius: int) -> tuple:
+    """XOR masks flipping at most `radius` bits of a chunk."""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for bits in combinations(range(CHUNK_BITS), r):
+            masks.append(sum(1 << bit for bit in bits))
+    return tuple(masks)
+
+
+def _variants(chunk: int, radius: int) -> List[int]:
+    """All chunk values within `radius` bits of chunk."""
+    return [chunk ^ mask for mask in _flip_masks(radius)]
+
+
+class PHashIndex:
+    """SQLite-backed multi-index hash of generated images"""
+
+    def __init__(self, db_path: Path = PHASH_INDEX_DB):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(db_path), timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, path: str, digest: Optional[str] = None) -> Optional[int]:
+        """Hash and index an image. Returns the hash, or None if not hashable."""
+        value = phash(path)
+        if value is None:
+            return None
+        if digest is None:
+            digest = file_digest(Path(path))
+        with self.db:
+            self.db.execute(
+                "INSERT OR REPLACE INTO images (digest, path, phash, c0, c1, c2, c3, created_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (digest, str(path), _signed(value), *_chunks(value), time.time())
+            )
+        return value
+
+    def near(self, value: int, max_distance: int = PHASH_DUPLICATE_DISTANCE,
+             exclude_digest: Optional[str] = None) -> List[dict]:
+        """
+        Find indexed images within max_distance bits of a hash.
+
+        Returns:
+            List[dict]: {"digest", "path", "distance"} sorted by distance
+        """
+        sub_radius = max_distance // CHUNKS
+        clauses = []
+        params = []
+        for i, chunk in enumerate(_chunks(value)):
+            variants = _variants(chunk, sub_radius)
+            clauses.append(f"c{i} IN ({','.join('?' * len(variants))})")
+            params.extend(variants)
+
+        rows = self.db.execute(
+            f"SELECT digest, path, phash FROM images WHERE {' OR '.join(clauses)}", params
+        ).fetchall()
+
+        matches = []
+        for digest, path, stored in rows:
+            if digest == exclude_digest:
+                continue
+            distance = hamming(value, stored & 0xFFFFFFFFFFFFFFFF)
+            if distance <= max_distance and Path(path).exists():
+                matches.append({"digest": digest, "path": path, "distance": distance})
+        return sorted(matches, key=lambda m: m["distance"])
+
+    def near_image(self, path: str, max_distance: int = PHASH_DUPLICATE_DISTANCE) -> List[dict]:
+        """Near-duplicates of an image file (which need not be indexed)."""
+        value = phash(path)
+        if value is None:
+            raise RuntimeError("Pillow is required for perceptual hashing (pip install Pillow)")
+        return self.near(value, max_distance, exclude_digest=file_digest(Path(path)))
+
+    def duplicate_groups(self, max_distance: int = PHASH_DUPLICATE_DISTANCE) -> List[List[dict]]:
+        """
+        Group all indexed images into clusters of near-duplicates.
+
+        Builds the chunk tables in memory once, so each image costs a handful
+        of dictionary lookups instead of a comparison with every other image.
+        """
+        rows = [(d, p, h & 0xFFFFFFFFFFFFFFFF) for d, p, h in
+                self.db.execute("SELECT digest, path, phash FROM images")
+                if Path(p).exists()]
+        tables: List[Dict[int, List[int]]] = [{} for _ in range(CHUNKS)]
+        for idx, (_, _, value) in enumerate(rows):
+            for i, chunk in enumerate(_chunks(value)):
+                tables[i].setdefault(chunk, []).append(idx)
+
+        parent = list(range(len(rows)))
+
+        def find(i):
+            while parent[i] != i:
+                parent[i] = parent[parent[i]]
+                i = parent[i]
+            return i
+
+        masks = _flip_masks(max_distance // CHUNKS)
+        for idx, (_, _, value) in enumerate(rows):
+            for i, chunk in enumerate(_chunks(value)):
+                table = tables[i]
+                for mask in masks:
+                    bucket = table.get(chunk ^ mask)
+                    if not bucket:
+                        continue
+                    for other in bucket:
+                        if other > idx and hamming(value, rows[other][2]) <= max_distance:
+                            parent[find(other)] = find(idx)
+
+        groups: Dict[int, List[dict]] = {}
+        for idx, (digest, path, _) in enumerate(rows):
+            groups.setdefault(find(idx), []).append({"digest": digest, "path": path})
+        return [g for g in groups.values() if len(g) > 1]
+
+    def backfill(self, directory: Path = OUTPUT_DIR) -> int:
+        """Index images in a directory that are not indexed yet. Returns count added."""
+        known = {p for (p,) in self.db.execute("SELECT path FROM images")}
+        added = 0
+        for path in sorted(directory.iterdir()):
+            if path.suffix.lower() not in IMAGE_EXTENSIONS or str(path) in known:
+                continue
+            try:
+                if self.add(str(path)) is not None:
+                    added += 1
+            except Exception as e:
+                print(f"   ⚠️  Skipping {path.name}: {e}")
+        return added
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Perceptual-hash index of generated images")
+    parser.add_argument("action", choices=["backfill", "near", "report"], help="Action to perform")
+    parser.add_argument("image", nargs="?", help="Image to compare (near)")
+    parser.add_argument("--distance", type=int, default=PHASH_DUPLICATE_DISTANCE,
+                        help=f"Max Hamming distance (default: {PHASH_DUPLICATE_DISTANCE})")
+    args = parser.parse_args()
+
+    if Image is None:
+        print("❌ Pillow is required: pip install Pillow")
+        return 1
+
+    with PHashIndex() as index:
+        start = time.perf_counter()
+        if args.action == "backfill":
+            added = index.backfill()
+            print(f"✓ Indexed {added} images")
+        elif args.action == "near":
+            if not args.image:
+                print("❌ near requires an image path")
+                return 1
+            print(json.dumps(index.near_image(args.image, args.distance), indent=2))
+        else:
+            groups = index.duplicate_groups(args.distance)
+            print(json.dumps({"groups": groups, "count": len(groups)}, indent=2, ensure_ascii=False))
+        print(f"({(time.perf_counter() - start) * 1000:.1f} ms)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,499 @@
+#!/usr/bin/env python3
+"""
+Browser profile manager for Gemini Image Generator
+Snapshots an authenticated "golden" profile and stamps out worker profiles
+
+Every Chrome instance needs its own user_data_dir. Instead of running
+`auth_manager.py setup` once per worker, authenticate once, snapshot the
+profile, and clone it for as many parallel workers as needed.
+
+Clones use copy-on-write reflinks where the filesystem supports them
+(btrfs, XFS, APFS via cp) and fall back to a plain copy otherwise. Caches
+are skipped either way. Hardlinks are deliberately not used: Chrome updates
+its SQLite/LevelDB files in place, so a write in one worker would leak into
+the golden profile and every other worker.
+
+Compaction strips a profile down to PROFILE_KEEP_PATHS (cookies, local
+storage, preferences) so HTTP cache, service workers, GPU cache and history
+stop accumulating. Launch time is measured before and after and appended to
+PROFILE_MAINTENANCE_LOG, which is what compaction should be scheduled from.
+
+Usage:
+    python profile_manager.py snapshot              # Golden snapshot of BROWSER_PROFILE_DIR
+    python profile_manager.py clone --workers 4     # Create worker-0 .. worker-3
+    python profile_manager.py list                  # Show golden + worker profiles
+    python profile_manager.py compact               # Compact BROWSER_PROFILE_DIR
+    python profile_manager.py compact --workers 4 --measure
+    python profile_manager.py bench                 # Measure launch time only
+"""
+
+import sys
+import os
+import json
+import time
+import shutil
+import argparse
+from pathlib import Path
+from statistics import median
+from typing import List, Optional, Tuple
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import (
+    BROWSER_PROFILE_DIR,
+    STATE_FILE,
+    GOLDEN_PROFILE_DIR,
+    WORKER_PROFILES_DIR,
+    PROFILE_CACHE_DIRS,
+    PROFILE_LOCK_FILES,
+    PROFILE_KEEP_PATHS,
+    PROFILE_MAINTENANCE_LOG,
+    BROWSER_STATS_DIR,
+    GEMINI_URL
+)
+
+# linux/fs.h: _IOW(0x94, 9, int)
+FICLONE = 0x40049409
+
+GOLDEN_INFO_NAME = "golden_info.json"
+
+
+def _reflink(src: Path, dst: Path) -> bool:
+    """Try a copy-on-write clone of src to dst. Returns False if unsupported."""
+    try:
+        import fcntl
+    except ImportError:
+        return False
+
+    try:
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        shutil.copystat(src, dst)
+        return True
+    except OSError:
+        dst.unlink(missing_ok=True)
+        return False
+
+
+def copy_profile(src: Path, dst: Path, skip_dirs: List[str] = PROFILE_CACHE_DIRS) -> dict:
+    """
+    Copy a Chrome profile without caches or lock files.
+
+    Args:
+        src: Source user_data_dir
+        dst: Destination user_data_dir (must not exist)
+        skip_dirs: Directory names to skip at any depth
+
+    Returns:
+        dict: {"files": n, "bytes": n, "reflinked": n, "seconds": s}
+    """
+    start = time.time()
+    stats = {"files": 0, "bytes": 0, "reflinked": 0}
+    skip = set(skip_dirs)
+    use_reflink = True
+
+    for root, dirs, files in os.walk(src):
+        dirs[:] = [d for d in dirs if d not in skip]
+        rel = Path(root).relative_to(src)
+        target_dir = dst / rel
+        target_dir.mkdir(parents=True, exist_ok=True)
+
+        for name in files:
+            if name in PROFILE_LOCK_FILES:
+                continue
+            s = Path(root) / name
+            d = target_dir / name
+            if s.is_symlink():
+                continue
+
+            if use_reflink and _reflink(s, d):
+                stats["reflinked"] += 1
+            else:
+                # One failure means the filesystem can't reflink; stop trying
+                use_reflink = False
+                shutil.copy2(s, d)
+
+            stats["files"] += 1
+            stats["bytes"] += d.stat().st_size
+
+    stats["seconds"] = round(time.time() - start, 3)
+    return stats
+
+
+def profile_in_use(profile_dir: Path) -> bool:
+    """Chrome leaves a SingletonLock symlink while a profile is open."""
+    return os.path.lexists(profile_dir / "SingletonLock")
+
+
+def golden_paths() -> Tuple[Path, Path]:
+    """Return (profile_dir, state_file) of the golden snapshot."""
+    return GOLDEN_PROFILE_DIR / "profile", GOLDEN_PROFILE_DIR / "state.json"
+
+
+def worker_paths(index: int) -> Tuple[Path, Path]:
+    """Return (profile_dir, state_file) for worker N."""
+    worker_dir = WORKER_PROFILES_DIR / f"worker-{index}"
+    return worker_dir / "profile", worker_dir / "state.json"
+
+
+def snapshot_golden(source: Path = BROWSER_PROFILE_DIR, state_file: Path = STATE_FILE) -> bool:
+    """
+    Snapshot an authenticated profile as the golden profile.
+
+    Args:
+        source: Authenticated user_data_dir (default: BROWSER_PROFILE_DIR)
+        state_file: Storage state saved by auth_manager.py setup
+
+    Returns:
+        bool: True if snapshot was created
+    """
+    if not source.exists():
+        print(f"❌ Profile not found: {source}")
+        print("   Run: python scripts/run.py auth_manager.py setup")
+        return False
+
+    if not state_file.exists():
+        print("❌ No saved session (state.json). Authenticate first:")
+        print("   Run: python scripts/run.py auth_manager.py setup")
+        return False
+
+    if profile_in_use(source):
+        print(f"⚠️  {source} looks in use (SingletonLock present)")
+        print("   Close the browser first for a consistent snapshot")
+        return False
+
+    golden_profile, golden_state = golden_paths()
+    staging = GOLDEN_PROFILE_DIR.with_name(GOLDEN_PROFILE_DIR.name + ".tmp")
+    if staging.exists():
+        shutil.rmtree(staging)
+
+    print(f"📸 Snapshotting {source}...")
+    stats = copy_profile(source, staging / "profile")
+    shutil.copy2(state_file, staging / "state.json")
+
+    info = {
+        "source": str(source),
+        "created": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "state_mtime": state_file.stat().st_mtime,
+        **stats
+    }
+    with open(staging / GOLDEN_INFO_NAME, 'w') as f:
+        json.dump(info, f, indent=2)
+
+    # Swap in atomically so clones never see a half-written golden profile
+    if GOLDEN_PROFILE_DIR.exists():
+        shutil.rmtree(GOLDEN_PROFILE_DIR)
+    staging.rename(GOLDEN_PROFILE_DIR)
+
+    print(f"✓ Golden profile saved: {golden_profile}")
+    print(f"  {stats['files']} files, {stats['bytes'] / 1024 / 1024:.1f} MB, {stats['seconds']}s")
+    return True
+
+
+def clone_workers(count: int, force: bool = False) -> List[Path]:
+    """
+    Create worker profiles from the golden snapshot.
+
+    Existing worker profiles are kept unless force is set, so this can be
+    rerun to scale up without disturbing running workers.
+
+    Args:
+        count: Number of worker profiles (worker-0 .. worker-{count-1})
+        force: Recreate profiles that already exist
+
+    Returns:
+        List[Path]: Profile directories of all requested workers
+    """
+    golden_profile, golden_state = golden_paths()
+    if not golden_profile.exists():
+        print("❌ No golden profile. Run: python profile_manager.py snapshot")
+        return []
+
+    profiles = []
+    for index in range(count):
+        profile_dir, state_file = worker_paths(index)
+
+        if profile_dir.exists() and not force:
+            print(f"   → worker-{index}: exists, keeping")
+            profiles.append(profile_dir)
+            continue
+
+        if profile_in_use(profile_dir):
+            print(f"⚠️  worker-{index} is in use, skipping")
+            profiles.append(profile_dir)
+            continue
+
+        if profile_dir.parent.exists():
+            shutil.rmtree(profile_dir.parent)
+
+        stats = copy_profile(golden_profile, profile_dir)
+        # Cookies are re-injected from this file via BrowserFactory._inject_cookies
+        shutil.copy2(golden_state, state_file)
+        mode = "reflink" if stats["reflinked"] else "copy"
+        print(f"   ✓ worker-{index}: {stats['files']} files ({mode}) in {stats['seconds']}s")
+        profiles.append(profile_dir)
+
+    return profiles
+
+
+def profile_size(profile_dir: Path) -> int:
+    """Total bytes of regular files in a profile (symlinks not followed)."""
+    total = 0
+    for root, _, files in os.walk(profile_dir):
+        for name in files:
+            path = Path(root) / name
+            if not path.is_symlink():
+                total += path.stat().st_size
+    return total
+
+
+def compact_profile(profile_dir: Path, keep_paths: List[str] = PROFILE_KEEP_PATHS) -> dict:
+    """
+    Delete everything in a profile except auth-relevant storage.
+
+    Args:
+        profile_dir: user_data_dir to compact (browser must be closed)
+        keep_paths: Paths relative to profile_dir to keep (files or directories)
+
+    Returns:
+        dict: {"bytes_before": n, "bytes_after": n, "removed": n}
+    """
+    keep = {Path(p) for p in keep_paths}
+    # Directories that contain something we keep must be descended into
+    ancestors = {parent for p in keep for parent in p.parents if parent != Path(".")}
+
+    bytes_before = profile_size(profile_dir)
+    removed = 0
+
+    def _walk(directory: Path):
+        nonlocal removed
+        for entry in list(directory.iterdir()):
+            rel = entry.relative_to(profile_dir)
+            if rel in keep:
+                continue
+            if rel in ancestors and entry.is_dir() and not entry.is_symlink():
+                _walk(entry)
+                continue
+            if entry.is_dir() and not entry.is_symlink():
+                shutil.rmtree(entry, ignore_errors=True)
+            else:
+                entry.unlink(missing_ok=True)
+            removed += 1
+
+    _walk(profile_dir)
+
+    return {
+        "bytes_before": bytes_before,
+        "bytes_after": profile_size(profile_dir),
+        "removed": removed
+    }
+
+
+def measure_launch(profile_dir: Path, state_file: Optional[Path] = None,
+                   runs: int = 3, tmpfs_cache: Optional[bool] = None) -> Optional[float]:
+    """
+    Measure cold launch time of a profile (launch + Gemini domcontentloaded).
+
+    Args:
+        profile_dir: user_data_dir to launch
+        state_file: Storage state for cookie re-injection
+        runs: Number of launches; the median is returned
+        tmpfs_cache: Override PROFILE_TMPFS_CACHE for this measurement
+
+    Returns:
+        float: Median seconds, or None if every launch failed
+    """
+    from patchright.sync_api import sync_playwright
+    from browser_utils import BrowserFactory
+
+    timings = []
+    with sync_playwright() as playwright:
+        for _ in range(runs):
+            start = time.time()
+            context = None
+            try:
+                context = BrowserFactory.launch_persistent_context(
+                    playwright,
+                    headless=True,
+                    user_data_dir=str(profile_dir),
+                    state_file=state_file,
+                    tmpfs_cache=tmpfs_cache
+                )
+                page = context.pages[0] if context.pages else context.new_page()
+                page.goto(GEMINI_URL, wait_until="domcontentloaded", timeout=30000)
+                timings.append(time.time() - start)
+            except Exception as e:
+                print(f"   ⚠️  Launch failed: {e}")
+            finally:
+                if context:
+                    context.close()
+
+    return round(median(timings), 3) if timings else None
+
+
+def maintain_profile(profile_dir: Path, state_file: Optional[Path] = None,
+                     measure: bool = False, runs: int = 3) -> Optional[dict]:
+    """
+    Compact one profile, optionally timing launches before and after.
+
+    The result is appended to PROFILE_MAINTENANCE_LOG.
+    """
+    if not profile_dir.exists():
+        print(f"❌ Profile not found: {profile_dir}")
+        return None
+
+    if profile_in_use(profile_dir):
+        print(f"⚠️  {profile_dir} is in use, skipping")
+        return None
+
+    print(f"🧹 Compacting {profile_dir}...")
+    record = {
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "profile": str(profile_dir)
+    }
+
+    if measure:
+        record["launch_before"] = measure_launch(profile_dir, state_file, runs)
+
+    record.update(compact_profile(profile_dir))
+
+    if measure:
+        record["launch_after"] = measure_launch(profile_dir, state_file, runs)
+
+    PROFILE_MAINTENANCE_LOG.parent.mkdir(parents=True, exist_ok=True)
+    with open(PROFILE_MAINTENANCE_LOG, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+
+    freed_mb = (record["bytes_before"] - record["bytes_after"]) / 1024 / 1024
+    print(f"   ✓ Freed {freed_mb:.1f} MB ({record['removed']} entries removed)")
+    if measure:
+        print(f"   Launch: {record['launch_before']}s → {record['launch_after']}s")
+    return record
+
+
+def list_profiles():
+    """Print golden and worker profiles."""
+    golden_profile, _ = golden_paths()
+    info_file = GOLDEN_PROFILE_DIR / GOLDEN_INFO_NAME
+    if info_file.exists():
+        with open(info_file, 'r') as f:
+            info = json.load(f)
+        print(f"Golden: {golden_profile}")
+        print(f"  Created: {info.get('created')}")
+        print(f"  Files: {info.get('files')}, {info.get('bytes', 0) / 1024 / 1024:.1f} MB")
+    else:
+        print("Golden: (none)")
+
+    # Memory/recycling stats exported by ManagedBrowser, keyed by profile path
+    browser_stats = {}
+    if BROWSER_STATS_DIR.exists():
+        for stats_file in BROWSER_STATS_DIR.glob("*.json"):
+            try:
+                with open(stats_file, 'r') as f:
+                    stats = json.load(f)
+                browser_stats[str(Path(stats["profile"]).resolve())] = stats
+            except (OSError, ValueError, KeyError):
+                continue
+
+    if WORKER_PROFILES_DIR.exists():
+        for worker_dir in sorted(WORKER_PROFILES_DIR.iterdir()):
+            profile_dir = worker_dir / "profile"
+            state = "in use" if profile_in_use(profile_dir) else "idle"
+            line = f"  {worker_dir.name}: {state}"
+            stats = browser_stats.get(str(profile_dir.resolve()))
+            if stats:
+                memory = stats.get("memory") or {}
+                line += (f", {stats['total_jobs']} jobs, {stats['launches']} launches, "
+                         f"{memory.get('total_mb', '-')} MB")
+            print(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Manage golden and worker browser profiles",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python profile_manager.py snapshot             # After auth_manager.py setup
+  python profile_manager.py clone --workers 4    # Stamp out 4 worker profiles
+  python profile_manager.py clone --workers 4 --force
+  python profile_manager.py list
+  python profile_manager.py compact --measure    # Compact BROWSER_PROFILE_DIR
+  python profile_manager.py compact --workers 4  # Compact worker-0 .. worker-3
+  python profile_manager.py bench --tmpfs-cache  # Launch time with caches on tmpfs
+        """
+    )
+    parser.add_argument(
+        "action",
+        choices=["snapshot", "clone", "list", "compact", "bench"],
+        help="Action to perform"
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        help="Number of worker profiles to create (default: 1) or maintain"
+    )
+    parser.add_argument(
+        "--profile",
+        help="Profile directory for compact/bench (default: BROWSER_PROFILE_DIR)"
+    )
+    parser.add_argument(
+        "--measure",
+        action="store_true",
+        help="Measure launch time before and after compaction"
+    )
+    parser.add_argument(
+        "--runs",
+        type=int,
+        default=3,
+        help="Launches per measurement (default: 3)"
+    )
+    parser.add_argument(
+        "--tmpfs-cache",
+        action="store_true",
+        help="bench: keep disposable caches on tmpfs"
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="Recreate worker profiles that already exist"
+    )
+    args = parser.parse_args()
+
+    if args.action == "snapshot":
+        return 0 if snapshot_golden() else 1
+
+    elif args.action == "clone":
+        count = args.workers or 1
+        profiles = clone_workers(count, force=args.force)
+        return 0 if len(profiles) == count else 1
+
+    elif args.action == "list":
+        list_profiles()
+        return 0
+
+    # Targets for compact/bench: an explicit profile, worker profiles, or the default one
+    if args.profile:
+        targets = [(Path(args.profile), None)]
+    elif args.workers:
+        targets = [worker_paths(i) for i in range(args.workers)]
+    else:
+        targets = [(BROWSER_PROFILE_DIR, STATE_FILE)]
+
+    if args.action == "compact":
+        results = [maintain_profile(p, s, measure=args.measure, runs=args.runs)
+                   for p, s in targets]
+        return 0 if all(results) else 1
+
+    elif args.action == "bench":
+        for profile_dir, state_file in targets:
+            seconds = measure_launch(profile_dir, state_file, args.runs,
+                                     tmpfs_cache=args.tmpfs_cache or None)
+            print(f"{profile_dir}: {seconds}s (median of {args.runs}, "
+                  f"{profile_size(profile_dir) / 1024 / 1024:.1f} MB)")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
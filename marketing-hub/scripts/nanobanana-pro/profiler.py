@@ -0,0 +1,431 @@
+#!/usr/bin/env python3
+"""
+Round-trip profiler for Gemini Image Generator
+Counts and times every Playwright call and stealth sleep by call site and phase
+
+Most of the generator's own overhead is Playwright IPC (count, is_visible,
+bounding_box, get_attribute inside polling loops) and the human-like
+sleeps in StealthUtils. With profiling on (PROFILE_ENABLED, or
+profile=True / --profile for one job), every public Page, Frame, Locator,
+ElementHandle, Keyboard, Mouse and BrowserContext method is wrapped to
+record, per (method, call site, phase):
+
+- calls, total and max seconds, errors (timeouts included)
+
+StealthUtils sleeps are recorded the same way, by the function that slept
+and its caller. Phases are the generator's own (setup, probe, submit,
+wait, save, recovery). Calls made inside another wrapped call, local
+helpers such as page.locator() and get_by_*(), and calls from threads
+without an active profile are not counted.
+
+With PROFILE_SAMPLING a background thread also samples the job thread's
+Python stack every PROFILE_SAMPLE_INTERVAL seconds (wall clock, so waits
+show up too). The hottest frames of this skill are listed in the report
+and all stacks are written as <report>.folded (flamegraph.pl, speedscope).
+
+One JSON report per job is written to PROFILE_DIR; the job's timings get
+ipc_calls, ipc_ms and sleep_ms.
+
+Usage:
+    python profiler.py list                 # Recent reports
+    python profiler.py show                 # Latest report: phases, top calls and sleeps
+    python profiler.py show <report.json>
+    python profiler.py summary --last 50    # Most expensive call sites across jobs
+"""
+
+import sys
+import json
+import time
+import inspect
+import argparse
+import functools
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Optional
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import (
+    PROFILE_ENABLED,
+    PROFILE_DIR,
+    PROFILE_SAMPLING,
+    PROFILE_SAMPLE_INTERVAL,
+    PROFILE_MAX_REPORTS
+)
+
+# Playwright classes whose public methods are wrapped
+PROFILED_CLASSES = ["Page", "Frame", "Locator", "ElementHandle", "Keyboard", "Mouse", "BrowserContext"]
+# Methods that build objects locally or register handlers (no round trip)
+LOCAL_METHODS = {"locator", "nth", "filter", "and_", "or_", "frame_locator",
+                 "on", "once", "remove_listener"}
+LOCAL_PREFIXES = ("get_by_", "expect_")
+# Entries per list in a report
+REPORT_TOP = 50
+MAX_STACK_DEPTH = 64
+
+# This skill's modules (except this one), to find the innermost own frame of sampled stacks
+SKILL_FILES = {path.name for path in Path(__file__).parent.glob("*.py")} - {Path(__file__).name}
+
+_install_lock = threading.Lock()
+_installed = False
+
+
+class _State(threading.local):
+    profile = None  # Active Profile of this thread
+    depth = 0  # Nesting of wrapped calls
+
+
+_state = _State()
+
+
+def _site(frame) -> str:
+    return f"{Path(frame.f_code.co_filename).name}:{frame.f_lineno} {frame.f_code.co_name}"
+
+
+def _wrap(owner: str, name: str, fn):
+    method = f"{owner}.{name}"
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        profile = _state.profile
+        if profile is None or _state.depth:
+            return fn(*args, **kwargs)
+        site = _site(sys._getframe(1))
+        _state.depth += 1
+        start = time.perf_counter()
+        error = False
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            error = True
+            raise
+        finally:
+            _state.depth -= 1
+            profile.add_call(method, site, time.perf_counter() - start, error)
+
+    wrapper.__profiled__ = True
+    return wrapper
+
+
+def install():
+    """Wrap the Playwright methods (once per process; a no-op without an active profile)."""
+    global _installed
+    with _install_lock:
+        if _installed:
+            return
+        import patchright.sync_api as sync_api
+
+        for owner in PROFILED_CLASSES:
+            cls = getattr(sync_api, owner, None)
+            if cls is None:
+                continue
+            for name, attr in list(vars(cls).items()):
+                if (name.startswith("_") or name in LOCAL_METHODS or name.startswith(LOCAL_PREFIXES)
+                        or not inspect.isfunction(attr) or getattr(attr, "__profiled__", False)):
+                    continue
+                setattr(cls, name, _wrap(owner, name, attr))
+        _installed = True
+
+
+class Profile:
+    """Call and sleep statistics of one job on the current thread"""
+
+    def __init__(self, job_id: str, directory: Path = PROFILE_DIR,
+                 sampling: bool = PROFILE_SAMPLING,
+                 interval: float = PROFILE_SAMPLE_INTERVAL):
+        self.job_id = job_id
+        self.directory = Path(directory)
+        self.sampling = sampling
+        self.interval = interval
+        self.started = time.time()
+        self.calls = {}  # (method, site, phase) -> [count, seconds, max, errors]
+        self.sleeps = {}  # (function, site, phase) -> [count, seconds]
+        self.phase_seconds = {}
+        self.phase_name = "setup"
+        self.samples = Counter()  # Folded stack -> samples
+        self._phase_started = time.perf_counter()
+        self._start = time.perf_counter()
+        self._thread_id = threading.get_ident()
+        self._previous = None
+        self._sampler = None
+        self._stop = threading.Event()
+
+    def start(self) -> "Profile":
+        install()
+        self._previous = _state.profile
+        _state.profile = self
+        if self.sampling:
+            self._sampler = threading.Thread(target=self._sample, daemon=True)
+            self._sampler.start()
+        return self
+
+    def enter_phase(self, name: str) -> str:
+        """Attribute everything from now on to phase name. Returns the previous phase."""
+        now = time.perf_counter()
+        previous = self.phase_name
+        self.phase_seconds[previous] = self.phase_seconds.get(previous, 0.0) + now - self._phase_started
+        self.phase_name = name
+        self._phase_started = now
+        return previous
+
+    def add_call(self, method: str, site: str, seconds: float, error: bool = False):
+        entry = self.calls.setdefault((method, site, self.phase_name), [0, 0.0, 0.0, 0])
+        entry[0] += 1
+        entry[1] += seconds
+        entry[2] = max(entry[2], seconds)
+        entry[3] += error
+
+    def add_sleep(self, function: str, site: str, seconds: float):
+        entry = self.sleeps.setdefault((function, site, self.phase_name), [0, 0.0])
+        entry[0] += 1
+        entry[1] += seconds
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self._thread_id)
+            stack = []
+            while frame is not None and len(stack) < MAX_STACK_DEPTH:
+                stack.append(f"{Path(frame.f_code.co_filename).name}:{frame.f_code.co_name}")
+                frame = frame.f_back
+            if stack:
+                self.samples[";".join(reversed(stack))] += 1
+
+    def summary(self) -> dict:
+        """Totals for the job's timings."""
+        return {
+            "ipc_calls": sum(c[0] for c in self.calls.values()),
+            "ipc_ms": round(sum(c[1] for c in self.calls.values()) * 1000, 1),
+            "sleep_ms": round(sum(s[1] for s in self.sleeps.values()) * 1000, 1)
+        }
+
+    def finish(self, **result) -> Optional[Path]:
+        """
+        Stop profiling and write the report.
+
+        Args:
+            **result: Job outcome to include (e.g. success, failure)
+
+        Returns:
+            Path: The report, or None if it could not be written
+        """
+        self.enter_phase(self.phase_name)
+        if _state.profile is self:
+            _state.profile = self._previous
+        if self._sampler:
+            self._stop.set()
+            self._sampler.join(timeout=1)
+
+        stamp = time.strftime("%Y%m%d-%H%M%S", time.localtime(self.started))
+        path = self.directory / f"{stamp}-{self.job_id}.json"
+        try:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            report = self._report(result)
+            if self.samples:
+                folded = path.with_suffix(".folded")
+                with open(folded, 'w') as f:
+                    for stack, count in self.samples.most_common():
+                        f.write(f"{stack} {count}\n")
+                report["samples"]["folded"] = folded.name
+            with open(path, 'w') as f:
+                json.dump(report, f, indent=2, ensure_ascii=False)
+            prune(self.directory)
+        except OSError as e:
+            print(f"   ⚠️  Could not write profile: {e}")
+            return None
+        return path
+
+    def _report(self, result: dict) -> dict:
+        seconds = time.perf_counter() - self._start
+        phases = {}
+        for phase, phase_seconds in self.phase_seconds.items():
+            phases[phase] = {"seconds": round(phase_seconds, 3), "calls": 0,
+                             "call_seconds": 0.0, "sleep_seconds": 0.0}
+        for (_, _, phase), (count, total, _, _) in self.calls.items():
+            phases[phase]["calls"] += count
+            phases[phase]["call_seconds"] += total
+        for (_, _, phase), (_, total) in self.sleeps.items():
+            phases[phase]["sleep_seconds"] += total
+        for entry in phases.values():
+            entry["call_seconds"] = round(entry["call_seconds"], 3)
+            entry["sleep_seconds"] = round(entry["sleep_seconds"], 3)
+
+        calls = sorted(self.calls.items(), key=lambda item: item[1][1], reverse=True)
+        sleeps = sorted(self.sleeps.items(), key=lambda item: item[1][1], reverse=True)
+        summary = self.summary()
+        return {
+            "job_id": self.job_id,
+            "started": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.started)),
+            "seconds": round(seconds, 3),
+            "result": result,
+            "totals": {
+                "calls": summary["ipc_calls"],
+                "call_seconds": round(summary["ipc_ms"] / 1000, 3),
+                "sleep_seconds": round(summary["sleep_ms"] / 1000, 3),
+                "other_seconds": round(seconds - (summary["ipc_ms"] + summary["sleep_ms"]) / 1000, 3)
+            },
+            "phases": phases,
+            "calls": [
+                {"method": method, "site": site, "phase": phase, "count": count,
+                 "seconds": round(total, 4), "max_ms": round(longest * 1000, 1), "errors": errors}
+                for (method, site, phase), (count, total, longest, errors) in calls[:REPORT_TOP]
+            ],
+            "sleeps": [
+                {"function": function, "site": site, "phase": phase, "count": count,
+                 "seconds": round(total, 3)}
+                for (function, site, phase), (count, total) in sleeps[:REPORT_TOP]
+            ],
+            "samples": self._hot_frames()
+        }
+
+    def _hot_frames(self) -> dict:
+        # Innermost frame of this skill's own code per sample
+        hot = Counter()
+        for stack, count in self.samples.items():
+            frames = stack.split(";")
+            own = [f for f in frames if f.split(":")[0] in SKILL_FILES]
+            hot[own[-1] if own else frames[-1]] += count
+        total = sum(self.samples.values())
+        return {
+            "interval": self.interval if self.sampling else None,
+            "count": total,
+            "top": [{"frame": frame, "samples": count, "share": round(count / total, 3)}
+                    for frame, count in hot.most_common(REPORT_TOP)]
+        }
+
+
+def start(job_id: str, enabled: bool = None) -> Optional[Profile]:
+    """Start profiling a job on this thread if enabled (default: PROFILE_ENABLED)."""
+    if enabled is None:
+        enabled = PROFILE_ENABLED
+    if not enabled:
+        return None
+    try:
+        return Profile(job_id).start()
+    except Exception as e:
+        print(f"   ⚠️  Profiling unavailable: {e}")
+        return None
+
+
+def enter_phase(name: str):
+    """Switch the active profile's phase (no-op without one)."""
+    if _state.profile is not None:
+        _state.profile.enter_phase(name)
+
+
+@contextmanager
+def phase(name: str):
+    """Attribute a block to a phase, then return to the previous one."""
+    profile = _state.profile
+    if profile is None:
+        yield
+        return
+    previous = profile.enter_phase(name)
+    try:
+        yield
+    finally:
+        profile.enter_phase(previous)
+
+
+def sleep(seconds: float):
+    """time.sleep() that the active profile counts by sleeping function and its caller."""
+    profile = _state.profile
+    if profile is None:
+        time.sleep(seconds)
+        return
+    frame = sys._getframe(1)
+    time.sleep(seconds)
+    caller = frame.f_back
+    profile.add_sleep(frame.f_code.co_name, _site(caller) if caller else "?", seconds)
+
+
+def prune(directory: Path = PROFILE_DIR, max_reports: int = PROFILE_MAX_REPORTS):
+    """Delete the oldest reports beyond max_reports."""
+    reports = sorted(directory.glob("*.json"))
+    for report in reports[:max(0, len(reports) - max_reports)]:
+        report.unlink(missing_ok=True)
+        report.with_suffix(".folded").unlink(missing_ok=True)
+
+
+def _load(path: Path) -> dict:
+    with open(path, 'r') as f:
+        return json.load(f)
+
+
+def show(report: dict, top: int = 15):
+    totals = report["totals"]
+    print(f"{report['job_id']} ({report['started']}): {report['seconds']:.1f}s, "
+          f"{totals['calls']} calls {totals['call_seconds']:.1f}s, "
+          f"sleeps {totals['sleep_seconds']:.1f}s, other {totals['other_seconds']:.1f}s")
+
+    print(f"\n{'phase':<12}{'seconds':>9}{'calls':>8}{'calls s':>9}{'sleep s':>9}")
+    for name, p in report["phases"].items():
+        print(f"{name:<12}{p['seconds']:>9.2f}{p['calls']:>8}{p['call_seconds']:>9.2f}{p['sleep_seconds']:>9.2f}")
+
+    print(f"\n{'seconds':>8}{'count':>7}{'max ms':>9}  call (phase) @ site")
+    for c in report["calls"][:top]:
+        errors = f"  [{c['errors']} errors]" if c["errors"] else ""
+        print(f"{c['seconds']:>8.3f}{c['count']:>7}{c['max_ms']:>9.1f}  "
+              f"{c['method']} ({c['phase']}) @ {c['site']}{errors}")
+
+    if report["sleeps"]:
+        print(f"\n{'seconds':>8}{'count':>7}  sleep (phase) @ site")
+        for s in report["sleeps"][:top]:
+            print(f"{s['seconds']:>8.2f}{s['count']:>7}  {s['function']} ({s['phase']}) @ {s['site']}")
+
+    samples = report.get("samples") or {}
+    if samples.get("count"):
+        print(f"\nSampled frames ({samples['count']} samples):")
+        for frame in samples["top"][:top]:
+            print(f"{frame['share']:>8.0%}  {frame['frame']}")
+
+
+def summarize(reports: list, top: int = 25):
+    """Most expensive (method, call site) pairs across jobs, per job on average."""
+    calls = {}
+    for report in reports:
+        for c in report["calls"]:
+            entry = calls.setdefault((c["method"], c["site"]), [0, 0.0])
+            entry[0] += c["count"]
+            entry[1] += c["seconds"]
+    jobs = len(reports)
+    print(f"{jobs} jobs, {sum(r['seconds'] for r in reports) / jobs:.1f}s average\n")
+    print(f"{'s/job':>8}{'calls/job':>11}  call @ site")
+    ranked = sorted(calls.items(), key=lambda item: item[1][1], reverse=True)
+    for (method, site), (count, seconds) in ranked[:top]:
+        print(f"{seconds / jobs:>8.3f}{count / jobs:>11.1f}  {method} @ {site}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect per-job round-trip profiles")
+    parser.add_argument("action", choices=["list", "show", "summary"], help="Action to perform")
+    parser.add_argument("report", nargs="?", type=Path, help="Report to show (default: latest)")
+    parser.add_argument("--last", type=int, default=50, help="Reports to summarize (default: 50)")
+    parser.add_argument("--top", type=int, default=15, help="Rows per table (default: 15)")
+    args = parser.parse_args()
+
+    reports = sorted(PROFILE_DIR.glob("*.json")) if PROFILE_DIR.exists() else []
+    if args.action == "show" and args.report:
+        show(_load(args.report), args.top)
+        return 0
+    if not reports:
+        print("No profiles (enable PROFILE_ENABLED in config.py or use --profile)")
+        return 0
+
+    if args.action == "list":
+        for path in reports[-args.last:]:
+            report = _load(path)
+            totals = report["totals"]
+            print(f"{path.name}: {report['seconds']:.1f}s, {totals['calls']} calls "
+                  f"({totals['call_seconds']:.1f}s), sleeps {totals['sleep_seconds']:.1f}s")
+    elif args.action == "show":
+        show(_load(reports[-1]), args.top)
+    else:
+        summarize([_load(path) for path in reports[-args.last:]], args.top)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,367 @@
+#!/usr/bin/env python3
+"""
+Near-duplicate prompt index for Gemini Image Generator
+Finds previously generated images whose prompt is close enough to reuse
+
+Prompts are normalized (NFKC, lowercase, punctuation dropped) and turned
+into a feature set of tokens plus character 3-grams within each token.
+Working within tokens makes the features independent of word order and
+whitespace, and 3-grams handle Japanese without a tokenizer.
+
+Each feature set gets a 64-slot MinHash signature (one-permutation hashing,
+so one hash per feature). The signature is split into LSH_BANDS band keys
+stored in SQLite. A lookup reads the newest BUCKET_SCAN entries of each of
+its buckets through the (key, entry_id) primary key, ranks them by
+signature agreement and computes exact Jaccard similarity only for the best
+few, so it stays sub-millisecond at tens of thousands of prompts (bench:
+about 0.6 ms at 30k-50k templated prompts).
+
+Templated prompts crowd buckets, so an older entry can fall out of the
+scanned window. Identical feature sets (same words in any order or
+punctuation) are therefore also looked up in an exact table keyed by a hash
+of the whole set, which finds them however old they are, and callers look
+up the exact prompt with find_exact() first. Prompts are stored and looked
+up in prompt_text.normalize_prompt() form, so exact means equal up to
+Unicode width and whitespace, as for request coalescing.
+
+Usage:
+    python prompt_index.py find "夕焼けの海辺、油絵風"     # Best match + similarity
+    python prompt_index.py stats
+    python prompt_index.py bench --entries 50000         # Synthetic lookup benchmark
+"""
+
+import sys
+import time
+import sqlite3
+import hashlib
+import argparse
+import unicodedata
+from array import array
+from pathlib import Path
+from typing import List, Optional, Set
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import PROMPT_INDEX_DB, OUTPUT_DIR
+from prompt_text import normalize_prompt
+
+NUM_SLOTS = 64
+LSH_BANDS = 16
+ROWS_PER_BAND = NUM_SLOTS // LSH_BANDS
+BUCKET_SCAN = 8  # Newest entries read per LSH bucket (templates make buckets huge)
+MAX_RANK = 16  # Candidates (by shared buckets) ranked by signature agreement
+MAX_VERIFY = 3  # Best candidates re-scored with exact Jaccard per lookup
+SHINGLE_SIZE = 3
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS entries (
+    id INTEGER PRIMARY KEY,
+    prompt TEXT NOT NULL,
+    digest TEXT,
+    filename TEXT NOT NULL,
+    signature BLOB NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    key INTEGER NOT NULL,
+    entry_id INTEGER NOT NULL,
+    PRIMARY KEY (key, entry_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS bands_entry ON bands (entry_id);
+CREATE TABLE IF NOT EXISTS exact (
+    key INTEGER NOT NULL,
+    entry_id INTEGER NOT NULL,
+    PRIMARY KEY (key, entry_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS exact_entry ON exact (entry_id);
+CREATE INDEX IF NOT EXISTS entries_prompt ON entries (prompt);
+"""
+
+
+_CANDIDATE_SQL = " UNION ALL ".join(
+    f"SELECT * FROM (SELECT entry_id FROM bands WHERE key = ? "
+    f"ORDER BY entry_id DESC LIMIT {BUCKET_SCAN})"
+    for _ in range(LSH_BANDS)
+)
+_EXACT_SQL = f"SELECT entry_id FROM exact WHERE key = ? ORDER BY entry_id DESC LIMIT {MAX_VERIFY}"
+
+
+def _signed64(value: int) -> int:
+    """Map an unsigned 64-bit hash onto SQLite's signed INTEGER range."""
+    return value - (1 << 64) if value >= (1 << 63) else value
+
+
+def _hash64(data: bytes) -> int:
+    return int.from_bytes(hashlib.blake2b(data, digest_size=8).digest(), "little")
+
+
+def features(prompt: str) -> Set[str]:
+    """Order-insensitive feature set: tokens + within-token character 3-grams."""
+    text = unicodedata.normalize("NFKC", prompt).lower()
+    # Punctuation and symbols become separators
+    text = "".join(
+        " " if unicodedata.category(ch)[0] in "PSZ" else ch
+        for ch in text
+    )
+    feats = set()
+    for token in text.split():
+        feats.add(token)
+        for i in range(len(token) - SHINGLE_SIZE + 1):
+            feats.add(token[i:i + SHINGLE_SIZE])
+    return feats
+
+
+def signature(feats: Set[str]) -> List[int]:
+    """One-permutation MinHash: one hash per feature, min per slot, densified."""
+    empty = 1 << 64
+    slots = [empty] * NUM_SLOTS
+    for feat in feats:
+        h = _hash64(feat.encode("utf-8"))
+        slot = h % NUM_SLOTS
+        value = h // NUM_SLOTS
+        if value < slots[slot]:
+            slots[slot] = value
+
+    # Densify: empty slots borrow from the next filled slot (rotation)
+    if any(v != empty for v in slots):
+        for i in range(NUM_SLOTS):
+            if slots[i] == empty:
+                j = i
+                offset = 0
+                while slots[j] == empty:
+                    j = (j + 1) % NUM_SLOTS
+                    offset += 1
+                slots[i] = slots[j] + offset
+    return slots
+
+
+def band_keys(sig: List[int]) -> List[int]:
+    """LSH band keys as signed 64-bit ints (SQLite INTEGER range)."""
+    keys = []
+    for band in range(LSH_BANDS):
+        rows = sig[band * ROWS_PER_BAND:(band + 1) * ROWS_PER_BAND]
+        data = array("Q", [band] + [v & 0xFFFFFFFFFFFFFFFF for v in rows]).tobytes()
+        keys.append(_signed64(_hash64(data)))
+    return keys
+
+
+def feature_key(feats: Set[str]) -> int:
+    """Hash of a whole feature set, for the exact table."""
+    return _signed64(_hash64("\x00".join(sorted(feats)).encode("utf-8")))
+
+
+def _pack(sig: List[int]) -> bytes:
+    return array("Q", [v & 0xFFFFFFFFFFFFFFFF for v in sig]).tobytes()
+
+
+def _unpack(blob: bytes) -> array:
+    sig = array("Q")
+    sig.frombytes(blob)
+    return sig
+
+
+def jaccard(a: Set[str], b: Set[str]) -> float:
+    if not a and not b:
+        return 1.0
+    return len(a & b) / len(a | b)
+
+
+class PromptIndex:
+    """SQLite-backed MinHash/LSH index of generated prompts"""
+
+    def __init__(self, db_path: Path = PROMPT_INDEX_DB):
+        Path(db_path).parent.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(str(db_path), timeout=30)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        self.db.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def add(self, prompt: str, filename: str, digest: Optional[str] = None) -> int:
+        """Index the prompt of a generated image. Returns the entry id."""
+        with self.db:
+            return self._insert(normalize_prompt(prompt), filename, digest, time.time())
+
+    def _insert(self, prompt: str, filename: str, digest: Optional[str], created_at: float) -> int:
+        """Write an entry with its band and exact keys (caller commits)."""
+        feats = features(prompt)
+        sig = signature(feats)
+        cur = self.db.execute(
+            "INSERT INTO entries (prompt, digest, filename, signature, created_at) "
+            "VALUES (?, ?, ?, ?, ?)",
+            (prompt, digest, filename, _pack(sig), created_at)
+        )
+        entry_id = cur.lastrowid
+        self.db.executemany(
+            "INSERT OR IGNORE INTO bands (key, entry_id) VALUES (?, ?)",
+            [(key, entry_id) for key in band_keys(sig)]
+        )
+        self.db.execute("INSERT OR IGNORE INTO exact (key, entry_id) VALUES (?, ?)",
+                        (feature_key(feats), entry_id))
+        return entry_id
+
+    def find(self, prompt: str, threshold: float = 0.0,
+             require_file: bool = True) -> Optional[dict]:
+        """
+        Find the most similar indexed prompt.
+
+        Args:
+            prompt: Prompt to look up
+            threshold: Minimum Jaccard similarity (0-1) of feature sets
+            require_file: Skip (and prune) entries whose image was evicted
+
+        Returns:
+            dict: {"prompt", "filename", "digest", "similarity"} or None
+        """
+        feats = features(normalize_prompt(prompt))
+        sig = signature(feats)
+
+        # Candidates: newest entries of each bucket this prompt falls into,
+        # gathered in one statement
+        hits = {}
+        for (entry_id,) in self.db.execute(_CANDIDATE_SQL, band_keys(sig)):
+            hits[entry_id] = hits.get(entry_id, 0) + 1
+        top = sorted(hits, key=hits.get, reverse=True)[:MAX_RANK]
+        # Identical feature sets, however crowded their buckets are
+        for (entry_id,) in self.db.execute(_EXACT_SQL, (feature_key(feats),)):
+            if entry_id not in top:
+                top.append(entry_id)
+        if not top:
+            return None
+
+        placeholders = ",".join("?" * len(top))
+        rows = self.db.execute(
+            f"SELECT id, prompt, filename, digest, signature FROM entries "
+            f"WHERE id IN ({placeholders})",
+            top
+        ).fetchall()
+
+        # Rank by estimated similarity (share of equal signature slots)
+        ranked = []
+        for row in rows:
+            other_sig = _unpack(row[4])
+            agree = sum(1 for a, b in zip(sig, other_sig) if a == b) / NUM_SLOTS
+            ranked.append((agree, row[0], row))
+        ranked.sort(reverse=True)
+
+        best = None
+        for _, entry_id, (_, other, filename, digest, _) in ranked[:MAX_VERIFY]:
+            similarity = jaccard(feats, features(other))
+            if similarity < threshold or (best and similarity <= best["similarity"]):
+                continue
+            if require_file and not (OUTPUT_DIR / filename).exists():
+                self.remove(entry_id)
+                continue
+            best = {
+                "prompt": other,
+                "filename": filename,
+                "digest": digest,
+                "similarity": round(similarity, 3)
+            }
+        return best
+
+    def find_exact(self, prompt: str, require_file: bool = True) -> Optional[dict]:
+        """
+        Find the newest image generated for exactly this prompt (after
+        normalize_prompt(), so full-width and repeated spaces don't matter).
+
+        Returns:
+            dict: {"prompt", "filename", "digest", "similarity"} or None
+        """
+        prompt = normalize_prompt(prompt)
+        rows = self.db.execute(
+            "SELECT id, filename, digest FROM entries WHERE prompt = ? ORDER BY id DESC",
+            (prompt,)
+        ).fetchall()
+        for entry_id, filename, digest in rows:
+            if require_file and not (OUTPUT_DIR / filename).exists():
+                self.remove(entry_id)
+                continue
+            return {"prompt": prompt, "filename": filename, "digest": digest, "similarity": 1.0}
+        return None
+
+    def remove(self, entry_id: int):
+        with self.db:
+            self.db.execute("DELETE FROM bands WHERE entry_id = ?", (entry_id,))
+            self.db.execute("DELETE FROM exact WHERE entry_id = ?", (entry_id,))
+            self.db.execute("DELETE FROM entries WHERE id = ?", (entry_id,))
+
+    def stats(self) -> dict:
+        entries = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {"entries": entries, "bands": LSH_BANDS, "slots": NUM_SLOTS}
+
+
+def _bench(entries: int, lookups: int = 1000):
+    """Fill a throwaway index with synthetic prompts and time lookups."""
+    import random
+    import tempfile
+
+    subjects = ["猫", "犬", "富士山", "coffee cup", "sneakers", "夕焼けの海辺", "city skyline",
+                "ramen", "桜並木", "robot", "lipstick", "watch", "tea set", "mountain cabin"]
+    styles = ["油絵風", "watercolor", "アニメ調", "photorealistic", "minimalist", "3D render",
+              "ポップアート", "film photo", "isometric", "浮世絵風"]
+    extras = ["soft light", "高コントラスト", "pastel colors", "夜景", "bokeh", "top view",
+              "白背景", "golden hour", "neon", "vintage"]
+
+    def make_prompt(rng):
+        return (f"{rng.choice(subjects)} {rng.choice(styles)} {rng.choice(extras)} "
+                f"{rng.choice(extras)} 商品画像 #{rng.randint(0, 10 ** 6)}")
+
+    rng = random.Random(42)
+    with tempfile.TemporaryDirectory() as tmp:
+        index = PromptIndex(Path(tmp) / "bench.db")
+        start = time.time()
+        with index.db:
+            for i in range(entries):
+                index._insert(make_prompt(rng), f"{i}.png", None, 0)
+        print(f"Indexed {entries} prompts in {time.time() - start:.1f}s")
+
+        queries = [make_prompt(rng) for _ in range(lookups)]
+        start = time.perf_counter()
+        for query in queries:
+            index.find(query, threshold=0.8, require_file=False)
+        per_lookup = (time.perf_counter() - start) / lookups * 1000
+        print(f"Lookup: {per_lookup:.3f} ms average over {lookups} queries")
+        index.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Near-duplicate prompt index")
+    parser.add_argument("action", choices=["find", "stats", "bench"], help="Action to perform")
+    parser.add_argument("prompt", nargs="?", help="Prompt to look up (find)")
+    parser.add_argument("--threshold", type=float, default=0.0,
+                        help="Minimum similarity for find (default: 0.0)")
+    parser.add_argument("--entries", type=int, default=20000,
+                        help="Synthetic prompts for bench (default: 20000)")
+    args = parser.parse_args()
+
+    if args.action == "bench":
+        _bench(args.entries)
+        return 0
+
+    with PromptIndex() as index:
+        if args.action == "stats":
+            print(index.stats())
+            return 0
+
+        if not args.prompt:
+            print("❌ find requires a prompt")
+            return 1
+        start = time.perf_counter()
+        match = index.find(args.prompt, args.threshold)
+        elapsed_ms = (time.perf_counter() - start) * 1000
+        print(match if match else "No match")
+        print(f"({elapsed_ms:.3f} ms)")
+        return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
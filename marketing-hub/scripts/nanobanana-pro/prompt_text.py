@@ -0,0 +1,11 @@
+"""
+Prompt text helpers for Gemini Image Generator
+Normalization shared by request coalescing, the prompt index and matrix expansion
+"""
+
+import unicodedata
+
+
+def normalize_prompt(prompt: str) -> str:
+    """NFKC-normalize and collapse whitespace (full-width spaces included)."""
+    return " ".join(unicodedata.normalize("NFKC", prompt).split())
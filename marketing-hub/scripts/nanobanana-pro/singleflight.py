@@ -0,0 +1,131 @@
+"""
+Singleflight coalescing for Gemini Image Generator
+Concurrent jobs with the same normalized prompt and options share one generation
+
+The first job for a key becomes the leader and holds an exclusive flock on
+INFLIGHT_DIR/<key>.lock while it generates. Jobs arriving meanwhile block on
+the same lock and, once the leader releases it, read the result it
+published to <key>.json.
+
+- Leader fails: every waiter receives the same failure result.
+- Leader is cancelled or killed: nothing is published, so the next waiter
+  takes over as leader and runs the generation itself. Results marked
+  "cancelled" are never published either.
+- Waiter is cancelled: it simply stops waiting; the leader is unaffected.
+
+flock locks belong to an open file description, so this coalesces threads of
+one process as well as separate generate.py processes.
+"""
+
+import os
+import json
+import time
+import hashlib
+from pathlib import Path
+from typing import Callable, Tuple
+
+from config import INFLIGHT_DIR, INFLIGHT_RESULT_TTL
+from prompt_text import normalize_prompt
+
+try:
+    import fcntl
+except ImportError:  # No coalescing without flock (Windows)
+    fcntl = None
+
+POLL_INTERVAL = 0.5
+
+
+def request_key(prompt: str, **options) -> str:
+    """Key identifying generations that would produce interchangeable results."""
+    payload = json.dumps(
+        {"prompt": normalize_prompt(prompt), "options": options},
+        sort_keys=True, ensure_ascii=False
+    )
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+
+class SingleFlight:
+    """Cross-process request coalescing keyed by request_key()"""
+
+    def __init__(self, directory: Path = INFLIGHT_DIR):
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+
+    def do(self, key: str, fn: Callable[[], dict], cancel=None) -> Tuple[dict, bool]:
+        """
+        Run fn() once per key across all concurrent callers.
+
+        Args:
+            key: Coalescing key (see request_key)
+            fn: Generation to run; must return a JSON-serializable dict
+            cancel: CancelToken; a cancelled waiter raises GenerationError(CANCELLED)
+
+        Returns:
+            tuple: (result, shared) where shared is True if another caller's
+                   result was reused
+        """
+        if fcntl is None:
+            return fn(), False
+
+        lock_path = self.directory / f"{key}.lock"
+        result_path = self.directory / f"{key}.json"
+        joined_at = time.time()
+
+        with open(lock_path, 'a') as lock:
+            try:
+                fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                print("   → Identical prompt already generating, waiting for its result...")
+                # Poll rather than block so KeyboardInterrupt/SIGTERM stay responsive
+                while True:
+                    if cancel is not None:
+                        cancel.check()
+                    time.sleep(POLL_INTERVAL)
+                    try:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        break
+                    except BlockingIOError:
+                        continue
+
+            try:
+                # A leader that finished after we arrived published for us
+                published = self._read(result_path)
+                if published and published.get("finished_at", 0) >= joined_at:
+                    return published["result"], True
+
+                result = fn()
+                if not result.get("cancelled"):
+                    self._publish(result_path, result)
+                return result, False
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _read(self, path: Path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _publish(self, path: Path, result: dict):
+        tmp = path.with_suffix(".tmp")
+        with open(tmp, 'w') as f:
+            json.dump({"finished_at": time.time(), "result": result}, f, ensure_ascii=False)
+        os.replace(tmp, path)
+        self._sweep()
+
+    def _sweep(self):
+        """Drop results and idle lock files nobody can still be waiting for."""
+        cutoff = time.time() - INFLIGHT_RESULT_TTL
+        for entry in self.directory.iterdir():
+            try:
+                if entry.stat().st_mtime >= cutoff:
+                    continue
+                if entry.suffix == ".lock":
+                    with open(entry, 'a') as lock:
+                        fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                        entry.unlink()
+                else:
+                    entry.unlink()
+            except OSError:
+                continue  # In use or already gone
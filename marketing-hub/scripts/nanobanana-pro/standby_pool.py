@@ -0,0 +1,236 @@
+"""
+Standby tab pool for Gemini Image Generator
+Keeps tabs open on a fresh chat in image mode, so a new job starts typing at once
+
+Preparing a tab (loading Gemini, clicking "画像の作成", finding the input)
+takes several seconds of every job. A worker that keeps prepared tabs in
+standby skips that: generate_with_context takes one from the pool and
+sends the prompt right away.
+
+How many tabs to keep follows the recent arrival rate, read from the job
+timing log (shared by all generator processes on the host, so the rate is
+split across the workers): by Little's law, rate x preparation time tabs
+are consumed while a new one is being prepared. At least one tab is kept
+while jobs are arriving, at most STANDBY_MAX_TABS. Without a job in the
+last STANDBY_RATE_WINDOW seconds the target drops to zero and the pool
+closes its tabs, so an idle worker holds no extra renderers.
+
+Tabs are prepared only between jobs (see supervisor.worker_main), one per
+call of tick(), so prewarming never delays a job by more than one tab's
+preparation. Tabs older than STANDBY_MAX_AGE are re-prepared; Gemini
+sessions go stale. Tabs of cancelled jobs come back through release() and
+are prepared again instead of being replaced by new ones.
+
+Hits (job started on a standby tab) and misses (pool empty when a job
+needed a tab) are counted and reported with the worker status:
+
+    python supervisor.py status
+"""
+
+import math
+import time
+from typing import Optional, Tuple
+
+from config import STANDBY_MAX_TABS, STANDBY_RATE_WINDOW, STANDBY_MAX_AGE
+from circuit_breaker import CircuitBreaker
+from timings import TimingLog
+
+# Re-read the timing log at most this often (seconds)
+RATE_CHECK_INTERVAL = 5
+# Assumed preparation time until one has been measured (seconds)
+DEFAULT_PREPARE_SECONDS = 8.0
+# Pause prewarming after a failed preparation (seconds)
+PREPARE_BACKOFF = 60
+
+
+class StandbyPool:
+    """Prepared tabs of one browser context, sized by the recent arrival rate"""
+
+    def __init__(self, max_tabs: int = STANDBY_MAX_TABS,
+                 window: float = STANDBY_RATE_WINDOW,
+                 max_age: float = STANDBY_MAX_AGE,
+                 share: float = 1.0,
+                 timing_log: Optional[TimingLog] = None):
+        self.max_tabs = max_tabs
+        self.window = window
+        self.max_age = max_age
+        self.share = share  # This worker's part of the host's arrivals
+        self.timing_log = timing_log or TimingLog()
+
+        self._context = None
+        self._tabs = []  # [{"page", "image_mode", "prepared_at"}], oldest first
+        self._released = []  # Pages handed back to be prepared again
+        self._rate = 0.0
+        self._rate_checked = 0.0
+        self._paused_until = 0.0
+        self.prepare_seconds = None
+        self.hits = 0
+        self.misses = 0
+        self.prepared = 0
+        self.discarded = 0
+        self.failed = 0
+
+    def _bind(self, context):
+        # A recycled or crashed browser took its tabs with it
+        if context is not self._context:
+            self._context = context
+            self._tabs = []
+            self._released = []
+
+    def _owns(self, page) -> bool:
+        return (any(tab["page"] is page for tab in self._tabs)
+                or any(released is page for released in self._released))
+
+    def arrival_rate(self) -> float:
+        """Jobs per second reaching this worker, from the recent job history."""
+        now = time.time()
+        if now - self._rate_checked >= RATE_CHECK_INTERVAL:
+            # Retried attempts are logged too; count each job once
+            recent = [r for r in self.timing_log.recent()
+                      if now - r.get("time", 0) <= self.window
+                      and (r.get("success") or r.get("final", True))]
+            self._rate = len(recent) / self.window * self.share
+            self._rate_checked = now
+        return self._rate
+
+    def target(self) -> int:
+        """Number of tabs to keep prepared now."""
+        rate = self.arrival_rate()
+        if not self.max_tabs or not rate:
+            return 0
+        prepare = self.prepare_seconds or DEFAULT_PREPARE_SECONDS
+        return max(1, min(self.max_tabs, math.ceil(rate * prepare)))
+
+    def take(self, context) -> Optional[Tuple[object, bool]]:
+        """
+        Hand out the freshest prepared tab.
+
+        Returns:
+            tuple: (page, image_mode) on a hit, None on a miss
+        """
+        self._bind(context)
+        while self._tabs:
+            tab = self._tabs.pop()
+            if self._usable(tab):
+                self.hits += 1
+                return tab["page"], tab["image_mode"]
+            self._discard(tab)
+        self.misses += 1
+        return None
+
+    def release(self, page):
+        """Take back a tab whose job was cancelled; the next tick() prepares it again."""
+        if not self._owns(page):
+            self._released.append(page)
+
+    def spare_page(self, context):
+        """A tab that is not held in standby (new if there is none)."""
+        self._bind(context)
+        for page in context.pages:
+            if not self._owns(page):
+                return page
+        return context.new_page()
+
+    def tick(self, context) -> bool:
+        """
+        Bring the pool towards its target; call between jobs.
+
+        Drops stale tabs, closes surplus ones and leftover tabs of earlier
+        jobs, and prepares at most one new tab.
+
+        Returns:
+            bool: True if a tab was prepared
+        """
+        self._bind(context)
+        for tab in list(self._tabs):
+            if not self._usable(tab):
+                self._tabs.remove(tab)
+                self._discard(tab)
+
+        target = self.target()
+        while len(self._tabs) > target:
+            self._discard(self._tabs.pop(0))
+
+        # Tabs used by earlier jobs are still on their conversation; keep one for probes
+        spare = [p for p in context.pages if not self._owns(p)]
+        for page in spare[1:]:
+            _close_quietly(page)
+
+        if len(self._tabs) >= target or time.time() < self._paused_until:
+            while self._released:
+                _close_quietly(self._released.pop())
+            return False
+        if CircuitBreaker().is_open():
+            return False  # Don't load a UI that is known to be broken
+        return self._prepare(context)
+
+    def _prepare(self, context) -> bool:
+        from image_generator import _prepare_tab, _find_input
+
+        print(f"   → Preparing standby tab ({len(self._tabs) + 1}/{self.target()})...")
+        start = time.time()
+        page = None
+        while self._released and page is None:
+            page = self._released.pop()
+            if page.is_closed():
+                page = None
+        page = page or context.new_page()
+        try:
+            image_mode = _prepare_tab(page)
+            _find_input(page).focus()
+        except Exception as e:
+            print(f"   ⚠️  Standby tab preparation failed: {e}")
+            _close_quietly(page)
+            self.failed += 1
+            self._paused_until = time.time() + PREPARE_BACKOFF
+            return False
+
+        elapsed = time.time() - start
+        self.prepare_seconds = (elapsed if self.prepare_seconds is None
+                                else 0.8 * self.prepare_seconds + 0.2 * elapsed)
+        self._tabs.append({"page": page, "image_mode": image_mode, "prepared_at": time.time()})
+        self.prepared += 1
+        return True
+
+    def _usable(self, tab: dict) -> bool:
+        page = tab["page"]
+        if time.time() - tab["prepared_at"] > self.max_age:
+            return False
+        try:
+            # Still on a fresh chat (not signed out, not in a conversation)
+            return not page.is_closed() and "/app" in page.url and "/app/c" not in page.url
+        except Exception:
+            return False
+
+    def _discard(self, tab: dict):
+        _close_quietly(tab["page"])
+        self.discarded += 1
+
+    def clear(self):
+        """Close all standby tabs."""
+        while self._tabs:
+            self._discard(self._tabs.pop())
+        while self._released:
+            _close_quietly(self._released.pop())
+
+    def stats(self) -> dict:
+        requests = self.hits + self.misses
+        return {
+            "ready": len(self._tabs),
+            "target": self.target(),
+            "arrivals_per_min": round(self.arrival_rate() * 60, 2),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / requests, 3) if requests else None,
+            "prepared": self.prepared,
+            "discarded": self.discarded,
+            "failed": self.failed,
+            "prepare_seconds": round(self.prepare_seconds, 2) if self.prepare_seconds else None
+        }
+
+
+def _close_quietly(page):
+    try:
+        page.close()
+    except Exception:
+        pass
@@ -0,0 +1,413 @@
+#!/usr/bin/env python3
+"""
+Multi-process worker supervisor for Gemini Image Generator
+Runs one generator process per worker profile so throughput scales with cores
+
+Each worker is a separate Python process with its own cloned browser
+profile (see profile_manager.py clone) and a long-lived, recycled browser
+(browser_utils.ManagedBrowser). Workers claim jobs from the shared job
+queue in lane/deadline order, so no extra dispatching is needed: a free
+worker simply takes the next job.
+
+While the supervisor runs, generate.py only submits jobs to the queue and
+waits for the result, instead of launching a browser of its own. With
+COORDINATION_BACKEND set, the queue is shared by the supervisors of
+several hosts (see coordination.py): claimed jobs are leased, and this
+supervisor announces its capacity and reassigns jobs of dead nodes.
+
+The supervisor restarts crashed workers (with backoff if they keep
+crashing) and puts the jobs they were running back in the queue. Every
+worker reports its utilization to SUPERVISOR_DIR/worker-N.json and the
+supervisor aggregates them into SUPERVISOR_DIR/status.json.
+
+Between jobs, each worker keeps tabs prepared in image mode
+(standby_pool.py) as long as jobs keep arriving, so claimed jobs start
+typing without loading Gemini first.
+
+Running jobs can be cancelled by id through the queue (`python
+job_queue.py cancel ID`); the worker polls the job's cancel flag, stops
+Gemini and takes the next job. A worker that loses a job's lease stops
+that job the same way, since another node now runs it.
+
+With remote output storage (output_storage.py), workers upload finished
+images in the background and move on to the next job at once. The job
+itself is only finished (and its URL handed out) once the upload has
+landed; the supervisor retries uploads left in the spool.
+
+The supervisor also keeps OUTPUT_DIR within its disk budget, with an
+image_store.py retention pass every RETENTION_INTERVAL.
+
+Usage:
+    python supervisor.py run --workers 4    # Needs worker profiles 0..3
+    python supervisor.py status             # Per-worker utilization
+"""
+
+import os
+import sys
+import json
+import time
+import signal
+import argparse
+import multiprocessing
+from pathlib import Path
+from typing import Optional
+
+# Add parent to path for imports
+sys.path.insert(0, str(Path(__file__).parent))
+
+from config import (
+    OUTPUT_DIR,
+    SUPERVISOR_DIR,
+    SUPERVISOR_WORKERS,
+    SUPERVISOR_HEARTBEAT,
+    SUPERVISOR_MAX_RESTART_DELAY,
+    STORAGE_DRAIN_TIMEOUT,
+    DEFAULT_TIMEOUT
+)
+from job_queue import JobQueue
+from coordination import CoordinationBackend, LeaseKeeper, get_backend
+from cancellation import CancelToken
+from image_store import ImageStore
+import output_storage
+
+STATUS_FILE = SUPERVISOR_DIR / "status.json"
+POLL_INTERVAL = 0.5
+
+
+def _write_json(path: Path, data: dict):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    tmp = path.with_suffix(".tmp")
+    with open(tmp, 'w') as f:
+        json.dump(data, f, indent=2, ensure_ascii=False)
+    os.replace(tmp, path)
+
+
+def _read_json(path: Path) -> Optional[dict]:
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def supervisor_status() -> Optional[dict]:
+    """Status of the running supervisor, or None if there is none."""
+    status = _read_json(STATUS_FILE)
+    if not status or time.time() - status.get("updated_at", 0) > 3 * SUPERVISOR_HEARTBEAT:
+        return None
+    try:
+        os.kill(status["pid"], 0)
+    except (ProcessLookupError, KeyError):
+        return None
+    except PermissionError:
+        pass
+    return status
+
+
+def open_queue(slots: int):
+    """The shared coordination backend if configured, else this host's job queue."""
+    return get_backend() or JobQueue(slots=slots)
+
+
+def worker_name(queue, index: int) -> str:
+    """Worker names are unique across hosts when a coordination backend is used."""
+    if isinstance(queue, CoordinationBackend):
+        return f"{queue.node}/worker-{index}"
+    return f"worker-{index}"
+
+
+def run_job(context, job: dict, standby=None, cancel: CancelToken = None) -> dict:
+    """Run one queued job on a worker's browser context."""
+    from generate import build_result
+    from image_generator import generate_with_context
+
+    payload = job["payload"]
+    filename = payload["filename"]
+    total_timeout = payload.get("total_timeout")
+    remaining = job["deadline"] - time.time()
+    total_timeout = min(total_timeout, remaining) if total_timeout else remaining
+
+    OUTPUT_DIR.mkdir(parents=True, exist_ok=True)
+    generation = generate_with_context(
+        context, job["prompt"], str(OUTPUT_DIR / filename),
+        timeout=payload.get("timeout", DEFAULT_TIMEOUT),
+        total_timeout=total_timeout,
+        hedge=payload.get("hedge"),
+        job_id=job["id"],
+        standby=standby,
+        cancel=cancel,
+        profile=payload.get("profile")
+    )
+    return build_result(generation, job["prompt"], filename)
+
+
+def finish_after_upload(queue, job: dict, result: dict, upload, lease=None):
+    """
+    Finish a job once its image upload has landed, without waiting for it.
+
+    The job's slot is freed so the worker can run the next job; the job
+    itself stays RUNNING (its lease still renewed) until the upload's
+    done-callback records the result, so no caller gets a URL that does not
+    work yet. A failed upload finishes the job as failed; the spool keeps
+    retrying it.
+    """
+    from generate import upload_failed_result
+
+    if not isinstance(queue, CoordinationBackend):
+        queue.release_slot(job["id"])
+
+    def done(future):
+        ok = not future.cancelled() and future.exception() is None and future.result()
+        if lease:
+            lease.stop()
+            # After losing the lease only a finished image is worth reporting
+            if lease.lost and not ok:
+                return
+        final = result if ok else upload_failed_result(result)
+        try:
+            if isinstance(queue, CoordinationBackend):
+                queue.finish(job["id"], final, worker=job["worker"])
+            else:
+                # Runs on the upload thread; SQLite connections stay with their thread
+                with JobQueue(slots=queue.slots) as reporter:
+                    reporter.finish(job["id"], final)
+        except Exception as e:
+            print(f"   ❌ Could not finish job {job['id']} after its upload: {e}")
+
+    upload.add_done_callback(done)
+
+
+def worker_main(index: int, slots: int, stop):
+    """Worker process: claim jobs and run them on this worker's profile."""
+    from browser_utils import ManagedBrowser
+    from profile_manager import worker_paths
+    from standby_pool import StandbyPool
+
+    # The supervisor handles Ctrl+C; workers stop through the stop event
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    queue = open_queue(slots)
+    name = worker_name(queue, index)
+    status_path = SUPERVISOR_DIR / f"worker-{index}.json"
+    profile_dir, state_file = worker_paths(index)
+    started = time.time()
+    stats = {"worker": name, "pid": os.getpid(), "started_at": started,
+             "jobs": 0, "failed": 0, "cancelled": 0, "busy_seconds": 0.0, "current_job": None}
+    standby = StandbyPool(share=1 / slots)
+
+    def report(browser):
+        stats["updated_at"] = time.time()
+        stats["utilization"] = round(stats["busy_seconds"] / max(1e-9, time.time() - started), 3)
+        stats["browser"] = browser.stats()
+        stats["standby"] = standby.stats()
+        uploader = output_storage.get_uploader()
+        if uploader:
+            stats["uploads"] = uploader.stats()
+        _write_json(status_path, stats)
+
+    with ManagedBrowser(user_data_dir=str(profile_dir), state_file=state_file) as browser:
+        last_report = 0
+        while not stop.is_set():
+            job = queue.claim(worker=name)
+            if job is None:
+                if time.time() - last_report >= SUPERVISOR_HEARTBEAT:
+                    browser.maybe_recycle()  # Idle browsers get closed
+                    report(browser)
+                    last_report = time.time()
+                # Keep tabs ready while jobs arrive (launches the browser if needed)
+                if browser.running or standby.target():
+                    try:
+                        standby.tick(browser.start())
+                    except Exception as e:
+                        print(f"[{name}] ⚠️  Standby pool: {e}")
+                stop.wait(POLL_INTERVAL)
+                continue
+
+            print(f"[{name}] Job {job['id']}: {job['prompt'][:60]}")
+            stats["current_job"] = job["id"]
+            report(browser)
+            job_start = time.time()
+            result = None
+            # Shared queues need proof of life while the job runs
+            lease = (LeaseKeeper(queue, job["id"], name)
+                     if isinstance(queue, CoordinationBackend) else None)
+            cancel = CancelToken(poll=lambda: bool(lease and lease.lost)
+                                 or queue.cancel_requested(job["id"]))
+            if lease:
+                lease.start()
+            try:
+                with browser.job() as context:
+                    result = run_job(context, job, standby, cancel)
+            except Exception as e:
+                print(f"[{name}] ❌ Job {job['id']} failed: {e}")
+                result = {"success": False, "error": str(e)}
+            finally:
+                result = result or {"success": False, "error": "interrupted"}
+                upload = output_storage.pending_upload(result.get("url"))
+                if upload is not None and not (lease and lease.lost):
+                    finish_after_upload(queue, job, result, upload, lease)
+                else:
+                    if lease:
+                        lease.stop()
+                    # After losing the lease only a finished image is worth reporting
+                    if result.get("success") or not (lease and lease.lost):
+                        queue.finish(job["id"], result, worker=name)
+
+            stats["jobs"] += 1
+            stats["failed"] += 0 if result.get("success") else 1
+            stats["cancelled"] += 1 if result.get("cancelled") else 0
+            stats["busy_seconds"] += time.time() - job_start
+            stats["current_job"] = None
+            report(browser)
+            last_report = time.time()
+    # Uploads first: their done-callbacks still finish jobs through the queue
+    output_storage.shutdown(STORAGE_DRAIN_TIMEOUT)
+    queue.close()
+
+
+class Supervisor:
+    """Starts, watches and restarts worker processes"""
+
+    def __init__(self, workers: int = SUPERVISOR_WORKERS):
+        self.count = workers
+        self.ctx = multiprocessing.get_context("spawn")  # No forking a process that drove Chrome
+        self.stop = self.ctx.Event()
+        self.procs = {}
+        self.restarts = {i: 0 for i in range(workers)}
+        self.crash_streak = {i: 0 for i in range(workers)}
+        self.next_start = {i: 0.0 for i in range(workers)}
+        self.started_at = time.time()
+
+    def _start(self, index: int):
+        proc = self.ctx.Process(target=worker_main, args=(index, self.count, self.stop),
+                                name=f"worker-{index}")
+        proc.start()
+        self.procs[index] = (proc, time.time())
+
+    def _check(self, queue):
+        now = time.time()
+        for index in range(self.count):
+            entry = self.procs.get(index)
+            if entry and entry[0].is_alive():
+                continue
+            if entry:
+                proc, started = entry
+                del self.procs[index]
+                requeued = queue.requeue(worker_name(queue, index))
+                # Crashing right after start again and again: back off
+                self.crash_streak[index] = self.crash_streak[index] + 1 if now - started < 60 else 1
+                delay = min(SUPERVISOR_MAX_RESTART_DELAY, 2 ** (self.crash_streak[index] - 1))
+                self.next_start[index] = now + delay
+                self.restarts[index] += 1
+                print(f"⚠️  worker-{index} exited (code {proc.exitcode}), "
+                      f"requeued {requeued} job(s), restarting in {delay}s")
+            if now >= self.next_start[index]:
+                self._start(index)
+
+    def status(self) -> dict:
+        workers = []
+        for index in range(self.count):
+            worker = _read_json(SUPERVISOR_DIR / f"worker-{index}.json") or {"worker": f"worker-{index}"}
+            entry = self.procs.get(index)
+            worker["alive"] = bool(entry and entry[0].is_alive())
+            worker["restarts"] = self.restarts[index]
+            workers.append(worker)
+        return {
+            "pid": os.getpid(),
+            "workers": self.count,
+            "started_at": self.started_at,
+            "updated_at": time.time(),
+            "worker_status": workers
+        }
+
+    def run(self):
+        def shutdown(signum, frame):
+            self.stop.set()
+
+        signal.signal(signal.SIGTERM, shutdown)
+        signal.signal(signal.SIGINT, shutdown)
+
+        print(f"🚀 Starting {self.count} workers")
+        uploader = output_storage.get_uploader()
+        with open_queue(self.count) as queue, ImageStore() as store:
+            shared = isinstance(queue, CoordinationBackend)
+            while not self.stop.is_set():
+                self._check(queue)
+                if uploader:
+                    uploader.resume()  # Uploads of exited workers, or out of retries
+                status = self.status()
+                _write_json(STATUS_FILE, status)
+                if shared:
+                    queue.node_heartbeat(self.count, {"busy": sum(
+                        1 for w in status["worker_status"] if w.get("current_job"))})
+                    queue.reap()
+                try:
+                    store.enforce_if_due()
+                except Exception as e:
+                    print(f"⚠️  Image retention failed: {e}")
+                self.stop.wait(SUPERVISOR_HEARTBEAT)
+
+            print("   → Stopping workers (finishing current jobs)...")
+            for proc, _ in self.procs.values():
+                proc.join(timeout=DEFAULT_TIMEOUT + 30)
+                if proc.is_alive():
+                    proc.terminate()
+            for index in range(self.count):
+                queue.requeue(worker_name(queue, index))
+            if shared:
+                queue.node_heartbeat(0)  # Stop counting this node as capacity
+        output_storage.shutdown(STORAGE_DRAIN_TIMEOUT)
+        STATUS_FILE.unlink(missing_ok=True)
+        print("✓ Supervisor stopped")
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Run generator workers across CPU cores",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+        epilog="""
+Examples:
+  python profile_manager.py clone --workers 4   # One profile per worker first
+  python supervisor.py run --workers 4
+  python supervisor.py status
+        """
+    )
+    parser.add_argument("action", choices=["run", "status"], help="Action to perform")
+    parser.add_argument("--workers", type=int, default=SUPERVISOR_WORKERS,
+                        help=f"Worker processes (default: {SUPERVISOR_WORKERS})")
+    args = parser.parse_args()
+
+    if args.action == "status":
+        status = supervisor_status()
+        if not status:
+            print("Supervisor not running")
+            return 1
+        for worker in status["worker_status"]:
+            memory = (worker.get("browser") or {}).get("memory") or {}
+            standby = worker.get("standby") or {}
+            hit_rate = standby.get("hit_rate")
+            print(f"{worker['worker']}: {'up' if worker['alive'] else 'down'}, "
+                  f"{worker.get('jobs', 0)} jobs ({worker.get('failed', 0)} failed), "
+                  f"utilization {worker.get('utilization', 0):.0%}, "
+                  f"{memory.get('total_mb', '-')} MB, restarts {worker['restarts']}, "
+                  f"standby {standby.get('ready', 0)}/{standby.get('target', 0)} "
+                  f"(hit rate {'-' if hit_rate is None else f'{hit_rate:.0%}'})"
+                  + (f", running {worker['current_job']}" if worker.get("current_job") else ""))
+        return 0
+
+    from profile_manager import worker_paths
+    missing = [i for i in range(args.workers) if not worker_paths(i)[0].exists()]
+    if missing:
+        print(f"❌ Missing worker profiles: {missing}")
+        print(f"   Run: python profile_manager.py clone --workers {args.workers}")
+        return 1
+    if supervisor_status():
+        print("❌ A supervisor is already running")
+        return 1
+
+    Supervisor(args.workers).run()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
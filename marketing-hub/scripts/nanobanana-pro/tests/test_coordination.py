@@ -0,0 +1,174 @@
+"""
+Tests for coordination.py
+Both backends as two nodes sharing one store (SQLite file, in-memory Redis)
+
+Run:
+    python -m unittest discover -s tests     # from scripts/nanobanana-pro
+"""
+
+import sys
+import time
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from coordination import SQLiteBackend, RedisBackend
+from job_queue import QUEUED, RUNNING, DONE, FAILED, CANCELLED
+
+try:
+    import fakeredis
+except ImportError:
+    fakeredis = None
+
+LEASE = 0.1  # Seconds; short enough to let leases run out inside a test
+OK = {"success": True, "images": ["out.png"]}
+ERROR = {"success": False, "error": "boom"}
+
+
+class BackendTests:
+    """Shared cases; subclasses provide backend(node, lease) on one shared store"""
+
+    def setUp(self):
+        self.node_a = self.backend("node-a", LEASE)
+        self.node_b = self.backend("node-b", LEASE)
+        self.node_a.node_heartbeat(1)
+
+    def submit(self, prompt="a red apple", **kwargs):
+        submitted = self.node_a.submit(prompt, deadline=600, **kwargs)
+        self.assertTrue(submitted["admitted"], submitted["reason"])
+        return submitted["job_id"]
+
+    def expire_leases(self):
+        time.sleep(LEASE * 2)
+
+    def test_submit_and_claim(self):
+        first = self.submit("first", payload={"n": 1})
+        second = self.submit("second")
+
+        job = self.node_b.claim("b-1")
+        self.assertEqual((job["id"], job["prompt"], job["payload"]), (first, "first", {"n": 1}))
+        self.assertEqual((job["state"], job["worker"], job["attempts"]), (RUNNING, "b-1", 1))
+        self.assertEqual(self.node_a.claim("a-1")["id"], second)
+        self.assertIsNone(self.node_a.claim("a-2"))
+
+        self.assertTrue(self.node_b.finish(first, OK, "b-1"))
+        self.assertEqual(self.node_a.get(first)["state"], DONE)
+
+    def test_interactive_lane_is_claimed_first(self):
+        self.submit("bulk", lane="bulk")
+        interactive = self.submit("interactive", lane="interactive")
+        self.assertEqual(self.node_b.claim("b-1")["id"], interactive)
+
+    def test_heartbeat(self):
+        job_id = self.submit()
+        self.node_b.claim("b-1")
+        for _ in range(4):
+            time.sleep(LEASE / 2)
+            self.assertTrue(self.node_b.heartbeat(job_id, "b-1"))
+        self.assertEqual(self.node_a.reap(), 0)  # Kept alive past several leases
+        self.assertFalse(self.node_b.heartbeat(job_id, "someone-else"))
+
+    def test_expired_lease_is_reassigned(self):
+        job_id = self.submit()
+        self.node_a.claim("a-1")
+        self.expire_leases()
+
+        self.assertEqual(self.node_b.reap(), 1)
+        self.assertEqual(self.node_b.get(job_id)["state"], QUEUED)
+        job = self.node_b.claim("b-1")
+        self.assertEqual((job["id"], job["attempts"]), (job_id, 2))
+
+    def test_stale_worker_cannot_renew_or_finish(self):
+        job_id = self.submit()
+        self.node_a.claim("a-1")
+        self.expire_leases()
+        self.node_b.reap()
+        self.node_b.claim("b-1")
+
+        self.assertFalse(self.node_a.heartbeat(job_id, "a-1"))
+        self.assertFalse(self.node_a.finish(job_id, ERROR, "a-1"))
+        self.assertEqual(self.node_b.get(job_id)["state"], RUNNING)
+        self.assertTrue(self.node_b.finish(job_id, ERROR, "b-1"))
+        self.assertEqual(self.node_b.get(job_id)["state"], FAILED)
+
+    def test_stale_worker_success_still_wins(self):
+        job_id = self.submit()
+        self.node_a.claim("a-1")
+        self.expire_leases()
+        self.node_b.reap()
+        self.node_b.claim("b-1")
+
+        self.assertTrue(self.node_a.finish(job_id, OK, "a-1"))
+        self.assertFalse(self.node_b.finish(job_id, OK, "b-1"))
+        self.assertEqual(self.node_b.get(job_id)["state"], DONE)
+
+    def test_cancel(self):
+        queued = self.submit("queued", lane="bulk")
+        running = self.submit("running", lane="interactive")
+        self.node_b.claim("b-1")
+
+        self.assertEqual(self.node_a.cancel(queued), CANCELLED)
+        self.assertEqual(self.node_a.get(queued)["state"], CANCELLED)
+        self.assertIsNone(self.node_b.claim("b-2"))
+
+        self.assertFalse(self.node_b.cancel_requested(running))
+        self.assertEqual(self.node_a.cancel(running), RUNNING)
+        self.assertTrue(self.node_b.cancel_requested(running))
+
+        self.assertIsNone(self.node_a.cancel(queued))  # Already finished
+        self.assertIsNone(self.node_a.cancel("no-such-job"))
+
+
+class SQLiteBackendTest(BackendTests, unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db_path = Path(self.tmp.name) / "coordination.db"
+        super().setUp()
+        self.addCleanup(self.node_a.close)
+        self.addCleanup(self.node_b.close)
+
+    def backend(self, node, lease):
+        return SQLiteBackend(db_path=self.db_path, node=node, lease=lease)
+
+
+@unittest.skipIf(fakeredis is None, "fakeredis not installed")
+class RedisBackendTest(BackendTests, unittest.TestCase):
+
+    def setUp(self):
+        self.server = fakeredis.FakeServer()
+        super().setUp()
+
+    def backend(self, node, lease):
+        return RedisBackend(client=fakeredis.FakeRedis(server=self.server), node=node, lease=lease)
+
+    def test_heartbeat_racing_reap_does_not_extend_a_reaped_lease(self):
+        job_id = self.submit()
+        self.node_a.claim("a-1")
+        self.expire_leases()
+
+        load = self.node_a._load
+        raced = []
+
+        def load_then_reap(*args):
+            job = load(*args)
+            if not raced:
+                # Another node reaps and reclaims between the read and the write
+                raced.append(self.node_b.reap())
+                self.node_b.claim("b-1")
+            return job
+
+        self.node_a._load = load_then_reap
+        self.assertFalse(self.node_a.heartbeat(job_id, "a-1"))
+        self.assertEqual(raced, [1])
+
+        lease = self.node_b.r.zscore(self.node_b.running_key, job_id)
+        self.assertLessEqual(lease, time.time() + LEASE)  # b-1's own lease, not extended
+        self.assertEqual(self.node_b.get(job_id)["worker"], "b-1")
+
+
+if __name__ == "__main__":
+    unittest.main()
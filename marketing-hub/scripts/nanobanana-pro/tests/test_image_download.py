@@ -0,0 +1,284 @@
+"""
+Tests for image_download.py
+Format sniffing, the validating temp-file sink and the download paths (fake page)
+
+Run:
+    python -m unittest discover -s tests     # from scripts/nanobanana-pro
+"""
+
+import os
+import sys
+import zlib
+import base64
+import struct
+import hashlib
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import image_download
+from image_download import ImageSink, sniff, write_data_uri, remove_stale_parts, download_image
+from failures import FailureKind, GenerationError
+
+
+def _png_chunk(kind: bytes, data: bytes) -> bytes:
+    return struct.pack(">I", len(data)) + kind + data + struct.pack(">I", zlib.crc32(kind + data))
+
+
+def make_png(width: int = 96, height: int = 64) -> bytes:
+    raw = b"".join(b"\0" + bytes(width * 3) for _ in range(height))
+    return (image_download.PNG_SIGNATURE
+            + _png_chunk(b"IHDR", struct.pack(">IIBBBBB", width, height, 8, 2, 0, 0, 0))
+            + _png_chunk(b"IDAT", zlib.compress(raw))
+            + _png_chunk(b"IEND", b""))
+
+
+def make_jpeg(width: int = 640, height: int = 480, app_bytes: int = 1000) -> bytes:
+    app1 = b"x" * app_bytes
+    return (b"\xff\xd8\xff\xe1" + struct.pack(">H", len(app1) + 2) + app1
+            + b"\xff\xc0" + struct.pack(">HBHHB", 17, 8, height, width, 3) + bytes(9)
+            + b"\xff\xda" + bytes(16) + b"\xff\xd9")
+
+
+class SniffTest(unittest.TestCase):
+
+    def test_formats_and_dimensions(self):
+        gif = b"GIF89a" + struct.pack("<HH", 320, 240) + bytes(10)
+        vp8l = (b"RIFF" + bytes(4) + b"WEBPVP8L" + bytes(4) + b"\x2f"
+                + struct.pack("<I", 799 | (599 << 14)) + bytes(10))
+        vp8x = (b"RIFF" + bytes(4) + b"WEBPVP8X" + bytes(8)
+                + (1023).to_bytes(3, "little") + (767).to_bytes(3, "little"))
+
+        self.assertEqual(sniff(make_png(96, 64)), ("png", 96, 64))
+        self.assertEqual(sniff(make_jpeg(640, 480)), ("jpeg", 640, 480))
+        self.assertEqual(sniff(gif), ("gif", 320, 240))
+        self.assertEqual(sniff(vp8l), ("webp", 800, 600))
+        self.assertEqual(sniff(vp8x), ("webp", 1024, 768))
+
+    def test_more_bytes_needed(self):
+        self.assertIsNone(sniff(make_png()[:16]))
+        self.assertIsNone(sniff(make_jpeg(app_bytes=1000)[:500]))
+
+    def test_not_an_image(self):
+        with self.assertRaises(ValueError):
+            sniff(b"<!DOCTYPE html><html>")
+
+
+class SinkTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.dir = Path(self.tmp.name)
+        self.output = self.dir / "out.png"
+
+    def leftovers(self):
+        return sorted(path.name for path in self.dir.iterdir() if path.name.startswith("."))
+
+
+class ImageSinkTest(SinkTestCase):
+
+    def test_commit_moves_the_file_into_place(self):
+        png = make_png()
+        with ImageSink(self.output) as sink:
+            for start in range(0, len(png), 100):
+                sink.write(png[start:start + 100])
+            self.assertFalse(self.output.exists())  # Only the temp file so far
+            info = sink.commit()
+
+        self.assertEqual(self.output.read_bytes(), png)
+        self.assertEqual(info, {"sha256": hashlib.sha256(png).hexdigest(), "bytes": len(png),
+                                "format": "png", "width": 96, "height": 64})
+        self.assertEqual(self.leftovers(), [])
+
+    def test_format_is_detected_across_chunks(self):
+        jpeg = make_jpeg(app_bytes=5000)
+        with ImageSink(self.output) as sink:
+            sink.write(jpeg[:3000])
+            self.assertIsNone(sink.info)  # Frame header not seen yet
+            sink.write(jpeg[3000:])
+            self.assertEqual(sink.commit()["format"], "jpeg")
+
+    def test_rejected_images_leave_no_temp_file_and_keep_the_output(self):
+        self.output.write_bytes(b"previous")
+        png = make_png()
+        cases = [b"<html>error page</html>", png[:len(png) // 2], make_png(16, 16)]
+        for data in cases:
+            with self.assertRaises(ValueError):
+                with ImageSink(self.output) as sink:
+                    sink.write(data)
+                    sink.commit()
+        self.assertEqual(self.output.read_bytes(), b"previous")
+        self.assertEqual(self.leftovers(), [])
+
+    def test_size_limit(self):
+        png = make_png()
+        with self.assertRaises(ValueError):
+            with ImageSink(self.output, max_bytes=len(png) - 1) as sink:
+                sink.write(png)
+        self.assertEqual(self.leftovers(), [])
+
+
+class DataUriTest(SinkTestCase):
+
+    def decode(self, uri: str, chunk_size: int = 64) -> bytes:
+        with ImageSink(self.output) as sink:
+            write_data_uri(uri, sink, chunk_size=chunk_size)
+            sink.commit()
+        return self.output.read_bytes()
+
+    def test_whitespace_is_ignored(self):
+        png = make_png()
+        encoded = base64.b64encode(png).decode()
+        wrapped = "\n".join(encoded[i:i + 76] for i in range(0, len(encoded), 76))
+        self.assertEqual(self.decode("data:image/png;base64," + wrapped), png)
+        self.assertEqual(self.decode("data:image/png;base64, " + encoded.replace("A", "A ")), png)
+
+    def test_truncated_or_plain_data_is_rejected(self):
+        encoded = base64.b64encode(make_png()).decode()
+        with self.assertRaises(ValueError):
+            self.decode("data:image/png;base64," + encoded[:-1])
+        with self.assertRaises(ValueError):
+            self.decode("data:image/svg+xml,<svg/>")
+
+
+class StaleTempFileTest(SinkTestCase):
+
+    def test_only_old_temp_files_are_removed(self):
+        old = self.dir / ".a.png.0123.part"
+        shot = self.dir / ".b.png.4567.shot.part"
+        fresh = self.dir / ".c.png.89ab.part"
+        for path in (old, shot, fresh):
+            path.write_bytes(b"x")
+        for path in (old, shot):
+            os.utime(path, (0, 0))
+        self.output.write_bytes(b"image")
+        os.utime(self.output, (0, 0))
+
+        self.assertEqual(remove_stale_parts(self.dir, max_age=60), 2)
+        self.assertEqual(self.leftovers(), [fresh.name])
+        self.assertTrue(self.output.exists())
+
+
+class FakeCDPSession:
+    """Network.loadNetworkResource + IO.read over an in-memory body"""
+
+    def __init__(self, body: bytes, status: int = 200):
+        self.body = body
+        self.status = status
+        self.offset = 0
+        self.reads = 0
+        self.closed = False
+        self.detached = False
+
+    def send(self, method, params=None):
+        if method == "Page.getFrameTree":
+            return {"frameTree": {"frame": {"id": "frame-1"}}}
+        if method == "Network.loadNetworkResource":
+            return {"resource": {"success": True, "httpStatusCode": self.status, "stream": "s1"}}
+        if method == "IO.read":
+            chunk = self.body[self.offset:self.offset + params["size"]]
+            self.offset += len(chunk)
+            self.reads += 1
+            return {"data": base64.b64encode(chunk).decode(), "base64Encoded": True,
+                    "eof": self.offset >= len(self.body)}
+        if method == "IO.close":
+            self.closed = True
+            return {}
+        raise AssertionError(method)
+
+    def detach(self):
+        self.detached = True
+
+
+class FakeContext:
+    def __init__(self, session):
+        self.session = session
+
+    def new_cdp_session(self, page):
+        return self.session
+
+
+class FakeResponse:
+    def __init__(self, body):
+        self._body = body
+
+    def body(self):
+        return self._body
+
+
+class FakeRequest:
+    def __init__(self, body):
+        self.body = body
+        self.calls = 0
+
+    def get(self, url):
+        self.calls += 1
+        return FakeResponse(self.body)
+
+
+class FakePage:
+    def __init__(self, body: bytes, status: int = 200):
+        self.context = FakeContext(FakeCDPSession(body, status))
+        self.request = FakeRequest(body)
+
+    def evaluate(self, script, arg=None):
+        pass
+
+
+class FakeImage:
+    """<img> whose in-page fetch fails, as for a cross-origin image"""
+
+    def __init__(self, src: str, screenshot: bytes = None):
+        self.src = src
+        self.shot = screenshot
+
+    def evaluate(self, script, arg=None):
+        if "currentSrc" in script and arg is None:
+            return self.src
+        raise Exception("TypeError: Failed to fetch")
+
+    def screenshot(self, path, type=None):
+        if self.shot is None:
+            raise Exception("Element is not attached to the DOM")
+        Path(path).write_bytes(self.shot)
+
+
+class DownloadImageTest(SinkTestCase):
+
+    def test_cross_origin_url_is_streamed_over_cdp(self):
+        png = make_png(200, 200)
+        page = FakePage(png)
+        saved = download_image(page, FakeImage("https://lh3.googleusercontent.com/x"), str(self.output),
+                               chunk_size=64)
+
+        session = page.context.session
+        self.assertEqual(saved["method"], "cdp")
+        self.assertEqual(self.output.read_bytes(), png)
+        self.assertGreater(session.reads, 1)  # Chunked, not one full read
+        self.assertTrue(session.closed and session.detached)
+        self.assertEqual(page.request.calls, 0)
+
+    def test_full_read_is_only_a_fallback(self):
+        png = make_png()
+        page = FakePage(png, status=403)
+        saved = download_image(page, FakeImage("https://lh3.googleusercontent.com/x"), str(self.output))
+        self.assertEqual(saved["method"], "request")
+        self.assertEqual(page.request.calls, 1)
+
+    def test_screenshot_temp_file_is_removed(self):
+        png = make_png()
+        saved = download_image(FakePage(b""), FakeImage("blob:https://gemini/1", png), str(self.output))
+        self.assertEqual(saved["method"], "screenshot")
+        self.assertEqual(self.leftovers(), [])
+
+        with self.assertRaises(GenerationError) as raised:
+            download_image(FakePage(b""), FakeImage("blob:https://gemini/1"), str(self.dir / "b.png"))
+        self.assertEqual(raised.exception.kind, FailureKind.DOWNLOAD)
+        self.assertEqual(self.leftovers(), [])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Tests for image_store.py
+Retention: live filenames keep their image, periodic passes, schema upgrade
+
+Run:
+    python -m unittest discover -s tests     # from scripts/nanobanana-pro
+"""
+
+import sys
+import time
+import sqlite3
+import tempfile
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from image_store import ImageStore
+
+DAY = 86400
+
+
+class ImageStoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        root = Path(self.tmp.name)
+        self.output = root / "out"
+        self.db_path = root / "store.db"
+        self.store = self.open()
+        self.addCleanup(self.store.close)
+
+    def open(self):
+        return ImageStore(self.db_path, self.output, self.output / ".blobs")
+
+    def add(self, filename: str, data: bytes, age: float = 0) -> str:
+        src = self.output / f"tmp-{filename}"
+        src.write_bytes(data)
+        digest = self.store.put(str(src), filename)
+        past = time.time() - age
+        self.store.db.execute("UPDATE blobs SET created_at = ?, last_served = ? WHERE digest = ?",
+                              (past, past, digest))
+        self.store.db.execute("UPDATE aliases SET created_at = ?, last_served = ? WHERE digest = ?",
+                              (past, past, digest))
+        return digest
+
+    def test_evicts_least_recently_served_first(self):
+        self.add("old.png", b"a" * 100, age=3 * DAY)
+        self.add("newer.png", b"b" * 100, age=2 * DAY)
+
+        result = self.store.enforce(max_bytes=150, alias_retention=DAY)
+        self.assertEqual((result["evicted"], result["total_bytes"]), (1, 100))
+        self.assertFalse((self.output / "old.png").exists())
+        self.assertTrue((self.output / "newer.png").exists())
+
+    def test_live_filename_keeps_its_image_over_budget(self):
+        digest = self.add("old.png", b"a" * 100, age=3 * DAY)
+        self.store.alias(digest, "handed-out.png")  # Reused for a new caller just now
+        self.add("other.png", b"b" * 100, age=2 * DAY)
+
+        result = self.store.enforce(max_bytes=50, grace=0, alias_retention=DAY)
+        self.assertEqual(result["evicted"], 1)
+        self.assertEqual(result["total_bytes"], 100)  # Stays over budget
+        self.assertTrue((self.output / "old.png").exists())
+        self.assertTrue((self.output / "handed-out.png").exists())
+        self.assertFalse((self.output / "other.png").exists())
+
+    def test_touch_renews_the_filename(self):
+        self.add("served.png", b"a" * 100, age=3 * DAY)
+        self.assertTrue(self.store.touch("served.png"))
+        self.assertEqual(self.store.enforce(max_bytes=0, grace=0, alias_retention=DAY)["evicted"], 0)
+        self.assertFalse(self.store.touch("unknown.png"))
+
+    def test_enforce_if_due_runs_once_per_interval(self):
+        self.add("old.png", b"a" * 100, age=3 * DAY)
+        self.assertIsNotNone(self.store.enforce_if_due(interval=3600))
+        with self.open() as other:  # Another process
+            self.assertIsNone(other.enforce_if_due(interval=3600))
+        self.assertIsNotNone(self.store.enforce_if_due(interval=0))
+
+    def test_existing_aliases_get_last_served(self):
+        self.store.close()
+        db = sqlite3.connect(str(self.db_path))
+        db.executescript("DROP TABLE aliases; CREATE TABLE aliases "
+                         "(filename TEXT PRIMARY KEY, digest TEXT NOT NULL, created_at REAL NOT NULL);"
+                         "INSERT INTO aliases VALUES ('x.png', 'abc', 123.0);")
+        db.close()
+
+        self.store = self.open()
+        self.addCleanup(self.store.close)
+        row = self.store.db.execute("SELECT last_served FROM aliases WHERE filename = 'x.png'").fetchone()
+        self.assertEqual(row[0], 123.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
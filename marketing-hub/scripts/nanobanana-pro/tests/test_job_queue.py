@@ -0,0 +1,167 @@
+"""
+Tests for job_queue.py
+Schedule simulation, admission control, lane order and reaping of dead submitters
+
+Run:
+    python -m unittest discover -s tests     # from scripts/nanobanana-pro
+"""
+
+import os
+import sys
+import tempfile
+import unittest
+import subprocess
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from job_queue import (
+    LANES,
+    QUEUED,
+    RUNNING,
+    FAILED,
+    EXPIRED,
+    ABANDONED,
+    JobQueue,
+    estimate_starts,
+    check_admission
+)
+
+NOW = 1000.0
+SERVICE = 60.0
+
+
+def job(job_id, lane="interactive", deadline=3600, created_at=NOW):
+    return {"id": job_id, "lane": LANES[lane], "deadline": NOW + deadline, "created_at": created_at}
+
+
+def dead_pid() -> int:
+    process = subprocess.Popen([sys.executable, "-c", "pass"])
+    process.wait()
+    return process.pid
+
+
+class EstimateStartsTest(unittest.TestCase):
+
+    def test_lanes_first_then_earliest_deadline(self):
+        queued = [job("bulk-soon", "bulk", deadline=100),
+                  job("late", deadline=900),
+                  job("soon", deadline=300)]
+        starts = estimate_starts(NOW, SERVICE, 1, [], queued)
+        self.assertEqual(sorted(starts, key=starts.get), ["soon", "late", "bulk-soon"])
+        self.assertEqual(starts["soon"], NOW)
+        self.assertEqual(starts["bulk-soon"], NOW + 2 * SERVICE)
+
+    def test_running_jobs_hold_their_slots(self):
+        # One slot frees in 20 s (started 40 s ago), the other is idle
+        starts = estimate_starts(NOW, SERVICE, 2, [NOW - 40], [job("a"), job("b", deadline=7200)])
+        self.assertEqual(starts, {"a": NOW, "b": NOW + 20})
+
+    def test_no_slots(self):
+        self.assertEqual(estimate_starts(NOW, SERVICE, 0, [], [job("a")]), {"a": float("inf")})
+
+
+class CheckAdmissionTest(unittest.TestCase):
+
+    def test_admitted_with_estimated_start(self):
+        start, reason = check_admission(NOW, SERVICE, 1, [NOW - 30], [job("a")], job("new"))
+        self.assertIsNone(reason)
+        self.assertEqual(start, NOW + 30 + SERVICE)
+
+    def test_rejected_when_it_cannot_finish_in_time(self):
+        queued = [job(f"q{i}") for i in range(3)]
+        start, reason = check_admission(NOW, SERVICE, 1, [], queued, job("new", "bulk", deadline=200))
+        self.assertEqual(start, NOW + 3 * SERVICE)
+        self.assertIn("estimated start in 180s", reason)
+
+    def test_rejected_when_it_would_break_an_admitted_job(self):
+        # "new" would run first (earlier deadline) and push "tight" past its deadline
+        tight = job("tight", deadline=2 * SERVICE + 5)
+        new = job("new", deadline=2 * SERVICE + 1)
+        _, reason = check_admission(NOW, SERVICE, 1, [NOW], [tight], new)
+        self.assertEqual(reason, "would push admitted jobs past their deadlines")
+
+    def test_lower_lane_promises_are_not_protected(self):
+        # Interactive jobs may delay bulk ones past their deadlines
+        bulk = job("bulk", "bulk", deadline=2 * SERVICE + 5)
+        _, reason = check_admission(NOW, SERVICE, 1, [NOW], [bulk], job("new", deadline=3 * SERVICE))
+        self.assertIsNone(reason)
+
+
+class JobQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.db_path = Path(self.tmp.name) / "queue.db"
+        self.queue = JobQueue(self.db_path, slots=1)
+        self.addCleanup(self.queue.close)
+
+    def submit(self, prompt, **kwargs):
+        kwargs.setdefault("deadline", 3600)
+        submitted = self.queue.submit(prompt, **kwargs)
+        self.assertTrue(submitted["admitted"], submitted["reason"])
+        return submitted["job_id"]
+
+    def test_claims_interactive_before_bulk(self):
+        bulk = self.submit("bulk", lane="bulk", deadline=600)
+        late = self.submit("late", deadline=3000)
+        soon = self.submit("soon", deadline=1200)
+
+        order = []
+        for _ in range(3):
+            claimed = self.queue.claim()
+            order.append(claimed["id"])
+            self.queue.finish(claimed["id"], {"success": True})
+        self.assertEqual(order, [soon, late, bulk])
+
+    def test_hopeless_job_is_rejected(self):
+        submitted = self.queue.submit("x", deadline=30)  # Default service time is longer
+        self.assertFalse(submitted["admitted"])
+        self.assertEqual(self.queue.get(submitted["job_id"])["state"], "rejected")
+
+    def test_dead_owners_jobs_are_reaped(self):
+        running = self.submit("running")
+        self.assertEqual(self.queue.claim()["id"], running)
+        queued = self.submit("queued")
+        self.queue.db.execute("UPDATE jobs SET owner_pid = ? WHERE id IN (?, ?)",
+                              (dead_pid(), running, queued))
+        alive = self.submit("alive", owner_pid=os.getpid())
+
+        self.assertEqual(self.queue.claim()["id"], alive)  # Reaped first, slot freed
+        self.assertEqual(self.queue.get(queued)["state"], ABANDONED)
+        self.assertEqual(self.queue.get(running)["state"], FAILED)
+
+    def test_jobs_that_can_no_longer_make_it_expire(self):
+        job_id = self.submit("x", deadline=3600)
+        self.queue.db.execute("UPDATE jobs SET deadline = ? WHERE id = ?", (NOW, job_id))
+        self.assertIsNone(self.queue.claim())
+        self.assertEqual(self.queue.get(job_id)["state"], EXPIRED)
+
+    def test_stats_with_a_job_submitted_meanwhile(self):
+        self.submit("first")
+        snapshot = self.queue._snapshot
+
+        def snapshot_then_submit():
+            result = snapshot()
+            with JobQueue(self.db_path, slots=1) as other:
+                other.submit("meanwhile", deadline=3600)
+            return result
+
+        self.queue._snapshot = snapshot_then_submit
+        stats = self.queue.stats()
+        self.assertEqual(stats["max_wait_by_lane"], {"interactive": 0.0})
+        self.assertEqual(stats["states"], {QUEUED: 1})
+        self.assertEqual(len([j for j in self.queue.active() if j["state"] == QUEUED]), 2)
+
+    def test_running_slot_counts_in_stats(self):
+        self.submit("a")
+        self.submit("b")
+        self.queue.claim()
+        stats = self.queue.stats()
+        self.assertEqual(stats["states"], {RUNNING: 1, QUEUED: 1})
+        self.assertGreater(stats["max_wait_by_lane"]["interactive"], 0)
+
+
+if __name__ == "__main__":
+    unittest.main()
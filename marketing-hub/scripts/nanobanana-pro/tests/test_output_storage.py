@@ -0,0 +1,281 @@
+"""
+Tests for output_storage.py
+Uploads against an injected in-memory S3 client (MinIO-style stand-in)
+
+Run:
+    python -m unittest discover -s tests     # from scripts/nanobanana-pro
+"""
+
+import sys
+import json
+import tempfile
+import threading
+import unittest
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+import output_storage
+from output_storage import S3Storage, Uploader
+
+
+class NotFound(Exception):
+    """What botocore raises for a missing object"""
+
+    def __init__(self):
+        super().__init__("An error occurred (404) when calling the HeadObject operation: Not Found")
+        self.response = {"Error": {"Code": "404"}}
+
+
+class FakeS3:
+    """In-memory S3 API subset used by S3Storage; fail_puts makes the next N writes fail"""
+
+    def __init__(self, fail_puts: int = 0):
+        self.objects = {}  # (bucket, key) -> {"body", "content_type"}
+        self.uploads = {}  # upload id -> {"bucket", "key", "content_type", "parts"}
+        self.fail_puts = fail_puts
+        self.calls = []
+        self.lock = threading.Lock()
+
+    def _maybe_fail(self, operation: str):
+        with self.lock:
+            self.calls.append(operation)
+            if self.fail_puts:
+                self.fail_puts -= 1
+                raise ConnectionError(f"{operation}: connection reset by peer")
+
+    def head_object(self, Bucket, Key):
+        if (Bucket, Key) not in self.objects:
+            raise NotFound()
+        return {"ContentLength": len(self.objects[(Bucket, Key)]["body"])}
+
+    def put_object(self, Bucket, Key, Body, ContentType):
+        self._maybe_fail("put_object")
+        self.objects[(Bucket, Key)] = {"body": Body.read(), "content_type": ContentType}
+
+    def create_multipart_upload(self, Bucket, Key, ContentType):
+        upload_id = f"upload-{len(self.uploads) + 1}"
+        self.uploads[upload_id] = {"bucket": Bucket, "key": Key,
+                                   "content_type": ContentType, "parts": {}}
+        return {"UploadId": upload_id}
+
+    def upload_part(self, Bucket, Key, PartNumber, UploadId, Body):
+        self._maybe_fail("upload_part")
+        self.uploads[UploadId]["parts"][PartNumber] = Body
+        return {"ETag": f'"etag-{PartNumber}"'}
+
+    def complete_multipart_upload(self, Bucket, Key, UploadId, MultipartUpload):
+        upload = self.uploads.pop(UploadId)
+        numbers = [part["PartNumber"] for part in MultipartUpload["Parts"]]
+        if numbers != sorted(upload["parts"]):
+            raise ValueError(f"Parts {numbers} do not match uploaded {sorted(upload['parts'])}")
+        self.objects[(Bucket, Key)] = {
+            "body": b"".join(upload["parts"][n] for n in numbers),
+            "content_type": upload["content_type"]
+        }
+
+    def abort_multipart_upload(self, Bucket, Key, UploadId):
+        self.uploads.pop(UploadId, None)
+
+
+class UploadTestCase(unittest.TestCase):
+
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmp.cleanup)
+        self.root = Path(self.tmp.name)
+        self.spool = self.root / "spool"
+        # No real backoff between retries
+        patcher = mock.patch.object(output_storage, "MAX_BACKOFF", 0)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def image(self, name: str, size: int) -> Path:
+        path = self.root / name
+        path.write_bytes(bytes(i % 251 for i in range(size)))
+        return path
+
+    def storage(self, client: FakeS3, **kwargs) -> S3Storage:
+        return S3Storage(bucket="images", client=client, prefix="ai-generated/",
+                         endpoint_url="http://minio:9000", **kwargs)
+
+    def uploader(self, storage: S3Storage, **kwargs) -> Uploader:
+        uploader = Uploader(storage, spool_dir=self.spool, workers=2, **kwargs)
+        self.addCleanup(uploader.close, 5)
+        return uploader
+
+    def spooled(self):
+        return sorted(self.spool.glob("*.json"))
+
+
+class SinglePartUploadTest(UploadTestCase):
+
+    def test_small_file_is_put_in_one_request(self):
+        client = FakeS3()
+        path = self.image("a.png", 1000)
+        uploader = self.uploader(self.storage(client, multipart_threshold=4096))
+
+        self.assertTrue(uploader.submit(path, "abc.png").result(timeout=5))
+
+        stored = client.objects[("images", "ai-generated/abc.png")]
+        self.assertEqual(stored["body"], path.read_bytes())
+        self.assertEqual(stored["content_type"], "image/png")
+        self.assertEqual(client.calls, ["put_object"])
+        self.assertEqual(self.spooled(), [])
+        self.assertEqual(uploader.stats()["uploaded"], 1)
+
+    def test_existing_object_is_not_uploaded_again(self):
+        client = FakeS3()
+        path = self.image("a.png", 1000)
+        client.objects[("images", "ai-generated/abc.png")] = {"body": b"x", "content_type": "image/png"}
+        uploader = self.uploader(self.storage(client))
+
+        self.assertTrue(uploader.submit(path, "abc.png").result(timeout=5))
+        self.assertEqual(client.calls, [])
+        self.assertEqual(uploader.stats()["skipped"], 1)
+
+    def test_url_uses_endpoint_and_bucket(self):
+        storage = self.storage(FakeS3())
+        self.assertEqual(storage.url("abc.png"), "http://minio:9000/images/ai-generated/abc.png")
+
+
+class MultipartUploadTest(UploadTestCase):
+
+    def test_large_file_is_uploaded_in_parts(self):
+        client = FakeS3()
+        path = self.image("big.png", 10_000)
+        uploader = self.uploader(self.storage(client, multipart_threshold=4096, part_size=4096))
+
+        self.assertTrue(uploader.submit(path, "big.png").result(timeout=5))
+
+        stored = client.objects[("images", "ai-generated/big.png")]
+        self.assertEqual(stored["body"], path.read_bytes())
+        self.assertEqual(client.calls, ["upload_part"] * 3)
+        self.assertEqual(client.uploads, {})
+
+    def test_failed_part_aborts_the_multipart_upload(self):
+        client = FakeS3(fail_puts=1)
+        path = self.image("big.png", 10_000)
+        storage = self.storage(client, multipart_threshold=4096, part_size=4096)
+
+        with self.assertRaises(ConnectionError):
+            storage.upload(path, "big.png")
+        self.assertEqual(client.uploads, {})  # Aborted, no orphaned parts
+        self.assertNotIn(("images", "ai-generated/big.png"), client.objects)
+
+
+class RetryTest(UploadTestCase):
+
+    def test_transient_failures_are_retried(self):
+        client = FakeS3(fail_puts=2)
+        path = self.image("a.png", 1000)
+        uploader = self.uploader(self.storage(client), retries=3)
+
+        self.assertTrue(uploader.submit(path, "abc.png").result(timeout=5))
+        self.assertEqual(client.calls, ["put_object"] * 3)
+        self.assertIn(("images", "ai-generated/abc.png"), client.objects)
+        self.assertEqual(self.spooled(), [])
+
+    def test_out_of_retries_waits_in_the_spool(self):
+        client = FakeS3(fail_puts=5)
+        path = self.image("a.png", 1000)
+        uploader = self.uploader(self.storage(client), retries=2, retry_after=300)
+
+        self.assertFalse(uploader.submit(path, "abc.png").result(timeout=5))
+
+        [entry] = self.spooled()
+        job = json.loads(entry.read_text())
+        self.assertEqual(job["key"], "abc.png")
+        self.assertEqual(job["attempts"], 2)
+        self.assertGreater(job["next_attempt"], job["created_at"])
+        self.assertEqual(uploader.resume(), 0)  # Not due yet
+
+
+class SpoolResumeTest(UploadTestCase):
+
+    def test_upload_left_by_an_exited_process_is_resumed(self):
+        path = self.image("a.png", 1000)
+        self.spool.mkdir(parents=True)
+        (self.spool / "1700000000.000000-deadbeef.json").write_text(json.dumps({
+            "path": str(path), "key": "abc.png", "content_type": None,
+            "created_at": 1700000000, "attempts": 0, "next_attempt": 0}))
+
+        client = FakeS3()
+        uploader = self.uploader(self.storage(client))
+        self.assertEqual(uploader.resume(), 1)
+        self.assertTrue(uploader.drain(timeout=5))
+
+        self.assertEqual(client.objects[("images", "ai-generated/abc.png")]["body"], path.read_bytes())
+        self.assertEqual(self.spooled(), [])
+
+    def test_failed_upload_is_resumed_once_due(self):
+        path = self.image("a.png", 1000)
+        client = FakeS3(fail_puts=1)
+        first = self.uploader(self.storage(client), retries=1, retry_after=0)
+        self.assertFalse(first.submit(path, "abc.png").result(timeout=5))
+        self.assertEqual(len(self.spooled()), 1)
+
+        # Another process (the supervisor) picks it up
+        second = self.uploader(self.storage(client), retries=1)
+        self.assertEqual(second.resume(), 1)
+        self.assertTrue(second.drain(timeout=5))
+        self.assertIn(("images", "ai-generated/abc.png"), client.objects)
+        self.assertEqual(self.spooled(), [])
+
+    def test_deleted_file_is_dropped_from_the_spool(self):
+        path = self.image("a.png", 1000)
+        uploader = self.uploader(self.storage(FakeS3(fail_puts=1)), retries=1, retry_after=0)
+        self.assertFalse(uploader.submit(path, "abc.png").result(timeout=5))
+        path.unlink()
+
+        self.assertEqual(uploader.resume(), 1)
+        self.assertTrue(uploader.drain(timeout=5))
+        self.assertEqual(self.spooled(), [])
+
+
+class PublishTest(UploadTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.client = FakeS3()
+        storage = self.storage(self.client)
+        uploader = self.uploader(storage)
+        for name, value in (("_storage", storage), ("_uploader", uploader), ("_uploads", {})):
+            patcher = mock.patch.object(output_storage, name, value)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def test_url_works_once_wait_uploaded_returns(self):
+        path = self.image("a.png", 1000)
+        url = output_storage.publish(path, "a.png", digest="f00d")
+
+        self.assertEqual(url, "http://minio:9000/images/ai-generated/f00d.png")
+        self.assertTrue(output_storage.wait_uploaded(url, timeout=5))
+        self.assertIn(("images", "ai-generated/f00d.png"), self.client.objects)
+        self.assertIsNone(output_storage.pending_upload(url))
+
+    def test_sniffed_format_sets_extension_and_content_type(self):
+        path = self.image("a.jpg", 1000)
+        url = output_storage.publish(path, "a.png", digest="f00d", image_format="jpeg")
+
+        self.assertEqual(url, "http://minio:9000/images/ai-generated/f00d.jpg")
+        self.assertTrue(output_storage.wait_uploaded(url, timeout=5))
+        self.assertEqual(self.client.objects[("images", "ai-generated/f00d.jpg")]["content_type"],
+                         "image/jpeg")
+
+    def test_failed_upload_is_reported_to_the_waiter(self):
+        self.client.fail_puts = 100
+        output_storage._uploader.retries = 1
+        path = self.image("a.png", 1000)
+        url = output_storage.publish(path, "a.png", digest="f00d")
+
+        self.assertFalse(output_storage.wait_uploaded(url, timeout=5))
+
+    def test_local_urls_need_no_waiting(self):
+        self.assertTrue(output_storage.wait_uploaded("/uploads/ai-generated/a.png", timeout=0))
+        self.assertTrue(output_storage.wait_uploaded(None, timeout=0))
+
+
+if __name__ == "__main__":
+    unittest.main()
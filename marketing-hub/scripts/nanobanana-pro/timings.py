@@ -0,0 +1,90 @@
+"""
+Job timing log for Gemini Image Generator
+Append-only JSONL of per-job latencies, used for hedging and throughput estimates
+"""
+
+import os
+import json
+import time
+from pathlib import Path
+from typing import List, Optional
+
+from config import TIMINGS_FILE, TIMINGS_WINDOW
+
+# Rewrite the log down to the newest entries once it grows past this size
+MAX_LOG_BYTES = 1024 * 1024
+# Bytes read from the end of the log per recent() call, per requested entry
+TAIL_BYTES_PER_ENTRY = 512
+
+
+def percentile(values: List[float], pct: float) -> Optional[float]:
+    """Nearest-rank percentile of values (pct in 0-100), or None if empty."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    rank = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[rank]
+
+
+class TimingLog:
+    """Recent job timings shared by all generator processes"""
+
+    def __init__(self, path: Path = TIMINGS_FILE):
+        self.path = Path(path)
+
+    def record(self, **fields):
+        """
+        Append one job record.
+
+        Typical fields: latency (seconds from send to image), success,
+        failure, final (failed attempt was the job's last), hedged,
+        hedge_won, attempts.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {"time": round(time.time(), 3), **fields}
+        line = json.dumps(entry, ensure_ascii=False) + "\n"
+
+        # A single O_APPEND write keeps concurrent writers from interleaving lines
+        fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        try:
+            os.write(fd, line.encode("utf-8"))
+        finally:
+            os.close(fd)
+
+        if self.path.stat().st_size > MAX_LOG_BYTES:
+            self._truncate()
+
+    def recent(self, n: int = TIMINGS_WINDOW) -> List[dict]:
+        """Return up to n newest records, oldest first, without reading the whole log."""
+        if not self.path.exists():
+            return []
+
+        with open(self.path, 'rb') as f:
+            f.seek(0, os.SEEK_END)
+            size = f.tell()
+            f.seek(max(0, size - n * TAIL_BYTES_PER_ENTRY))
+            data = f.read()
+
+        lines = data.decode("utf-8", errors="ignore").splitlines()
+        if len(data) < size:
+            lines = lines[1:]  # First line is probably cut off
+
+        records = []
+        for line in lines[-n:]:
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                continue
+        return records
+
+    def latencies(self, n: int = TIMINGS_WINDOW) -> List[float]:
+        """Latencies of recent jobs that got as far as waiting for an image."""
+        return [r["latency"] for r in self.recent(n) if r.get("latency") is not None]
+
+    def _truncate(self):
+        keep = self.recent(TIMINGS_WINDOW * 2)
+        tmp = self.path.with_suffix(".tmp")
+        with open(tmp, 'w') as f:
+            for record in keep:
+                f.write(json.dumps(record, ensure_ascii=False) + "\n")
+        os.replace(tmp, self.path)
@@ -8,7 +8,7 @@ import { join } from "path";
  */
 export async function POST(request: NextRequest) {
   try {
-    const { prompt } = await request.json();
+    const { prompt, lane } = await request.json();
 
     if (!prompt || typeof prompt !== "string") {
       return NextResponse.json(
@@ -18,7 +18,13 @@ export async function POST(request: NextRequest) {
     }
 
     // NanoBanana Pro（Pythonスクリプト）で画像生成
-    const result = await generateWithNanoBanana(prompt);
+    // エディタからの対話的リクエストが既定、キャンペーン一括生成は "bulk" レーン
+    // クライアントが切断した場合はrequest.signalで生成をキャンセルし、ブラウザのタブを解放する
+    const result = await generateWithNanoBanana(
+      prompt,
+      lane === "bulk" ? "bulk" : "interactive",
+      request.signal
+    );
 
     if (result.success) {
       return NextResponse.json(result);
@@ -34,11 +40,16 @@ export async function POST(request: NextRequest) {
       }, { status: 401 });
     }
 
-    // その他のエラー
+    // その他のエラー（拒否はプロンプト起因なので422、サーキットオープン中・混雑で期限内に処理できない場合・アップロード未完了は503）
+    const status = result.failure === "declined" ? 422
+      : result.failure === "circuit_open" || result.failure === "rejected" || result.failure === "upload" ? 503
+      : 500;
     return NextResponse.json({
       success: false,
-      error: result.error || "画像生成に失敗しました"
-    }, { status: 500 });
+      error: result.error || "画像生成に失敗しました",
+      failure: result.failure,
+      retry_after: result.retry_after
+    }, { status });
 
   } catch (error) {
     console.error("AI image generation error:", error);
@@ -52,21 +63,29 @@ export async function POST(request: NextRequest) {
 /**
  * NanoBanana Proで画像生成
  */
-async function generateWithNanoBanana(prompt: string): Promise<{
+async function generateWithNanoBanana(
+  prompt: string,
+  lane: "interactive" | "bulk",
+  signal?: AbortSignal
+): Promise<{
   success: boolean;
   url?: string;
   filename?: string;
   error?: string;
+  failure?: string;
+  retry_after?: number;
   auth_required?: boolean;
 }> {
   return new Promise((resolve) => {
     const scriptPath = join(process.cwd(), "scripts", "nanobanana-pro", "generate.py");
 
-    // Python実行
+    // Python実行（期限はタイムアウト（5分）より少し前。待ち行列で間に合わないジョブは即座に拒否される）
     const pythonProcess = spawn("python3", [
       scriptPath,
       "--prompt", prompt,
-      "--timeout", "180"
+      "--timeout", "180",
+      "--lane", lane,
+      "--deadline", "290"
     ], {
       cwd: join(process.cwd(), "scripts", "nanobanana-pro"),
       env: { ...process.env, PYTHONIOENCODING: "utf-8" }
@@ -77,6 +96,17 @@ async function generateWithNanoBanana(prompt: string): Promise<{
 
     pythonProcess.stdout.on("data", (data) => {
       stdout += data.toString();
+
+      // 結果のJSON行が届いた時点で応答する（S3等へのアップロード完了後に出力されるため、URLはすぐに利用できる）
+      const jsonLine = stdout.split("\n").slice(0, -1).reverse().find(line => line.startsWith("{"));
+      if (jsonLine) {
+        try {
+          signal?.removeEventListener("abort", onAbort);
+          resolve(JSON.parse(jsonLine));
+        } catch (parseError) {
+          console.error("JSON parse error:", parseError);
+        }
+      }
     });
 
     pythonProcess.stderr.on("data", (data) => {
@@ -84,20 +114,40 @@ async function generateWithNanoBanana(prompt: string): Promise<{
       console.log("NanoBanana Pro:", data.toString());
     });
 
-    pythonProcess.on("close", (code) => {
-      if (code === 0) {
-        try {
-          // 最後のJSONラインを探す
-          const lines = stdout.trim().split("\n");
-          const jsonLine = lines.reverse().find(line => line.startsWith("{"));
-          if (jsonLine) {
-            const result = JSON.parse(jsonLine);
-            resolve(result);
-            return;
-          }
-        } catch (parseError) {
-          console.error("JSON parse error:", parseError);
+    // SIGTERMでPython側が協調的にキャンセル（Geminiの応答停止・タブ解放）する。応答がなければSIGKILL
+    let killTimer: ReturnType<typeof setTimeout> | undefined;
+    const cancel = () => {
+      if (pythonProcess.exitCode !== null || pythonProcess.signalCode !== null) return;
+      pythonProcess.kill("SIGTERM");
+      if (!killTimer) killTimer = setTimeout(() => pythonProcess.kill("SIGKILL"), 15 * 1000);
+    };
+
+    const onAbort = () => {
+      console.log("NanoBanana Pro: client disconnected, cancelling generation");
+      cancel();
+    };
+    if (signal?.aborted) {
+      onAbort();
+    } else {
+      signal?.addEventListener("abort", onAbort, { once: true });
+    }
+
+    pythonProcess.on("close", () => {
+      clearTimeout(timeoutTimer);
+      clearTimeout(killTimer);
+      signal?.removeEventListener("abort", onAbort);
+      // 失敗時もJSONに失敗分類（failure）が含まれるため、終了コードに関係なく解析する
+      try {
+        // 最後のJSONラインを探す
+        const lines = stdout.trim().split("\n");
+        const jsonLine = lines.reverse().find(line => line.startsWith("{"));
+        if (jsonLine) {
+          const result = JSON.parse(jsonLine);
+          resolve(result);
+          return;
         }
+      } catch (parseError) {
+        console.error("JSON parse error:", parseError);
       }
 
       // エラー時
@@ -124,8 +174,8 @@ async function generateWithNanoBanana(prompt: string): Promise<{
     });
 
     // タイムアウト（5分）
-    setTimeout(() => {
-      pythonProcess.kill();
+    const timeoutTimer = setTimeout(() => {
+      cancel();
       resolve({
         success: false,
         error: "画像生成がタイムアウトしました（5分）"